@@ -1,64 +1,211 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify, g, Response, has_request_context
 #Flask: The main Flask class that creates your web app object (it’s the “engine” of the app).
 #render_template: Lets you render HTML files (like index.html) stored in your templates/ folder, and dynamically insert variables into them
 #request: Lets you access data sent from the user — like form inputs or URL parameters (POST or GET requests)
+#jsonify: Turns a Python dict into a JSON response (used by the /api endpoints)
+#g: Per-request storage (used to remember that the request holds a concurrency slot)
+#Response: A raw response (used for the plain text /metrics page)
 
-import joblib
-import requests
 import re
 import os
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+#Shared pooled HTTP client (keep-alive connections, timeouts, retries with backoff)
+from http_client import client
+
+#Trained model (compact export or versioned bundle written by the trainer)
+import inference_model
+from micro_batcher import MicroBatcher
+
+#Precision / recall / F1 of a prediction against the MangaDex tags
+import calibration
+
+#TTL/LRU caches for MangaDex metadata and predictions
+from cache import make_cache
+
+#Background cover downloads with a bounded, LRU-evicted folder
+import cover_store
+import similarity_index
+
+#Stage timers, counters and the optional slow request profiler, served on /metrics
+import metrics
+
+#Log lines instead of prints, so they carry a time and a level (MANGA_LOG_LEVEL=DEBUG for more)
+logging.basicConfig(level=os.environ.get("MANGA_LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("manga.app")
+
+#Flask runs an async view on an event loop thread of its own, not on the thread that took the request:
+#while the view runs, that thread is sampled into the request's profile too (see start_request_timer)
+class ProfiledFlask(Flask):
+    def ensure_sync(self, func):
+        if not inspect.iscoroutinefunction(func):
+            return func
+
+        async def view(*args, **kwargs):
+            profile = g.get("profile")
+            if profile is None:
+                return await func(*args, **kwargs)
+            with metrics.PROFILER.attach(profile):
+                return await func(*args, **kwargs)
+        return self.async_to_sync(view)
 
 #This line creates your Flask application object — the core of the app.
 #The __name__ argument tells Flask where to find resources (templates, static files, etc.).
 #If you’re running app.py directly, __name__ will be "__main__".
 #If it’s imported, Flask still knows where to look for templates.
-app = Flask(__name__)
+app = ProfiledFlask(__name__)
 
 # Load models
-tfidf = joblib.load("models/tfidf_vectorizer.pkl")
-mlb = joblib.load("models/genre_binarizer.pkl")
-clf = joblib.load("models/genre_classifier.pkl")
+#load_model() picks the compact export of the current model bundle: plain NumPy arrays that are memory mapped,
+#so start-up takes milliseconds and forked workers share the same memory. It falls back to the pickled bundle
+#(or the three legacy pickles) when there is no up-to-date export. See inference_model.py.
+load_started = time.perf_counter()
+model = inference_model.load_model()
+load_seconds = time.perf_counter() - load_started
+metrics.MODEL_LOAD_SECONDS.set(round(load_seconds, 4), version=str(model.version), kind=type(model).__name__)
+logger.info("Loaded %s %s in %.1f ms", type(model).__name__, model.version, load_seconds * 1000)
+
+#Predicts a list of texts, timing the vectorize and predict stages separately
+def predict_texts(texts):
+    with metrics.STAGE_SECONDS.time(stage="vectorize"):
+        X = model.vectorize(texts)
+    with metrics.STAGE_SECONDS.time(stage="predict"):
+        return model.predict_vectors(X)
+
+#Single predictions from concurrent requests are gathered into small batches and predicted together
+#(batch size / wait: MANGA_MICROBATCH_SIZE and MANGA_MICROBATCH_WAIT_MS)
+batcher = MicroBatcher(predict_texts)
 
 # Predict genres from text
 def predict_genres_from_text(title, description):
     text = title + " " + description
 
-    #This line converts the raw text into a numerical vector that your model understands
-    X = tfidf.transform([text])
-
-    #This uses your trained classifier model (clf) to predict genres.
-    y_pred = clf.predict(X)
-
-    # mlb is your MultiLabelBinarizer used during training. It knows how to map the binary output (1s and 0s) back to the genre names
-    genres = mlb.inverse_transform(y_pred)
-
-    #return the first element [0] to get just the tuple of genre names.
-    return genres[0]
-
-# Accuracy calculation
-def calculate_accuracy(predicted, actual):
-    """
-    Compute the accuracy of predicted genres against actual genres.
-
-    Accuracy = fraction of actual genres correctly predicted (recall).
-
-    Both predicted and actual can be lists or tuples.
-    """
-
-    # Ensure both are sets (removes duplicates and handles tuples/lists)
-    predicted_set = set(predicted)
-    actual_set = set(actual)
-
-    if not actual_set:
-        return 0  # Avoid division by zero
-
-    # Count overlapping genres
-    overlap = len(predicted_set & actual_set)
-
-    # Accuracy as fraction of actual genres
-    accuracy = overlap / len(actual_set)
-
-    return accuracy
+    #The model converts the raw text into a numerical vector and predicts genres from it,
+    #then maps the binary output (1s and 0s) back to the genre names.
+    #The batcher predicts it together with the other requests arriving at the same moment (see micro_batcher.py)
+    #and returns just this text's tuple of genre names.
+    return batcher.predict(text, timeout=PREDICT_TIMEOUT)
+
+#Most items accepted by one POST /api/predict call
+MAX_BATCH_ITEMS = 500
+
+# --- Async serving ---
+#The views are async (Flask async views, needs Flask[async]): they await MangaDex I/O concurrently and hand the
+#CPU-bound prediction to a small bounded thread pool (NumPy/SciPy release the GIL while multiplying matrices).
+#Every stage has a timeout, and when too many POSTs are already running new ones get a 503 straight away
+#instead of queueing up behind a slow upstream.
+#Known limit: Flask is a WSGI app, and every request holds one server worker thread from start to end (up to
+#UPSTREAM_TIMEOUT + PREDICT_TIMEOUT). Async only overlaps the waits inside one request (e.g. the MangaDex
+#lookups of a batch), it does not let a worker thread serve other requests meanwhile. Wrapping the app for an
+#ASGI server does not change that (asgiref's WsgiToAsgi even runs every request on one shared thread).
+#Concurrent requests per process = server threads (e.g. gunicorn --workers 4 --threads 16 serves 64 at once).
+#Load shedding only sees requests that already have a thread, so MAX_CONCURRENT_REQUESTS has to be a little
+#below the threads per process: the spare threads then answer 503 right away instead of requests queueing
+#in the server for a free thread.
+
+#Threads doing MangaDex lookups (shared by all requests; also caps how many lookups run at once)
+UPSTREAM_WORKERS = int(os.environ.get("MANGA_UPSTREAM_WORKERS", 32))
+
+#Threads running predictions
+PREDICT_WORKERS = int(os.environ.get("MANGA_PREDICT_WORKERS", 2))
+
+#Seconds to wait for MangaDex / for a prediction before giving up
+UPSTREAM_TIMEOUT = float(os.environ.get("MANGA_UPSTREAM_TIMEOUT", 10))
+PREDICT_TIMEOUT = float(os.environ.get("MANGA_PREDICT_TIMEOUT", 5))
+
+#POST requests allowed in flight per worker process before answering 503
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MANGA_MAX_CONCURRENT", 64))
+
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+predict_executor = ThreadPoolExecutor(max_workers=PREDICT_WORKERS, thread_name_prefix="predict")
+request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+#Runs a blocking MangaDex call on the upstream pool and awaits it (raises asyncio.TimeoutError when too slow).
+#The timeout starts when a pool thread picks the call up, so time spent queued behind other calls does not count.
+#slots: optional asyncio.Semaphore capping the calls one request has on the pool. A slot is given back when the
+#call really ends: a timed-out `requests` call cannot be stopped and keeps its thread until it returns.
+async def run_upstream(func, *args, slots=None):
+    loop = asyncio.get_running_loop()
+    if slots is not None:
+        await slots.acquire()
+    started = loop.create_future()
+
+    #Runs on the event loop's thread; the loop may already be closed if the request gave up and finished
+    def notify(callback):
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass
+
+    func = profiled(func)
+
+    def call():
+        notify(lambda: started.done() or started.set_result(None))
+        return func(*args)
+
+    future = upstream_executor.submit(call)
+    if slots is not None:
+        future.add_done_callback(lambda _: notify(slots.release))
+
+    result = asyncio.wrap_future(future)
+    await asyncio.wait({started, result}, return_when=asyncio.FIRST_COMPLETED)
+    return await asyncio.wait_for(result, UPSTREAM_TIMEOUT)
+
+#Runs a prediction on the bounded prediction pool and awaits it
+async def run_prediction(func, *args):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(predict_executor, profiled(func), *args), PREDICT_TIMEOUT)
+
+#Function: func wrapped so the pool thread running it is sampled into the current request's profile (func itself if the request is not profiled)
+def profiled(func):
+    profile = g.get("profile") if has_request_context() else None
+    if profile is None:
+        return func
+
+    def call(*args):
+        with metrics.PROFILER.attach(profile):
+            return func(*args)
+    return call
+
+#Async version of predict_genres_from_text: awaits the batcher directly, so waiting requests do not hold
+#prediction threads and can all land in the same batch (a request that times out is dropped from its batch)
+async def predict_genres_async(title, description):
+    future = batcher.submit(title + " " + description)
+    return await asyncio.wait_for(asyncio.wrap_future(future), PREDICT_TIMEOUT)
+
+# Predict genres for many texts at once
+#texts: list of strings.
+#threshold: a genre is returned when its probability is at least this, None = each genre's tuned threshold.
+#top_k: keep at most this many genres per text (highest probability first), None = no limit.
+#Function: vectorizes every text into one sparse matrix and scores all genres with one matrix product,
+#then returns, for each text, the ranked genres that pass and the probability of every genre.
+def predict_genres_batch(texts, threshold=None, top_k=None):
+    with metrics.STAGE_SECONDS.time(stage="vectorize"):
+        X = model.vectorize(texts)
+    with metrics.STAGE_SECONDS.time(stage="predict"):
+        proba = model.predict_proba_vectors(X)
+    labels = model.labels.tolist()
+    cutoffs = model.thresholds if threshold is None else np.full(len(labels), threshold)
+
+    #Genres of every row sorted by probability, highest first
+    ranking = np.argsort(-proba, axis=1)
+
+    results = []
+    for row, order in zip(proba, ranking):
+        genres = [labels[label] for label in order if row[label] >= cutoffs[label]]
+        if top_k is not None:
+            genres = genres[:top_k]
+        results.append({
+            "genres": genres,
+            "probabilities": {labels[label]: round(float(row[label]), 4) for label in order},
+        })
+    return results
 
 
 # Extract MangaDex ID from URL
@@ -72,29 +219,32 @@ def get_manga_id_from_url(url):
         return match.group(1)
     return None
 
-# Fetch manga info and download cover locally
-def fetch_manga_info(manga_id):
-    #URL retrieves data for a specific manga
-    manga_url = f"https://api.mangadex.org/manga/{manga_id}?includes[]=cover_art"
+#Caches keyed by manga id (see cache.py): MangaDex metadata, and predictions (also keyed by model version,
+#so a new model never serves old predictions). In-process by default; MANGA_CACHE_BACKEND=disk shares them between workers.
+metadata_cache = make_cache("metadata", maxsize=2048, ttl=3600)
+prediction_cache = make_cache("predictions", maxsize=4096, ttl=6 * 3600)
 
-    #sends a GET request to that URL.
-    response = requests.get(manga_url)
+#Covers are fetched in the background and kept under a disk budget (see cover_store.py)
+covers = cover_store.CoverStore()
 
-    # If request failed, return None
-    if response.status_code != 200:
-        return None, None, [], "/static/placeholder.png"
+#"Similar manga" index over the dataset's TF-IDF vectors (see similarity_index.py); None until it is built
+#with `python similarity_index.py build` for the current model
+similar_index = similarity_index.load_index(model_version=model.version)
 
-    #converts the response body into a Python dictionary.
-    data = response.json().get("data", {})
+#Most neighbours one /api/similar call may ask for
+MAX_SIMILAR = 100
 
+#data: one manga entry of a MangaDex answer; included: the answer's "included" list, if any.
+#Function: dict with title, description, genres and cover_file_name
+def parse_manga(data, included=()):
     #detailed info like title, description, tags, etc.
     attributes = data.get("attributes", {})
 
     # Title & description
     #MangaDex provides multiple languages. It first tries to get the English version (.get("en")).
     #If that doesn’t exist, it falls back to the first available translation
-    title = attributes.get("title", {}).get("en") or list(attributes.get("title", {}).values())[0]
-    description = attributes.get("description", {}).get("en") or list(attributes.get("description", {}).values())[0]
+    title = attributes.get("title", {}).get("en") or next(iter(attributes.get("title", {}).values()), "")
+    description = attributes.get("description", {}).get("en") or next(iter(attributes.get("description", {}).values()), "")
 
     # Actual genres
     # Each tag represents a genre (like “Action”, “Romance”, etc.).
@@ -105,8 +255,6 @@ def fetch_manga_info(manga_id):
         if tag_name:
             genres.append(tag_name)
 
-    # Default cover
-    cover_url = "/static/placeholder.png"
     cover_file_name = None
 
     # Try relationships  to get cover art file name
@@ -118,47 +266,160 @@ def fetch_manga_info(manga_id):
     # Fallback to included array in case not found in relationships
     if not cover_file_name:
         #included is another key sometimes returned in MangaDex API responses.
-        included = response.json().get("included", [])
-
         for item in included:
             if item.get("type") == "cover_art":
                 cover_file_name = item.get("attributes", {}).get("fileName")
                 break
 
-    # Download cover if available
-    if cover_file_name:
-        cover_url_api = f"https://uploads.mangadex.org/covers/{manga_id}/{cover_file_name}.256.jpg"
-        os.makedirs("static/covers", exist_ok=True)
-        cover_path = f"static/covers/{manga_id}.jpg"
+    return {"title": title, "description": description, "genres": genres, "cover_file_name": cover_file_name}
 
-        #check if the cover image already exists locally to avoid re-downloading it.
-        if not os.path.exists(cover_path):
-            try:
-                #Sends an HTTP GET request to MangaDex to fetch the cover image.
-                img_data = requests.get(cover_url_api).content
-                
-                #Opens a file at cover_path for writing binary data (wb = write binary)
-                with open(cover_path, "wb") as f:
-                    #Writes the downloaded bytes to your local file
-                    f.write(img_data)
-                print("Downloaded cover:", cover_path)
+# Fetch the MangaDex metadata of one manga
+#Returns a dict with title, description, genres and cover_file_name, or None if MangaDex did not answer with it.
+def fetch_manga_metadata(manga_id):
+    #A title submitted a few seconds ago is served from the cache, without a round trip to MangaDex
+    cached = metadata_cache.get(manga_id)
+    if cached is not None:
+        return cached
 
-            except Exception as e:
-                print("Error downloading cover:", e)
-                cover_path = "/static/placeholder.png"
+    #URL retrieves data for a specific manga
+    manga_url = f"https://api.mangadex.org/manga/{manga_id}?includes[]=cover_art"
 
-        cover_url = f"/static/covers/{manga_id}.jpg"
+    #sends a GET request to that URL (reusing a pooled connection, retrying 429/5xx with backoff).
+    #Timed as the "upstream_fetch" stage; failures are counted by status code or exception name
+    try:
+        with metrics.STAGE_SECONDS.time(stage="upstream_fetch"):
+            response = client.get(manga_url)
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(kind="metadata", reason=type(e).__name__)
+        raise
+
+    # If request failed, return None (failures are not cached)
+    if response.status_code != 200:
+        metrics.UPSTREAM_ERRORS.inc(kind="metadata", reason=str(response.status_code))
+        logger.warning("MangaDex answered %s for manga %s", response.status_code, manga_id)
+        return None
+
+    #converts the response body into a Python dictionary (once, it is used twice below).
+    payload = response.json()
+    metadata = parse_manga(payload.get("data", {}), payload.get("included", []))
+    metadata_cache.set(manga_id, metadata)
+    return metadata
+
+#Most ids one /manga?ids[]= request can ask for
+IDS_PER_REQUEST = 100
+
+#Every content rating, otherwise MangaDex leaves some ids out of the answer
+CONTENT_RATINGS = ["safe", "suggestive", "erotica", "pornographic"]
+
+# Fetch the MangaDex metadata of up to IDS_PER_REQUEST manga in one request
+#Function: {manga id: metadata dict} for the ids MangaDex returned (cached ones are not asked for again);
+#ids missing from the answer are missing from the dict. Raises if the request itself fails.
+def fetch_manga_metadata_many(manga_ids):
+    found = {}
+    for manga_id in manga_ids:
+        cached = metadata_cache.get(manga_id)
+        if cached is not None:
+            found[manga_id] = cached
+
+    missing = [manga_id for manga_id in manga_ids if manga_id not in found]
+    if not missing:
+        return found
+
+    params = {"ids[]": missing, "limit": len(missing), "includes[]": "cover_art", "contentRating[]": CONTENT_RATINGS}
+    try:
+        with metrics.STAGE_SECONDS.time(stage="upstream_fetch"):
+            response = client.get("https://api.mangadex.org/manga", params=params)
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(kind="metadata", reason=type(e).__name__)
+        raise
+    if response.status_code != 200:
+        metrics.UPSTREAM_ERRORS.inc(kind="metadata", reason=str(response.status_code))
+        raise RuntimeError(f"MangaDex answered {response.status_code} for {len(missing)} manga")
+
+    for data in response.json().get("data", []):
+        metadata = parse_manga(data)
+        metadata_cache.set(data["id"], metadata)
+        found[data["id"]] = metadata
+    return found
+
+# Fetch manga info and its cover
+#download_cover=False skips the cover image (the batch API only needs the text).
+def fetch_manga_info(manga_id, download_cover=True):
+    metadata = fetch_manga_metadata(manga_id)
+    if metadata is None:
+        return None, None, [], cover_store.PLACEHOLDER_URL
+
+    title = metadata["title"]
+    description = metadata["description"]
+    genres = metadata["genres"]
+    cover_file_name = metadata["cover_file_name"]
+
+    # Default cover
+    cover_url = cover_store.PLACEHOLDER_URL
+
+    # Cover: the local copy if it is already downloaded, otherwise the placeholder while it downloads in the background
+    if cover_file_name and download_cover:
+        cover_url = covers.cover_url(manga_id, cover_file_name)
 
     # Return title, description, genres, cover URL of the manga
     return title, description, genres, cover_url
 
+#Request timing, status code counts and (if MANGA_PROFILE_SLOW_MS is set) the slow request profiler.
+#Registered before the load shedding below, so shed requests are counted too.
+#Scrapes and static files are not profiled: they are never the slow requests, and /metrics is hit all the time.
+UNPROFILED_ENDPOINTS = ("metrics", "static")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if metrics.PROFILE_SLOW_MS and request.endpoint not in UNPROFILED_ENDPOINTS:
+        g.profile = metrics.PROFILER.begin()
+
+@app.after_request
+def count_response(response):
+    endpoint = request.endpoint or "unknown"
+    metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if "request_started" in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    return response
+
+#The profile is only logged when the request was slow; fast requests just drop theirs
+@app.teardown_request
+def stop_profiler(exc):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+    metrics.PROFILER.end(profile)
+    elapsed_ms = (time.perf_counter() - g.request_started) * 1000
+    if elapsed_ms >= metrics.PROFILE_SLOW_MS:
+        metrics.SLOW_REQUESTS.inc(endpoint=request.endpoint or "unknown")
+        logger.warning("Slow request %s %s took %.0f ms, profile:\n%s", request.method, request.path, elapsed_ms, profile.report())
+
+#Load shedding: every POST takes a slot, and so does a GET that calls MangaDex (/api/similar?url=);
+#with none left the request is answered 503 right away
+@app.before_request
+def limit_concurrency():
+    calls_upstream = request.endpoint == "api_similar" and request.args.get("url")
+    if request.method != 'POST' and not calls_upstream:
+        return None
+    if not request_slots.acquire(blocking=False):
+        return "Server is busy, please try again in a moment.", 503, {"Retry-After": "1"}
+    g.holds_slot = True
+
+@app.teardown_request
+def release_slot(exc):
+    if g.pop("holds_slot", False):
+        request_slots.release()
+
 @app.route('/', methods=['GET', 'POST'])
-def index():
+async def index():
     predicted_genres = []
     actual_genres = []
     accuracy = 0
+    scores = None  # Precision / recall / F1 of the prediction against the MangaDex tags
     predicted_cover_url = "/static/placeholder.png"
     actual_cover_url = "/static/placeholder.png"
+    cover_pending_url = None  # Where the cover will appear once its background download finishes
     error_message = None
     title = ""        # Initialize title
     description = ""  # Initialize description
@@ -173,38 +434,217 @@ def index():
             error_message = "Invalid MangaDex URL. Please enter a valid manga link."
         else:
             try:
-                title, description, actual_genres, actual_cover_url = fetch_manga_info(manga_id)
+                #MangaDex lookup on the upstream pool (the cover download itself runs in the background)
+                title, description, actual_genres, actual_cover_url = await run_upstream(fetch_manga_info, manga_id)
 
                 if not title or not description:
                     error_message = "Could not fetch manga info. Please try another link."
                 else:
 
                     #use train model to predict genre from extracted title and description of specified manga
-                    predicted_genres = predict_genres_from_text(title, description)
-
-                    #calculate accuracy by comparing predicted genres to actual genres from MangaDex
-                    accuracy = calculate_accuracy(predicted_genres, actual_genres)
+                    #(the same manga and model version is only predicted once, then served from the cache)
+                    prediction_key = f"{model.version}:{manga_id}"
+                    predicted_genres = prediction_cache.get(prediction_key)
+                    if predicted_genres is None:
+                        predicted_genres = await predict_genres_async(title, description)
+                        prediction_cache.set(prediction_key, predicted_genres)
+
+                    #compare predicted genres to actual genres from MangaDex. Recall alone would give 100% to a model
+                    #that predicts every genre, so the circle shows F1 (precision and recall are shown under it)
+                    scores = calibration.set_scores(predicted_genres, actual_genres)
+                    accuracy = scores["f1"]
                     predicted_cover_url = actual_cover_url  # For simplicity, same cover
 
+                    #The cover is still downloading: the page swaps the placeholder for it once it exists
+                    if actual_cover_url == cover_store.PLACEHOLDER_URL and (covers.is_pending(manga_id) or os.path.exists(covers.path(manga_id))):
+                        cover_pending_url = covers.local_url(manga_id)
+
+            except asyncio.TimeoutError:
+                logger.warning("Timed out handling manga %s", manga_id)
+                error_message = "MangaDex or the model took too long to answer. Please try again."
+
             except Exception as e:
-                print("Error fetching MangaDex data:", e)
+                logger.warning("Error fetching MangaDex data for %s: %s", manga_id, e)
                 error_message = "Failed to fetch data from MangaDex. Please try again later."
 
     # Pass title and description to template
     # Loads the HTML template file (index.html) from your templates/ folder.
     # Injects variables into the template so that they can be used in Jinja2 syntax ({{ variable }} or {% ... %}).
     # Returns a fully rendered HTML page to the user’s browser.
-    return render_template(
-        'index.html',
-        predicted_genres=predicted_genres,
-        actual_genres=actual_genres,
-        accuracy=accuracy,
-        predicted_cover_url=predicted_cover_url,
-        actual_cover_url=actual_cover_url,
-        error_message=error_message,
-        title=title,
-        description=description
-    )
+    with metrics.STAGE_SECONDS.time(stage="render"):
+        return render_template(
+            'index.html',
+            predicted_genres=predicted_genres,
+            actual_genres=actual_genres,
+            accuracy=accuracy,
+            scores=scores,
+            predicted_cover_url=predicted_cover_url,
+            actual_cover_url=actual_cover_url,
+            cover_pending_url=cover_pending_url,
+            error_message=error_message,
+            title=title,
+            description=description
+        )
+
+#Turns batch items into the texts to predict from.
+#An item is either {"title": ..., "description": ...} or {"url": "<MangaDex link>"}.
+#The ids of every "url" item are looked up together, IDS_PER_REQUEST per MangaDex request (a 500 url batch
+#is 5 requests, not 500), the requests running side by side on the upstream pool.
+#Returns one (text, None) or (None, error message) per item, in the same order.
+async def batch_item_texts(items, slots=None):
+    prepared = [None] * len(items)
+    positions = {}  # manga id -> positions of the items asking for it
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            prepared[position] = (None, "Item must be an object")
+        elif item.get("url"):
+            manga_id = get_manga_id_from_url(str(item["url"]))
+            if manga_id:
+                positions.setdefault(manga_id, []).append(position)
+            else:
+                prepared[position] = (None, "Invalid MangaDex URL")
+        else:
+            title = str(item.get("title") or "")
+            description = str(item.get("description") or "")
+            if title or description:
+                prepared[position] = (title + " " + description, None)
+            else:
+                prepared[position] = (None, "Item needs a title/description or a url")
+
+    ids = list(positions)
+    groups = [ids[start:start + IDS_PER_REQUEST] for start in range(0, len(ids), IDS_PER_REQUEST)]
+    answers = await asyncio.gather(*(run_upstream(fetch_manga_metadata_many, group, slots=slots) for group in groups), return_exceptions=True)
+
+    for group, answer in zip(groups, answers):
+        for manga_id in group:
+            if isinstance(answer, asyncio.TimeoutError):
+                result = (None, "MangaDex took too long to answer")
+            elif isinstance(answer, Exception):
+                logger.warning("Error fetching MangaDex data for %s: %s", manga_id, answer)
+                result = (None, "Failed to fetch data from MangaDex")
+            elif manga_id not in answer:
+                result = (None, "Manga not found on MangaDex")
+            elif not answer[manga_id]["title"] or not answer[manga_id]["description"]:
+                result = (None, "Could not fetch manga info")
+            else:
+                result = (answer[manga_id]["title"] + " " + answer[manga_id]["description"], None)
+            for position in positions[manga_id]:
+                prepared[position] = result
+    return prepared
+
+#Batch prediction API.
+#Body: {"items": [{"title": ..., "description": ...} or {"url": ...}, ...], "threshold": 0.5, "top_k": 5}
+#(threshold is optional: without it every genre uses the threshold tuned for it at training time)
+#Answer: {"results": [{"genres": [...], "probabilities": {...}} or {"error": ...}, ...]} in the same order as items.
+#All texts are predicted together in one model call instead of one call (and one HTTP round trip) per title.
+@app.route('/api/predict', methods=['POST'])
+async def api_predict():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("items"), list):
+        return jsonify({"error": "Body must be JSON with an 'items' list"}), 400
+
+    items = payload["items"]
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_ITEMS} items per request"}), 400
+
+    try:
+        threshold = payload.get("threshold")
+        threshold = float(threshold) if threshold is not None else None
+        top_k = payload.get("top_k")
+        top_k = int(top_k) if top_k is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "threshold must be a number and top_k an integer"}), 400
+    if (threshold is not None and not 0 <= threshold <= 1) or (top_k is not None and top_k < 1):
+        return jsonify({"error": "threshold must be between 0 and 1 and top_k at least 1"}), 400
+
+    #MangaDex lookups for "url" items are grouped and awaited side by side; plain text items need none.
+    #One request never has more lookups on the upstream pool than it has threads, so its own tail does not time out in the queue
+    prepared = await batch_item_texts(items, asyncio.Semaphore(UPSTREAM_WORKERS))
+
+    texts = [text for text, error in prepared if error is None]
+    try:
+        predictions = iter(await run_prediction(predict_genres_batch, texts, threshold, top_k) if texts else [])
+    except asyncio.TimeoutError:
+        return jsonify({"error": "Prediction timed out, try a smaller batch"}), 503
+
+    results = [next(predictions) if error is None else {"error": error} for _, error in prepared]
+    return jsonify({"results": results})
+
+#Similar manga API.
+#GET /api/similar?url=<MangaDex link>&k=10  (or ?title=...&description=... for text that is not on MangaDex)
+#Answer: {"similar": [{"manga_id", "title", "score", "genres"}, ...], "genres": [{"genre", "share"}, ...]}
+#"similar" holds the k most similar dataset manga by cosine similarity, "genres" their similarity-weighted vote.
+@app.route('/api/similar')
+async def api_similar():
+    if similar_index is None:
+        return jsonify({"error": "Similarity index not built, run similarity_index.py build"}), 503
+
+    try:
+        k = int(request.args.get("k", similarity_index.DEFAULT_K))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    if not 1 <= k <= MAX_SIMILAR:
+        return jsonify({"error": f"k must be between 1 and {MAX_SIMILAR}"}), 400
+
+    manga_id = None
+    if request.args.get("url"):
+        #Same lookup as a batch item with a url (the request holds a load shedding slot, see limit_concurrency)
+        (text, error), = await batch_item_texts([{"url": request.args["url"]}], asyncio.Semaphore(1))
+        manga_id = get_manga_id_from_url(request.args["url"])
+    else:
+        (text, error), = await batch_item_texts([{"title": request.args.get("title"), "description": request.args.get("description")}])
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        similar = await run_prediction(similar_index.search, model, text, k, manga_id)
+    except asyncio.TimeoutError:
+        return jsonify({"error": "Search timed out"}), 503
+
+    genres = similarity_index.vote_genres(similar)
+    return jsonify({"similar": similar, "genres": [{"genre": genre, "share": share} for genre, share in genres]})
+
+#Hit / miss / eviction counters of the caches
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    return jsonify({"metadata": metadata_cache.stats(), "predictions": prediction_cache.stats()})
+
+#Queue depth and batch size histogram of the micro-batcher
+@app.route('/api/batcher/stats')
+def api_batcher_stats():
+    return jsonify(batcher.stats())
+
+#Stats kept by the caches, the micro-batcher and the HTTP client, read at every /metrics scrape
+@metrics.register_collector
+def collect_component_stats():
+    cache_stats = {"metadata": metadata_cache.stats(), "predictions": prediction_cache.stats()}
+    families = [
+        (f"manga_cache_{name}_total", "counter", f"Cache {name} per cache", [(f"manga_cache_{name}_total", {"cache": cache}, stats[name]) for cache, stats in cache_stats.items()])
+        for name in ("hits", "misses", "evictions", "expirations")
+    ]
+    families.append(("manga_cache_entries", "gauge", "Entries in each cache", [("manga_cache_entries", {"cache": cache}, stats["size"]) for cache, stats in cache_stats.items()]))
+
+    batch = batcher.stats()
+    families.append(("manga_batcher_queue_depth", "gauge", "Texts waiting for the micro-batcher", [("manga_batcher_queue_depth", {}, batch["queue_depth"])]))
+    #The batcher counts batches per size bucket; Prometheus buckets are cumulative
+    buckets, running = [], 0
+    for bound, count in batch["batch_size_histogram"].items():
+        running += count
+        buckets.append(("manga_batcher_batch_size_bucket", {"le": bound}, running))
+    buckets.append(("manga_batcher_batch_size_sum", {}, batch["batched_items"]))
+    buckets.append(("manga_batcher_batch_size_count", {}, batch["batches"]))
+    families.append(("manga_batcher_batch_size", "histogram", "Texts per micro-batch", buckets))
+
+    hosts = client.stats()
+    for name in ("requests", "retries", "errors"):
+        families.append((f"manga_upstream_{name}_total", "counter", f"HTTP client {name} per host", [(f"manga_upstream_{name}_total", {"host": host}, stats[name]) for host, stats in hosts.items()]))
+    families.append(("manga_upstream_latency_seconds_max", "gauge", "Slowest upstream response per host", [("manga_upstream_latency_seconds_max", {"host": host}, stats["latency_max"]) for host, stats in hosts.items()]))
+    return families
+
+#Prometheus scrape endpoint: stage timings, request counts by status code, upstream errors, model load time...
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     app.run(debug=True)
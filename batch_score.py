@@ -0,0 +1,308 @@
+#Offline batch scoring of whole catalogues.
+#
+#The web form predicts one MangaDex link per request. This script predicts a whole file at once:
+#- input: a CSV or Parquet file (or a Parquet dataset folder) with title / description columns, or a text
+#  file with one MangaDex id or link per line (fetched 100 at a time with the crawler's rate limiter)
+#- the input is read CHUNK_SIZE rows at a time, so files larger than RAM are fine
+#- chunks are scored in a process pool (every worker loads the model once; the compact export is memory
+#  mapped, so the workers share its pages); at most 2 chunks per worker are in flight
+#- results are appended to the output (CSV or JSON lines, by extension) in input order, chunk by chunk, with
+#  the ranked genres and every genre's probability
+#- after every chunk, a progress file next to the output records how many chunks and bytes are done.
+#  Running the same command again after a crash or Ctrl+C cuts the output back to the last finished chunk
+#  and continues from there (--fresh starts over)
+#
+#    python batch_score.py data/catalogue.parquet predictions.csv
+#    python batch_score.py ids.txt predictions.jsonl --ids
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import dataset_io
+import inference_model
+import supervised_trainer
+
+#Rows read and scored at a time
+CHUNK_SIZE = 10000
+
+#Scoring processes (-1 = all cores)
+N_JOBS = -1
+
+#Ids per MangaDex request (the most /manga accepts)
+IDS_PER_REQUEST = 100
+
+#Input columns that are used when present (any missing one counts as empty)
+TEXT_COLUMNS = ["title_ja", "title_en", "title", "description"]
+ID_COLUMNS = ["manga_id", "id"]
+
+#Every content rating, otherwise MangaDex leaves some ids out of the answer
+CONTENT_RATINGS = ["safe", "suggestive", "erotica", "pornographic"]
+
+#Model of each worker process, loaded once by load_worker_model
+worker_model = None
+
+
+# --- Reading the input ---
+
+#Function: yields the input file as DataFrames of at most chunk_size rows, reading only the useful columns
+def read_file_chunks(path, chunk_size=CHUNK_SIZE):
+    if os.path.isdir(path):
+        parts = [os.path.join(path, name) for name in dataset_io.list_parts(path)]
+    elif path.endswith(".parquet"):
+        parts = [path]
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        columns = [column for column in ID_COLUMNS + TEXT_COLUMNS if column in header]
+        yield from pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_size)
+        return
+
+    for part_path in parts:
+        part = pq.ParquetFile(part_path, memory_map=True)
+        columns = [column for column in ID_COLUMNS + TEXT_COLUMNS if column in part.schema_arrow.names]
+        for batch in part.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+
+#Function: the MangaDex id in a line holding an id or a manga link, or None
+def parse_manga_id(line):
+    match = re.search(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", line)
+    return match.group(0) if match else None
+
+#Function: yields lists of at most chunk_size MangaDex ids from the ids file (lines without an id are skipped)
+def read_id_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, encoding="utf-8") as f:
+        ids = (parse_manga_id(line) for line in f)
+        ids = (manga_id for manga_id in ids if manga_id)
+        while True:
+            chunk = list(islice(ids, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+#Function: dataset rows (see mangadex_dataset_builder.manga_to_row) of up to IDS_PER_REQUEST ids in one request
+def fetch_rows(ids, api_url):
+    import mangadex_dataset_builder
+    params = {"ids[]": ids, "limit": len(ids), "contentRating[]": CONTENT_RATINGS}
+    data = mangadex_dataset_builder.safe_get(f"{api_url}/manga", params).json()["data"]
+    rows = [mangadex_dataset_builder.manga_to_row(manga) for manga in data]
+    return [row for row in rows if row is not None]
+
+#ids: one chunk of ids; fetcher: thread pool running the requests side by side (the rate limiter paces them).
+#Function: DataFrame with the chunk's manga that MangaDex returned, in the order of ids
+def fetch_id_chunk(ids, fetcher, api_url):
+    groups = [ids[start:start + IDS_PER_REQUEST] for start in range(0, len(ids), IDS_PER_REQUEST)]
+    by_id = {}
+    for rows in fetcher.map(lambda group: fetch_rows(group, api_url), groups):
+        by_id.update((row["manga_id"], row) for row in rows)
+
+    missing = len(ids) - sum(manga_id in by_id for manga_id in ids)
+    if missing:
+        print(f"  {missing} ids were not found on MangaDex")
+    return pd.DataFrame([by_id[manga_id] for manga_id in ids if manga_id in by_id], columns=dataset_io.COLUMNS)
+
+#Function: (manga ids, titles, model texts) of a chunk; the text is built like the trainer builds it
+def chunk_texts(df):
+    df = df.copy()
+    id_column = next((column for column in ID_COLUMNS if column in df.columns), None)
+    if "title" in df.columns:
+        df["title_en"] = df["title"] if "title_en" not in df.columns else df["title_en"].fillna(df["title"])
+    for column in ("title_ja", "title_en", "description"):
+        if column not in df.columns:
+            df[column] = ""
+
+    ids = df[id_column].fillna("").tolist() if id_column else [""] * len(df)
+    #English title, or the Japanese one when there is none
+    titles = df["title_en"].replace("", None).fillna(df["title_ja"]).fillna("").tolist()
+    return ids, titles, supervised_trainer.prepare_text(df).tolist()
+
+
+# --- Scoring (in the worker processes) ---
+
+def load_worker_model():
+    global worker_model
+    worker_model = inference_model.load_model()
+
+#Quotes a text field when CSV needs it (commas, quotes or line breaks in it)
+def csv_field(value):
+    value = str(value)
+    if any(char in value for char in ',"\n\r'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+#first_row: position of the chunk's first row in the input; threshold: None = each genre's tuned threshold.
+#Function: the chunk's output lines (CSV or JSON lines) as one string, ready to append to the output file
+def score_chunk(first_row, ids, titles, texts, threshold, output_format):
+    model = worker_model
+    proba = model.predict_proba_vectors(model.vectorize(texts))
+    cutoffs = model.thresholds if threshold is None else np.full(len(model.labels), threshold)
+    genres = inference_model.ranked_genres(proba, cutoffs, model.labels)
+    rows = range(first_row, first_row + len(texts))
+
+    if output_format == "csv":
+        #Formatting the probability columns is most of the time of a chunk: np.savetxt does it about 3x faster
+        #than DataFrame.to_csv, and only the few text columns need CSV quoting
+        buffer = io.StringIO()
+        np.savetxt(buffer, proba, fmt="%.4f", delimiter=",")
+        lines = []
+        for row, manga_id, title, row_genres, proba_line in zip(rows, ids, titles, genres, buffer.getvalue().splitlines()):
+            lines.append(",".join([str(row), csv_field(manga_id), csv_field(title), csv_field("|".join(row_genres)), proba_line]))
+        return "".join(line + "\n" for line in lines)
+
+    labels = model.labels.tolist()
+    lines = []
+    for row, manga_id, title, row_genres, row_proba in zip(rows, ids, titles, genres, np.round(proba.astype(np.float64), 4).tolist()):
+        lines.append(json.dumps({
+            "row": row,
+            "manga_id": manga_id,
+            "title": title,
+            "genres": list(row_genres),
+            "probabilities": dict(zip(labels, row_proba)),
+        }, ensure_ascii=False))
+    return "".join(line + "\n" for line in lines)
+
+
+# --- Output and progress ---
+
+def progress_path(output):
+    return output + ".progress.json"
+
+def load_progress(output):
+    if not os.path.exists(progress_path(output)):
+        return None
+    with open(progress_path(output), encoding="utf-8") as f:
+        return json.load(f)
+
+#Saved atomically (temp file, then rename), like the crawl checkpoint
+def save_progress(output, state):
+    tmp_path = progress_path(output) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, progress_path(output))
+
+#Function: the output file opened for appending, and the progress state to continue from
+def open_output(output, settings, labels, fresh):
+    state = None if fresh else load_progress(output)
+    if state is not None and state["settings"] != settings:
+        raise SystemExit(f"{output} was started with other settings or another model ({state['settings']}), use --fresh to start over")
+
+    #An output without a progress file was not written by an unfinished run of this script: never overwrite it silently
+    if state is None and not fresh and os.path.exists(output):
+        raise SystemExit(f"{output} already exists and has no progress file, use --fresh to overwrite it")
+
+    if state is None or not os.path.exists(output):
+        state = {"settings": settings, "chunks": 0, "rows": 0, "bytes": 0, "done": False}
+        f = open(output, "w", encoding="utf-8", newline="")
+        if settings["format"] == "csv":
+            f.write(pd.DataFrame(columns=["row", "manga_id", "title", "genres"] + [f"proba_{label}" for label in labels]).to_csv(index=False))
+    else:
+        #Anything after the last finished chunk is a chunk that was cut off, drop it
+        f = open(output, "r+", encoding="utf-8", newline="")
+        f.truncate(state["bytes"])
+        f.seek(state["bytes"])
+    return f, state
+
+#Makes the written chunk durable, then records it as done
+def commit_chunk(f, output, state, rows):
+    f.flush()
+    os.fsync(f.fileno())
+    state["chunks"] += 1
+    state["rows"] += rows
+    state["bytes"] = f.tell()
+    save_progress(output, state)
+
+
+#source: input file (or ids file with ids=True); output: .csv or .jsonl file.
+#Function: scores the whole input into the output and returns the number of rows written
+def main(source, output, ids=False, chunk_size=CHUNK_SIZE, n_jobs=N_JOBS, threshold=None, fresh=False,
+         api_url=None):
+    model = inference_model.load_model()
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    settings = {
+        "input": os.path.abspath(source),
+        "ids": ids,
+        "chunk_size": chunk_size,
+        "threshold": threshold,
+        "format": "jsonl" if output.endswith((".jsonl", ".json")) else "csv",
+        "model_version": model.version,
+    }
+
+    f, state = open_output(output, settings, model.labels, fresh)
+    fetcher = None
+    #The output is closed and the fetch threads stopped on every way out (already complete, finished or failed)
+    try:
+        if state["done"]:
+            print(f"{output} is already complete ({state['rows']} rows), use --fresh to score again")
+            return state["rows"]
+        if state["chunks"]:
+            print(f"Resuming after {state['chunks']} chunks ({state['rows']} rows)")
+
+        if ids:
+            import mangadex_dataset_builder
+            api_url = api_url or mangadex_dataset_builder.API_URL
+            fetcher = ThreadPoolExecutor(mangadex_dataset_builder.MAX_WORKERS)
+            chunks = (fetch_id_chunk(chunk, fetcher, api_url) for chunk in islice(read_id_chunks(source, chunk_size), state["chunks"], None))
+        else:
+            chunks = islice(read_file_chunks(source, chunk_size), state["chunks"], None)
+
+        started = time.time()
+        first_rows = state["rows"]
+        in_flight = deque()
+        with ProcessPoolExecutor(n_jobs, initializer=load_worker_model) as pool:
+
+            #Writes the oldest chunk once it is scored, so the output keeps the input order
+            def write_oldest():
+                future, rows = in_flight.popleft()
+                f.write(future.result())
+                commit_chunk(f, output, state, rows)
+                elapsed = time.time() - started
+                print(f"{state['chunks']} chunks, {state['rows']} rows ({(state['rows'] - first_rows) / max(elapsed, 1e-9):.0f} rows/s)")
+
+            #Row numbers continue across chunks; with --ids they count the manga found
+            next_row = state["rows"]
+            for df in chunks:
+                chunk_ids, titles, texts = chunk_texts(df)
+                future = pool.submit(score_chunk, next_row, chunk_ids, titles, texts, threshold, settings["format"])
+                in_flight.append((future, len(texts)))
+                next_row += len(texts)
+                #Bounded read-ahead: memory stays at a few chunks whatever the input size
+                if len(in_flight) >= 2 * n_jobs:
+                    write_oldest()
+            while in_flight:
+                write_oldest()
+
+        state["done"] = True
+        save_progress(output, state)
+        print(f"Wrote {state['rows']} predictions to {output} in {time.time() - started:.1f}s")
+        return state["rows"]
+    finally:
+        f.close()
+        if fetcher is not None:
+            fetcher.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict genres for a whole CSV / Parquet file or a list of MangaDex ids")
+    parser.add_argument("input", help="CSV or Parquet file, Parquet dataset folder, or ids file with --ids")
+    parser.add_argument("output", help="predictions file, .csv or .jsonl")
+    parser.add_argument("--ids", action="store_true", help="input is a text file with one MangaDex id or link per line")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows scored at a time")
+    parser.add_argument("--jobs", type=int, default=N_JOBS, help="scoring processes (-1 = all cores)")
+    parser.add_argument("--threshold", type=float, help="one probability cut-off for every genre (default: the tuned per-genre thresholds)")
+    parser.add_argument("--api-url", help="MangaDex API base URL for --ids (e.g. a local stub server)")
+    parser.add_argument("--fresh", action="store_true", help="start over instead of resuming an unfinished run")
+    args = parser.parse_args()
+
+    if args.threshold is not None and not 0 <= args.threshold <= 1:
+        sys.exit("--threshold must be between 0 and 1")
+    main(args.input, args.output, args.ids, args.chunk_size, args.jobs, args.threshold, args.fresh, args.api_url)
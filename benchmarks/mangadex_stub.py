@@ -0,0 +1,110 @@
+#Local stand-in for the MangaDex API, serving synthetic manga (see synthetic.py).
+#
+#Benchmarking the crawler against the real API would measure MangaDex and the network, and hit its rate limit.
+#The stub answers the endpoints the project uses from memory:
+#- GET /manga?limit=&offset=    one page of manga, optionally with updatedAtSince= and order[updatedAt]=asc|desc
+#                               (used by mangadex_dataset_builder.py --sync)
+#- GET /manga?ids[]=...          the listed manga (used by batch_score.py --ids)
+#- GET /manga/<id>              one manga (with its cover_art relationship)
+#An optional latency (seconds) is added to every answer to mimic a remote server.
+#
+#Run it on its own to point the crawler at it:
+#    python benchmarks/mangadex_stub.py --manga 5000 --port 8000
+#    python mangadex_dataset_builder.py --api-url http://127.0.0.1:8000 --total 5000 --fresh
+
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import synthetic
+
+
+class StubServer:
+    """Threaded HTTP server with n_manga synthetic manga"""
+
+    def __init__(self, n_manga=10000, seed=0, latency=0.0, port=0):
+        self.manga = synthetic.make_manga_list(n_manga, seed)
+        self.by_id = {manga["id"]: manga for manga in self.manga}
+        self.latency = latency
+        self.requests = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == "/manga":
+                    limit = int(query.get("limit", ["10"])[0])
+                    offset = int(query.get("offset", ["0"])[0])
+                    manga = stub.manga
+                    if "ids[]" in query:
+                        manga = [stub.by_id[manga_id] for manga_id in query["ids[]"] if manga_id in stub.by_id]
+                    #The API takes the date without timezone and keeps titles updated at or after it
+                    if "updatedAtSince" in query:
+                        since = query["updatedAtSince"][0]
+                        manga = [m for m in manga if m["attributes"]["updatedAt"][:19] >= since]
+                    if "order[updatedAt]" in query:
+                        manga = sorted(manga, key=lambda m: m["attributes"]["updatedAt"],
+                                       reverse=query["order[updatedAt]"][0] == "desc")
+                    body = {
+                        "result": "ok",
+                        "response": "collection",
+                        "data": manga[offset:offset + limit],
+                        "limit": limit,
+                        "offset": offset,
+                        "total": len(manga),
+                    }
+                elif url.path.startswith("/manga/") and url.path[len("/manga/"):] in stub.by_id:
+                    body = {"result": "ok", "response": "entity", "data": stub.by_id[url.path[len("/manga/"):]]}
+                else:
+                    self.send_error(404)
+                    return
+
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            #Keep the benchmark output clean
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mangadex-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic manga on a local MangaDex-like API")
+    parser.add_argument("--manga", type=int, default=10000, help="number of manga to serve")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = StubServer(args.manga, args.seed, args.latency, args.port)
+    print(f"Serving {args.manga} manga on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,334 @@
+#Benchmarks for the crawl, train, load and serve hot paths.
+#
+#Everything runs on synthetic data (synthetic.py) in a temporary folder, so the numbers only depend on the
+#code and the machine:
+#- crawl: rows/s of build_dataset() against the local MangaDex stub (mangadex_stub.py), with the rate limit
+#  lifted so the crawler itself is measured and not the 5 requests/s MangaDex allows
+#- train: TF-IDF vectorize time and cross-validation fit time per fold, for every dataset size
+#- load: start-up time of the compact model and of the pickled bundle
+#- predict: p50/p99 latency of one text, and of a batch of texts
+#- web: requests/s and p50/p99 of POST /api/predict through Flask's test client (in process, no sockets)
+#
+#The metrics are written as JSON and compared against a stored baseline; a metric that got worse by more
+#than the threshold is reported as a regression.
+#
+#    python benchmarks/run_benchmarks.py                      # run and compare with benchmarks/baseline.json
+#    python benchmarks/run_benchmarks.py --save-baseline      # run and store the results as the new baseline
+#    python benchmarks/run_benchmarks.py --sizes 1000 --skip crawl,web --fail-on-regression
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import synthetic
+from mangadex_stub import StubServer
+
+import dataset_io
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.json")
+
+#Dataset sizes trained on (the model of the largest one is used for the load / predict / web benchmarks)
+SIZES = [1000, 10000]
+
+#Manga served by the stub and crawled
+CRAWL_ROWS = 5000
+
+#Cross-validation folds timed per size
+FOLDS = 3
+
+#Timed predictions per latency benchmark, and texts per batch
+PREDICT_REPEATS = 300
+BATCH_SIZE = 64
+
+#Web benchmark: requests sent and client threads sending them
+WEB_REQUESTS = 500
+WEB_CONCURRENCY = 8
+
+#A metric more than 20% worse than the baseline is a regression
+THRESHOLD = 0.2
+
+STAGES = ["crawl", "train", "load", "predict", "web"]
+
+
+#seconds: list of timings.
+#Function: (p50, p99) in milliseconds
+def percentiles(seconds):
+    p50, p99 = np.percentile(np.array(seconds) * 1000, [50, 99])
+    return round(float(p50), 3), round(float(p99), 3)
+
+#Runs func `repeats` times and returns the median time in milliseconds
+def median_ms(func, repeats=5):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return round(float(np.median(timings)) * 1000, 3)
+
+
+def bench_crawl(rows=CRAWL_ROWS, workers=4, latency=0.0):
+    import mangadex_dataset_builder as builder
+    from http_client import TokenBucket
+
+    stub = StubServer(rows, latency=latency).start()
+    #Lift the MangaDex rate limit for the stub (safe_get looks the limiter up on every call)
+    builder.rate_limiter = TokenBucket(100000)
+    try:
+        start = time.perf_counter()
+        builder.build_dataset(rows, api_url=stub.url, workers=workers, resume=False)
+        elapsed = time.perf_counter() - start
+    finally:
+        stub.stop()
+
+    crawled = dataset_io.load_table(["manga_id"], dataset_dir=builder.META_FILE).num_rows
+    return {"crawl.rows_per_s": round(crawled / elapsed, 1), "crawl.seconds": round(elapsed, 3)}
+
+#Function: timings of one training run on `size` synthetic rows, plus the fitted (vectorizer, binarizer, classifier)
+def bench_train(size, jobs=1, folds=FOLDS):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.preprocessing import MultiLabelBinarizer
+    from sklearn.multiclass import OneVsRestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import KFold
+    import supervised_trainer
+    import parallel_training
+
+    dataset_dir = synthetic.write_dataset(size, f"data/bench_{size}")
+    df = dataset_io.load_dataset(columns=["title_ja", "title_en", "description", "tags"], dataset_dir=dataset_dir)
+    texts = supervised_trainer.prepare_text(df)
+
+    start = time.perf_counter()
+    tfidf = TfidfVectorizer(**supervised_trainer.vectorizer_params)
+    X = tfidf.fit_transform(texts)
+    vectorize_s = time.perf_counter() - start
+
+    mlb = MultiLabelBinarizer()
+    Y = mlb.fit_transform(df["tags"])
+
+    #Plain KFold: the iterative stratification of the real trainer would be timed along with the fits
+    fold_indices = list(KFold(folds, shuffle=True, random_state=0).split(X))
+    start = time.perf_counter()
+    parallel_training.cross_validate(X, Y, fold_indices, n_jobs=jobs)
+    fit_per_fold_s = (time.perf_counter() - start) / folds
+
+    start = time.perf_counter()
+    clf = OneVsRestClassifier(LogisticRegression(**parallel_training.LR_PARAMS), n_jobs=jobs).fit(X, Y)
+    final_fit_s = time.perf_counter() - start
+
+    metrics = {
+        f"train.{size}.vectorize_s": round(vectorize_s, 3),
+        f"train.{size}.fit_per_fold_s": round(fit_per_fold_s, 3),
+        f"train.{size}.final_fit_s": round(final_fit_s, 3),
+    }
+    return metrics, (tfidf, mlb, clf)
+
+#Saves the model like supervised_trainer does (bundle + compact export) and times loading both
+def bench_load(tfidf, mlb, clf):
+    import model_bundle
+    import inference_model
+
+    version = model_bundle.save_bundle(tfidf, mlb, clf, metadata={"benchmark": True})
+    inference_model.export_compact(tfidf, mlb, clf, inference_model.COMPACT_DIR, version)
+
+    def load_bundle():
+        bundle = model_bundle.load_bundle(version)
+        return inference_model.SklearnModel(bundle["vectorizer"], bundle["binarizer"], bundle["classifier"], version)
+
+    return {
+        "load.compact_ms": median_ms(lambda: inference_model.CompactModel(inference_model.COMPACT_DIR)),
+        "load.bundle_ms": median_ms(load_bundle),
+    }
+
+def bench_predict(texts, repeats=PREDICT_REPEATS, batch_size=BATCH_SIZE):
+    import inference_model
+
+    metrics = {}
+    for name, model in (("compact", inference_model.load_model()), ("sklearn", inference_model.SklearnModel(*load_current_pieces()))):
+        single = []
+        for text in texts[:repeats]:
+            start = time.perf_counter()
+            model.predict([text])
+            single.append(time.perf_counter() - start)
+
+        batched = []
+        for i in range(max(1, repeats // 10)):
+            batch = [texts[(i * batch_size + j) % len(texts)] for j in range(batch_size)]
+            start = time.perf_counter()
+            model.predict(batch)
+            batched.append(time.perf_counter() - start)
+
+        metrics[f"predict.{name}.single_p50_ms"], metrics[f"predict.{name}.single_p99_ms"] = percentiles(single)
+        metrics[f"predict.{name}.batch{batch_size}_p50_ms"], metrics[f"predict.{name}.batch{batch_size}_p99_ms"] = percentiles(batched)
+        metrics[f"predict.{name}.batch{batch_size}_per_item_ms"] = round(metrics[f"predict.{name}.batch{batch_size}_p50_ms"] / batch_size, 4)
+    return metrics
+
+def load_current_pieces():
+    import model_bundle
+    bundle = model_bundle.load_bundle()
+    return bundle["vectorizer"], bundle["binarizer"], bundle["classifier"], bundle["metadata"]["version"]
+
+#POST /api/predict from several client threads at once; also times predict_genres_from_text (micro-batched)
+def bench_web(texts, requests=WEB_REQUESTS, concurrency=WEB_CONCURRENCY):
+    #app.py loads the model from the current folder when it is imported
+    import app
+
+    def post(i):
+        client = app.app.test_client()
+        start = time.perf_counter()
+        response = client.post("/api/predict", json={"items": [{"title": "", "description": texts[i % len(texts)]}]})
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/predict answered {response.status_code}")
+        return time.perf_counter() - start
+
+    def predict(i):
+        start = time.perf_counter()
+        app.predict_genres_from_text("", texts[i % len(texts)])
+        return time.perf_counter() - start
+
+    metrics = {}
+    for name, func in (("api_predict", post), ("predict_genres_from_text", predict)):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            timings = list(executor.map(func, range(requests)))
+            elapsed = time.perf_counter() - start
+        metrics[f"web.{name}.requests_per_s"] = round(requests / elapsed, 1)
+        metrics[f"web.{name}.p50_ms"], metrics[f"web.{name}.p99_ms"] = percentiles(timings)
+    return metrics
+
+
+#Bigger is better for throughput metrics, smaller for every time
+def higher_is_better(name):
+    return name.endswith("_per_s")
+
+#Function: list of (metric, baseline, current, change) and the names of the metrics that regressed.
+#change is the relative improvement: positive = better, negative = worse.
+def compare(metrics, baseline, threshold=THRESHOLD):
+    rows, regressions = [], []
+    for name in sorted(metrics):
+        if name not in baseline or not baseline[name]:
+            continue
+        ratio = metrics[name] / baseline[name]
+        change = ratio - 1 if higher_is_better(name) else 1 - ratio
+        rows.append((name, baseline[name], metrics[name], change))
+        if change < -threshold:
+            regressions.append(name)
+    return rows, regressions
+
+def print_comparison(rows, regressions):
+    print(f"\n{'metric':<48}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, old, new, change in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<48}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+
+
+def run(sizes=SIZES, skip=(), crawl_rows=CRAWL_ROWS, crawl_latency=0.0, jobs=1, seed=0):
+    #saga not converging on random synthetic words is expected, and would bury the output
+    warnings.filterwarnings("ignore", message="The max_iter was reached")
+    metrics = {}
+
+    if "crawl" not in skip:
+        print("--- crawl ---")
+        metrics.update(bench_crawl(crawl_rows, latency=crawl_latency))
+
+    #A model is needed by every later stage, so training always runs (at least on the smallest size)
+    print("--- train ---")
+    fitted = None
+    for size in (sizes if "train" not in skip else sizes[:1]):
+        size_metrics, fitted = bench_train(size, jobs)
+        if "train" not in skip:
+            metrics.update(size_metrics)
+
+    texts = [row["title_en"] + " " + row["description"] for row in synthetic.make_rows(PREDICT_REPEATS, seed + 1)]
+
+    if "load" not in skip:
+        print("--- load ---")
+        metrics.update(bench_load(*fitted))
+    else:
+        bench_load(*fitted)
+
+    if "predict" not in skip:
+        print("--- predict ---")
+        metrics.update(bench_predict(texts))
+
+    if "web" not in skip:
+        print("--- web ---")
+        metrics.update(bench_web(texts))
+
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark crawl, train, load and serve, and compare with a baseline")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma separated dataset sizes to train on")
+    parser.add_argument("--skip", default="", help=f"comma separated stages to skip ({', '.join(STAGES)})")
+    parser.add_argument("--crawl-rows", type=int, default=CRAWL_ROWS, help="manga crawled from the stub (at most 10000)")
+    parser.add_argument("--crawl-latency", type=float, default=0.0, help="seconds of latency the stub adds per request")
+    parser.add_argument("--jobs", type=int, default=1, help="training processes (1 keeps the numbers comparable)")
+    parser.add_argument("--out", default=RESULTS_FILE, help="JSON file the results are written to")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="relative slowdown reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 when something regressed")
+    parser.add_argument("--keep-workspace", action="store_true", help="do not delete the temporary data/models folder")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    skip = {stage for stage in args.skip.split(",") if stage}
+    out, baseline_path = os.path.abspath(args.out), os.path.abspath(args.baseline)
+
+    #Every relative data/ and models/ path of the project lands in a throwaway folder
+    workspace = tempfile.mkdtemp(prefix="manga-bench-")
+    previous_dir = os.getcwd()
+    os.chdir(workspace)
+    os.environ.setdefault("MANGA_CACHE_BACKEND", "memory")
+    try:
+        metrics = run(sizes, skip, args.crawl_rows, args.crawl_latency, args.jobs)
+    finally:
+        os.chdir(previous_dir)
+        if args.keep_workspace:
+            print("Workspace kept in", workspace)
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sizes": sizes,
+            "jobs": args.jobs,
+        },
+        "metrics": metrics,
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", out)
+
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressions = compare(metrics, baseline["metrics"], args.threshold)
+        print_comparison(rows, regressions)
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}" if regressions else "\nNo regressions")
+    elif not args.save_baseline:
+        print("No baseline yet, store one with --save-baseline")
+
+    if args.save_baseline:
+        shutil.copyfile(out, baseline_path)
+        print("Baseline saved to", baseline_path)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,82 @@
+#Synthetic manga for the benchmarks.
+#
+#Real MangaDex data cannot be shipped or downloaded reproducibly, so the benchmarks use generated manga that
+#look like it: made-up words, a few genres per manga, and genre-specific words in the descriptions (so the
+#classifier has something to learn and the numbers resemble a real training run).
+#Everything is seeded, so the same size always gives the same data.
+
+import os
+import sys
+import random
+
+#The repo root, so the benchmark scripts can import the project modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dataset_io
+
+GENRES = [
+    "Action", "Adventure", "Comedy", "Drama", "Fantasy", "Horror", "Isekai", "Magic", "Mystery", "Romance",
+    "School Life", "Sci-Fi", "Slice of Life", "Sports", "Supernatural", "Thriller", "Tragedy", "Historical",
+    "Martial Arts", "Psychological",
+]
+
+SYLLABLES = ["ka", "ri", "to", "mi", "su", "ne", "ha", "ro", "yu", "ki", "sa", "no", "te", "ma", "shi", "ga", "ze", "po"]
+
+#Words shared by every genre, and extra words per genre
+COMMON_WORDS = 3000
+GENRE_WORDS = 60
+
+
+def make_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+#Function: (common words, {genre: its words}), always the same for the same seed
+def make_vocabulary(seed=0):
+    rng = random.Random(seed)
+    common = [make_word(rng) for _ in range(COMMON_WORDS)]
+    genre_words = {genre: [make_word(rng) + "n" for _ in range(GENRE_WORDS)] for genre in GENRES}
+    return common, genre_words
+
+#i: position of the manga; rng: random.Random; vocabulary: output of make_vocabulary().
+#Function: one manga entry shaped like the MangaDex /manga API returns it
+def make_manga(i, rng, vocabulary):
+    common, genre_words = vocabulary
+    genres = rng.sample(GENRES, rng.randint(1, 5))
+
+    #Common words are picked with a skew (a few are very frequent), like real text
+    words = [common[int(rng.paretovariate(1.2)) % len(common)] for _ in range(rng.randint(30, 120))]
+    words += [rng.choice(genre_words[rng.choice(genres)]) for _ in range(len(words) // 4)]
+    rng.shuffle(words)
+
+    title = " ".join(word.capitalize() for word in rng.sample(common[:500], rng.randint(1, 4)))
+    return {
+        "id": f"00000000-0000-4000-8000-{i:012d}",
+        "type": "manga",
+        "attributes": {
+            "title": {"en": title},
+            "description": {"en": " ".join(words)},
+            "tags": [{"attributes": {"name": {"en": genre}}} for genre in genres],
+            "availableTranslatedLanguages": ["en"],
+            "updatedAt": f"2024-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}+00:00",
+        },
+        "relationships": [{"type": "cover_art", "attributes": {"fileName": f"cover-{i}.jpg"}}],
+    }
+
+#Function: list of n MangaDex-shaped manga entries
+def make_manga_list(n, seed=0):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(seed)
+    return [make_manga(i, rng, vocabulary) for i in range(n)]
+
+#Function: n dataset rows (dicts with the dataset_io.COLUMNS keys), converted the way the crawler converts them
+def make_rows(n, seed=0):
+    import mangadex_dataset_builder
+    return [mangadex_dataset_builder.manga_to_row(manga) for manga in make_manga_list(n, seed)]
+
+#Writes n synthetic rows as a Parquet dataset folder (in parts of part_size rows, like the crawler)
+def write_dataset(n, dataset_dir, seed=0, part_size=1000):
+    rows = make_rows(n, seed)
+    dataset_io.clear_dataset(dataset_dir)
+    for start in range(0, n, part_size):
+        dataset_io.write_part(rows[start:start + part_size], f"part-{start:06d}.parquet", dataset_dir)
+    return dataset_dir
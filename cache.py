@@ -0,0 +1,142 @@
+#Bounded caches with a time-to-live (TTL) and least-recently-used (LRU) eviction.
+#
+#The web app asks MangaDex for the same popular titles over and over. A cache keeps recent answers:
+#- every entry expires after `ttl` seconds, so data is never older than that
+#- at most `maxsize` entries are kept; when full, the entry that was used longest ago is dropped
+#
+#Two backends with the same get/set/stats methods:
+#- MemoryCache: a dict inside the process (default, fastest, but every worker has its own)
+#- DiskCache: a SQLite file shared by every worker process on the machine
+#make_cache() picks one from the MANGA_CACHE_BACKEND environment variable ("memory" or "disk").
+
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+#Where the shared disk cache lives
+DISK_CACHE_PATH = os.environ.get("MANGA_CACHE_PATH", "data/cache.db")
+
+
+class MemoryCache:
+    """In-process TTL + LRU cache"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        #OrderedDict keeps entries in use order: most recently used at the end
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    #Returns the cached value, or `default` if the key is missing or expired
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counts["misses"] += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                self.counts["expirations"] += 1
+                self.counts["misses"] += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+
+            #Drop the least recently used entries (front of the OrderedDict) while over the limit
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, size=len(self.entries), maxsize=self.maxsize, backend="memory")
+
+
+class DiskCache:
+    """TTL + LRU cache in a SQLite file, shared by every process that opens the same path"""
+
+    #name: the cache's namespace inside the file (several caches can share one file)
+    def __init__(self, name, maxsize=1024, ttl=3600, path=DISK_CACHE_PATH):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        #One connection guarded by a lock; WAL mode lets other processes read while one writes
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (name TEXT, key TEXT, value BLOB, expires_at REAL, last_used REAL, "
+            "PRIMARY KEY (name, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (name, last_used)")
+        self.conn.commit()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM cache WHERE name = ? AND key = ?", (self.name, key)
+            ).fetchone()
+            if row is None:
+                self.counts["misses"] += 1
+                return default
+
+            value, expires_at = row
+            if expires_at < now:
+                self.conn.execute("DELETE FROM cache WHERE name = ? AND key = ?", (self.name, key))
+                self.counts["expirations"] += 1
+                self.counts["misses"] += 1
+                return default
+
+            self.conn.execute("UPDATE cache SET last_used = ? WHERE name = ? AND key = ?", (now, self.name, key))
+            self.counts["hits"] += 1
+            return pickle.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (self.name, key, pickle.dumps(value), now + self.ttl, now),
+            )
+
+            #Drop the least recently used entries while over the limit
+            size = self.conn.execute("SELECT COUNT(*) FROM cache WHERE name = ?", (self.name,)).fetchone()[0]
+            if size > self.maxsize:
+                evicted = self.conn.execute(
+                    "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE name = ? ORDER BY last_used LIMIT ?)",
+                    (self.name, size - self.maxsize),
+                ).rowcount
+                self.counts["evictions"] += evicted
+
+    def stats(self):
+        with self.lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM cache WHERE name = ?", (self.name,)).fetchone()[0]
+            return dict(self.counts, size=size, maxsize=self.maxsize, backend="disk")
+
+
+#name: what the cache holds (also its namespace in the disk file).
+#backend: "memory" or "disk"; defaults to the MANGA_CACHE_BACKEND environment variable, then "memory".
+def make_cache(name, maxsize=1024, ttl=3600, backend=None):
+    backend = backend or os.environ.get("MANGA_CACHE_BACKEND", "memory")
+    if backend == "disk":
+        return DiskCache(name, maxsize, ttl)
+    if backend == "memory":
+        return MemoryCache(maxsize, ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,79 @@
+#Per-genre decision thresholds tuned on out-of-fold probabilities.
+#
+#clf.predict cuts every genre at probability 0.5. Rare genres almost never reach 0.5 (so they are never
+#predicted) while common ones may be over-predicted. The trainer already has an out-of-fold probability for
+#every manga and genre from cross-validation, so the best cut-off per genre can be read off them for free:
+#- per genre, the manga are sorted by probability; predicting the top k of them as positive gives
+#  true positives = cumulative sum of the sorted labels, so F1 at every possible cut-off is one vectorized
+#  expression over the whole (manga x genre) matrix, no loop over candidate thresholds
+#- the threshold is put halfway between the k-th and (k+1)-th probability of the best k
+#- genres with too few positives to trust keep DEFAULT_THRESHOLD
+#The thresholds are shipped in the model bundle and the compact export and used at prediction time.
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.5
+
+#Genres with fewer positive manga than this keep the default threshold
+MIN_POSITIVES = 5
+
+#Tuned thresholds are kept inside this range (an extreme cut-off on few examples does not generalize)
+MIN_THRESHOLD = 0.05
+MAX_THRESHOLD = 0.95
+
+
+#y_true: (manga x genre) 0/1 matrix; proba: the out-of-fold probabilities of the same shape.
+#Function: array with the F1-maximizing threshold of every genre
+def tune_thresholds(y_true, proba, min_positives=MIN_POSITIVES):
+    y_true = np.asarray(y_true)
+    proba = np.asarray(proba, dtype=np.float64)
+    n_rows = proba.shape[0]
+
+    #Every genre column sorted by probability, highest first, with its labels in the same order
+    order = np.argsort(-proba, axis=0, kind="stable")
+    sorted_proba = np.take_along_axis(proba, order, axis=0)
+    sorted_true = np.take_along_axis(y_true, order, axis=0)
+
+    #Predicting the top k manga of a genre: tp = positives among them, and F1 = 2tp / (k + all positives)
+    true_pos = np.cumsum(sorted_true, axis=0)
+    positives = true_pos[-1]
+    predicted = np.arange(1, n_rows + 1)[:, None]
+    f1 = 2 * true_pos / (predicted + np.maximum(positives, 1))
+    best = np.argmax(f1, axis=0)
+
+    #Halfway between the last probability predicted positive and the first one predicted negative
+    columns = np.arange(proba.shape[1])
+    lower = sorted_proba[np.minimum(best + 1, n_rows - 1), columns]
+    thresholds = (sorted_proba[best, columns] + lower) / 2
+    thresholds = np.clip(thresholds, MIN_THRESHOLD, MAX_THRESHOLD)
+
+    thresholds[positives < min_positives] = DEFAULT_THRESHOLD
+    return thresholds.astype(np.float32)
+
+#Function: precision, recall and F1 (micro and macro over genres) of 0/1 predictions
+def scores(y_true, y_pred):
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+    true_pos = (y_true & y_pred).sum(axis=0)
+    false_pos = (~y_true & y_pred).sum(axis=0)
+    false_neg = (y_true & ~y_pred).sum(axis=0)
+
+    tp, fp, fn = true_pos.sum(), false_pos.sum(), false_neg.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        label_f1 = np.where(true_pos > 0, 2 * true_pos / (2 * true_pos + false_pos + false_neg), 0.0)
+    return {
+        "precision_micro": float(tp / (tp + fp)) if tp + fp else 0.0,
+        "recall_micro": float(tp / (tp + fn)) if tp + fn else 0.0,
+        "f1_micro": float(2 * tp / (2 * tp + fp + fn)) if tp else 0.0,
+        "f1_macro": float(label_f1.mean()),
+    }
+
+#predicted / actual: genre names of one manga.
+#Function: precision, recall and F1 of the prediction against the actual genres
+def set_scores(predicted, actual):
+    predicted, actual = set(predicted), set(actual)
+    overlap = len(predicted & actual)
+    precision = overlap / len(predicted) if predicted else 0.0
+    recall = overlap / len(actual) if actual else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if overlap else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
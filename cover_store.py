@@ -0,0 +1,175 @@
+#Bounded, background cover image store for the web app.
+#
+#Covers used to be downloaded inside the user's request, with no size limit and no check of what came back.
+#The store instead:
+#- answers right away: the local cover if it is already on disk, otherwise the placeholder, while the
+#  download runs in a background thread (the page picks the cover up once it is there)
+#- downloads each manga only once at a time: requests for a cover that is already downloading share it
+#- streams the bytes into a temp file and renames it into place only once it is complete and really is an image
+#- keeps the folder under max_bytes by deleting the least recently used covers (every use touches the file's mtime)
+
+import os
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import client
+import metrics
+
+logger = logging.getLogger("manga.covers")
+
+COVER_DIR = "static/covers"
+PLACEHOLDER_URL = "/static/placeholder.png"
+
+#Total disk space the covers may use
+MAX_BYTES = 200 * 1024 * 1024
+
+#A single cover bigger than this is refused (the 256px thumbnails are a few dozen KB)
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+#The first bytes of the image formats MangaDex serves (WebP is checked apart, see is_image)
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF8")
+
+#head: the first 12 bytes of a file.
+#Function: True if they start one of the image formats. WebP is a RIFF file with "WEBP" at byte 8;
+#other RIFF files (WAV, AVI) start the same way and are refused.
+def is_image(head):
+    return head.startswith(IMAGE_SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+
+
+class CoverStore:
+    def __init__(self, directory=COVER_DIR, max_bytes=MAX_BYTES, workers=4, http=client):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.http = http
+        os.makedirs(directory, exist_ok=True)
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cover")
+        #manga id -> Future of its running download
+        self.inflight = {}
+        #Re-entrant: a download that is already finished runs its done callback (which takes the lock) right inside fetch()
+        self.lock = threading.RLock()
+
+        #Running estimate of the folder size; the folder is rescanned whenever it goes over the limit
+        self.total_bytes = sum(size for _, size, _ in self._files())
+
+    def path(self, manga_id):
+        return os.path.join(self.directory, f"{manga_id}.jpg")
+
+    #URL the cover is served from once it is on disk
+    def local_url(self, manga_id):
+        return "/" + self.path(manga_id).replace(os.sep, "/")
+
+    def is_pending(self, manga_id):
+        with self.lock:
+            return manga_id in self.inflight
+
+    #manga_id: the manga's id; file_name: its cover file name on MangaDex.
+    #Function: returns the local cover URL if the cover is ready, otherwise starts (or joins) its download
+    #in the background and returns the placeholder URL.
+    def cover_url(self, manga_id, file_name):
+        path = self.path(manga_id)
+        if os.path.exists(path):
+            #Mark it as recently used for the LRU eviction
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return self.local_url(manga_id)
+
+        self.fetch(manga_id, file_name)
+        return PLACEHOLDER_URL
+
+    #Starts the download of a cover unless it is already running; returns its Future
+    def fetch(self, manga_id, file_name):
+        with self.lock:
+            future = self.inflight.get(manga_id)
+            if future is None:
+                future = self.executor.submit(self._download, manga_id, file_name)
+                self.inflight[manga_id] = future
+                future.add_done_callback(lambda _: self._done(manga_id))
+            return future
+
+    def _done(self, manga_id):
+        with self.lock:
+            self.inflight.pop(manga_id, None)
+
+    #Timed as the "cover_download" stage; failures are counted as upstream errors of kind "cover"
+    def _download(self, manga_id, file_name):
+        with metrics.STAGE_SECONDS.time(stage="cover_download"):
+            return self._download_file(manga_id, file_name)
+
+    def _download_file(self, manga_id, file_name):
+        url = f"https://uploads.mangadex.org/covers/{manga_id}/{file_name}.256.jpg"
+        tmp_path = None
+        response = None
+        try:
+            response = self.http.get(url, stream=True)
+            if response.status_code != 200 or not response.headers.get("Content-Type", "image/").startswith("image/"):
+                logger.warning("Error downloading cover %s: HTTP %s", manga_id, response.status_code)
+                metrics.UPSTREAM_ERRORS.inc(kind="cover", reason=str(response.status_code))
+                return False
+
+            #Stream into a temp file next to the final one, so the rename below is atomic
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            size = 0
+            head = b""
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        raise ValueError("cover too large")
+                    if len(head) < 12:
+                        head += chunk[:12 - len(head)]
+                    f.write(chunk)
+
+            if not is_image(head):
+                raise ValueError("not an image")
+
+            os.replace(tmp_path, self.path(manga_id))
+            tmp_path = None
+            logger.info("Downloaded cover %s", self.path(manga_id))
+
+            with self.lock:
+                self.total_bytes += size
+                over_limit = self.total_bytes > self.max_bytes
+            if over_limit:
+                self.evict()
+            return True
+
+        except Exception as e:
+            logger.warning("Error downloading cover %s: %s", manga_id, e)
+            metrics.UPSTREAM_ERRORS.inc(kind="cover", reason=type(e).__name__)
+            return False
+
+        #The connection goes back to the pool on every path, including a refused or half-written cover
+        finally:
+            if response is not None:
+                response.close()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    #(path, size, last used time) of every stored cover
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    #Deletes the least recently used covers until the folder fits in max_bytes
+    def evict(self):
+        with self.lock:
+            files = sorted(self._files(), key=lambda item: item[2])
+            total = sum(size for _, size, _ in files)
+            for path, size, _ in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self.total_bytes = total
@@ -0,0 +1,143 @@
+#Reading and writing the manga dataset in a columnar format (Parquet).
+#
+#The old CSV had to strip commas out of titles/descriptions and pack tags into a "|" string.
+#Parquet stores every column separately, keeps text exactly as it came from MangaDex, and stores tags
+#as a real list column. Readers can load just the columns they need, and the file can be memory mapped
+#so the OS pages it in on demand instead of copying the whole thing into RAM first.
+#
+#The dataset is a folder of part files (part-000000.parquet, part-001000.parquet, ...). The crawler adds
+#parts as pages arrive, and pyarrow reads the whole folder as one table.
+
+import os
+import shutil
+import argparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATASET_DIR = "data/manga_dataset"
+
+#The old CSV dataset, still readable if no Parquet dataset has been built yet
+LEGACY_CSV = "data/manga_dataset.csv"
+
+SCHEMA = pa.schema([
+    ("manga_id", pa.string()),
+    ("title_ja", pa.string()),
+    ("title_en", pa.string()),
+    ("tags", pa.list_(pa.string())),
+    ("cover_image_path", pa.string()),
+    ("description", pa.string()),
+])
+
+COLUMNS = SCHEMA.names
+
+
+#rows: list of dicts with the COLUMNS keys (tags is a list of strings), or an already built Table
+def rows_to_table(rows):
+    if isinstance(rows, pa.Table):
+        return rows
+    return pa.Table.from_pylist(rows, schema=SCHEMA)
+
+#Writes one part file atomically (temp file, then rename), so a crash never leaves a broken part behind
+def write_part(rows, name, dataset_dir=DATASET_DIR):
+    os.makedirs(dataset_dir, exist_ok=True)
+    path = os.path.join(dataset_dir, name)
+    tmp_path = path + ".tmp"
+    pq.write_table(rows_to_table(rows), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+#Deletes every part file (used when a crawl starts over)
+def clear_dataset(dataset_dir=DATASET_DIR):
+    if os.path.isdir(dataset_dir):
+        shutil.rmtree(dataset_dir)
+    os.makedirs(dataset_dir, exist_ok=True)
+
+#Replaces the whole dataset with one freshly written table.
+#The new data is written into a side folder first and then swapped in with renames.
+def replace_dataset(rows, dataset_dir=DATASET_DIR):
+    new_dir = dataset_dir + ".new"
+    old_dir = dataset_dir + ".old"
+    for path in (new_dir, old_dir):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    write_part(rows, "part-000000.parquet", new_dir)
+
+    if os.path.isdir(dataset_dir):
+        os.replace(dataset_dir, old_dir)
+    os.replace(new_dir, dataset_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+
+def has_parts(dataset_dir=DATASET_DIR):
+    return bool(list_parts(dataset_dir))
+
+#columns: only these columns are read from disk (None = all of them).
+#memory_map: map the files into memory instead of reading them into buffers first.
+#Function: loads the dataset as a pyarrow Table. Falls back to the old CSV if no Parquet dataset exists.
+def load_table(columns=None, memory_map=True, dataset_dir=DATASET_DIR, legacy_csv=LEGACY_CSV):
+    if has_parts(dataset_dir):
+        return pq.read_table(dataset_dir, columns=columns, memory_map=memory_map)
+    return read_legacy_csv(legacy_csv, columns)
+
+#Same as load_table, but as a pandas DataFrame (tags come out as a list per row, no splitting needed)
+def load_dataset(columns=None, memory_map=True, dataset_dir=DATASET_DIR, legacy_csv=LEGACY_CSV):
+    return load_table(columns, memory_map, dataset_dir, legacy_csv).to_pandas()
+
+#Part files of the dataset, in order
+def list_parts(dataset_dir=DATASET_DIR):
+    if not os.path.isdir(dataset_dir):
+        return []
+    return sorted(name for name in os.listdir(dataset_dir) if name.endswith(".parquet"))
+
+#Function: {part name: row count} from the Parquet footers (nothing else is read); the old CSV counts as "legacy.csv"
+def part_row_counts(dataset_dir=DATASET_DIR, legacy_csv=LEGACY_CSV):
+    if not has_parts(dataset_dir):
+        return {"legacy.csv": read_legacy_csv(legacy_csv, ["tags"]).num_rows}
+    return {name: pq.ParquetFile(os.path.join(dataset_dir, name)).metadata.num_rows for name in list_parts(dataset_dir)}
+
+#batch_size: rows per batch; parts: only read these part files (None = all of them).
+#Function: yields (part name, pandas DataFrame) batches one at a time, so only one batch is ever in memory.
+#The old CSV (read in one go, it is small) comes out as part name "legacy.csv".
+def iter_batches(columns=None, batch_size=10000, dataset_dir=DATASET_DIR, legacy_csv=LEGACY_CSV, parts=None):
+    if not has_parts(dataset_dir):
+        for batch in read_legacy_csv(legacy_csv, columns).to_batches(batch_size):
+            yield "legacy.csv", batch.to_pandas()
+        return
+
+    for name in list_parts(dataset_dir):
+        if parts is not None and name not in parts:
+            continue
+        part = pq.ParquetFile(os.path.join(dataset_dir, name), memory_map=True)
+        for batch in part.iter_batches(batch_size=batch_size, columns=columns):
+            yield name, batch.to_pandas()
+
+#Reads the old comma-stripped CSV and turns the "|" tags string into a list column
+def read_legacy_csv(path=LEGACY_CSV, columns=None):
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+
+    table = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(
+        column_types={name: pa.string() for name in COLUMNS},
+        strings_can_be_null=True,
+    ))
+
+    #Old CSVs written before manga ids were recorded have no manga_id column
+    if "manga_id" not in table.column_names:
+        table = table.add_column(0, "manga_id", pa.nulls(len(table), pa.string()))
+
+    table = table.set_column(table.column_names.index("tags"), "tags", pc.split_pattern(table["tags"], "|"))
+    table = table.select(COLUMNS).cast(SCHEMA)
+    return table.select(columns) if columns else table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the old CSV dataset into the Parquet dataset")
+    parser.add_argument("csv", nargs="?", default=LEGACY_CSV, help="CSV file to convert")
+    parser.add_argument("--out", default=DATASET_DIR, help="dataset folder to write")
+    args = parser.parse_args()
+
+    table = read_legacy_csv(args.csv)
+    replace_dataset(table, args.out)
+    print(f"Wrote {len(table)} rows to {args.out}")
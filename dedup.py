@@ -0,0 +1,205 @@
+#Normalization and deduplication of dataset rows, run as rows arrive.
+#
+#Offset paging over a catalogue that changes while it is crawled returns some manga twice, and MangaDex also
+#has separate entries with the same description (official colored versions, re-uploads...). Duplicates make
+#TF-IDF fitting slower and leak between cross-validation folds (the same text in the train and test fold).
+#Every row goes through three checks, cheapest first:
+#- the manga id was already kept
+#- the normalized description (lowercase, no links or markup) hashes the same as a kept one
+#- the description is a near duplicate of a kept one: MinHash signatures of its 3-word shingles are bucketed
+#  with LSH (locality-sensitive hashing), so only rows sharing a bucket are compared, never all pairs
+#Short descriptions are only checked by id ("Oneshot." is not a duplicate of every other oneshot).
+#
+#The crawler and the store export use a Deduplicator; on its own, this script dedupes an existing dataset:
+#    python dedup.py
+
+import os
+import re
+import zlib
+import shutil
+import hashlib
+import argparse
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+import dataset_io
+
+#Hash functions per MinHash signature, split into BANDS bands of NUM_PERM / BANDS values for LSH.
+#16 bands of 4 make rows with ~50% shingle overlap share a bucket; the threshold below decides the rest.
+NUM_PERM = 64
+BANDS = 16
+
+#Share of equal signature values (an estimate of the shingle overlap) from which a row is a near duplicate
+NEAR_DUP_THRESHOLD = 0.8
+
+#Words in a shingle, and the fewest words a description needs to be checked on its content
+SHINGLE_WORDS = 3
+MIN_WORDS = 10
+
+#Mersenne prime for the hash functions (a * x + b) mod PRIME; under 2^31 so a * x fits in 64 bits
+PRIME = (1 << 31) - 1
+
+#Reasons a row is dropped, as they appear in the report
+REASONS = ("duplicate_id", "duplicate_description", "near_duplicate")
+
+
+#row: dict with the dataset_io.COLUMNS keys.
+#Function: a cleaned copy: unicode in one canonical form, one kind of line break, no stray whitespace and no repeated tags
+def normalize_row(row):
+    row = dict(row)
+    for column in ("title_ja", "title_en", "description"):
+        value = row.get(column)
+        if isinstance(value, str):
+            value = unicodedata.normalize("NFC", value).replace("\r\n", "\n").replace("\r", "\n")
+            row[column] = value.strip()
+    if row.get("tags") is not None:
+        row["tags"] = list(dict.fromkeys(tag.strip() for tag in row["tags"] if tag and tag.strip()))
+    return row
+
+#Function: lowercase words of a description without links or markup, what the content checks compare
+def content_words(text):
+    text = unicodedata.normalize("NFKC", text if isinstance(text, str) else "").lower()
+    text = re.sub(r"https?://\S+", " ", text)
+    return re.findall(r"\w+", text)
+
+
+class Deduplicator:
+    """Remembers every kept row and tells whether a new one duplicates any of them"""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=NEAR_DUP_THRESHOLD, min_words=MIN_WORDS, seed=0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.threshold = threshold
+        self.min_words = min_words
+
+        self.ids = set()
+        self.digests = set()
+        #Signature of every kept row, and {(band, band values): [positions in signatures]}
+        self.signatures = []
+        self.buckets = {}
+        self.counts = Counter()
+
+    #Function: MinHash signature of a list of words: per hash function, the smallest hash over every shingle
+    def signature(self, words):
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+        x = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles)) % PRIME
+        #Every shingle through every hash function at once: (shingles x NUM_PERM)
+        return ((x[:, None] * self.a + self.b) % PRIME).min(axis=0).astype(np.uint32)
+
+    #Function: (manga id, description hash, signature); the last two are None for short descriptions
+    def fingerprint(self, row):
+        words = content_words(row.get("description"))
+        if len(words) < self.min_words:
+            return row.get("manga_id"), None, None
+        digest = hashlib.blake2b(" ".join(words).encode(), digest_size=16).digest()
+        return row.get("manga_id"), digest, self.signature(words)
+
+    def band_keys(self, signature):
+        step = self.rows_per_band
+        return [(band, signature[band * step:(band + 1) * step].tobytes()) for band in range(self.bands)]
+
+    #Function: the reason the fingerprinted row duplicates a kept one, or None if it is new
+    def check(self, fingerprint):
+        manga_id, digest, signature = fingerprint
+        if manga_id and manga_id in self.ids:
+            return "duplicate_id"
+        if digest is None:
+            return None
+        if digest in self.digests:
+            return "duplicate_description"
+
+        #Only rows that share at least one band with this one are compared
+        candidates = set()
+        for key in self.band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        for position in candidates:
+            if np.mean(self.signatures[position] == signature) >= self.threshold:
+                return "near_duplicate"
+        return None
+
+    #Remembers a row as kept (also used to load the rows of an interrupted crawl back in)
+    def add(self, fingerprint):
+        manga_id, digest, signature = fingerprint
+        if manga_id:
+            self.ids.add(manga_id)
+        if digest is None:
+            return
+        self.digests.add(digest)
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for key in self.band_keys(signature):
+            self.buckets.setdefault(key, []).append(position)
+
+    #Function: True if the row is new (it is remembered), False if it is dropped (the reason is counted)
+    def keep(self, row):
+        fingerprint = self.fingerprint(row)
+        reason = self.check(fingerprint)
+        self.counts["seen"] += 1
+        if reason:
+            self.counts[reason] += 1
+            return False
+        self.counts["kept"] += 1
+        self.add(fingerprint)
+        return True
+
+    #Function: yields the normalized rows that are not duplicates, as they come
+    def filter(self, rows):
+        for row in rows:
+            row = normalize_row(row)
+            if self.keep(row):
+                yield row
+
+    def dropped(self):
+        return sum(self.counts[reason] for reason in REASONS)
+
+    def report(self):
+        details = ", ".join(f"{reason}: {self.counts[reason]}" for reason in REASONS)
+        return f"Dedup: {self.counts['kept']} of {self.counts['seen']} rows kept, {self.dropped()} dropped ({details})"
+
+
+#Dedupes an existing dataset folder (or the old CSV) part by part, into a side folder swapped in at the end.
+#Only one part is in memory at a time. Function: the Deduplicator, for its counts
+def dedupe_dataset(dataset_dir=dataset_io.DATASET_DIR, legacy_csv=dataset_io.LEGACY_CSV):
+    new_dir = dataset_dir + ".dedup"
+    old_dir = dataset_dir + ".old"
+    for path in (new_dir, old_dir):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+    os.makedirs(new_dir)
+
+    deduper = Deduplicator()
+    part_name, part_rows = None, []
+    for name, df in dataset_io.iter_batches(dataset_io.COLUMNS, dataset_dir=dataset_dir, legacy_csv=legacy_csv):
+        #The old CSV becomes the first part of a Parquet dataset
+        name = name if name.endswith(".parquet") else "part-000000.parquet"
+        #Batches of a part come one after the other, so a new name means the previous part is complete
+        if name != part_name and part_name is not None:
+            dataset_io.write_part(part_rows, part_name, new_dir)
+            part_rows = []
+        part_name = name
+        #Missing values come out of pandas as NaN, Parquet wants None
+        df = df.astype(object).where(df.notna(), None)
+        rows = [dict(row, tags=None if row["tags"] is None else list(row["tags"])) for row in df.to_dict("records")]
+        part_rows.extend(deduper.filter(rows))
+    if part_name is not None:
+        dataset_io.write_part(part_rows, part_name, new_dir)
+
+    if os.path.isdir(dataset_dir):
+        os.replace(dataset_dir, old_dir)
+    os.replace(new_dir, dataset_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+    return deduper
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalize and deduplicate the manga dataset in place")
+    parser.add_argument("--dataset-dir", default=dataset_io.DATASET_DIR)
+    parser.add_argument("--legacy-csv", default=dataset_io.LEGACY_CSV, help="old CSV dataset, used when the folder has no parts")
+    args = parser.parse_args()
+
+    print(dedupe_dataset(args.dataset_dir, args.legacy_csv).report())
@@ -0,0 +1,141 @@
+#Cache of the vectorized training data, so re-running the trainer on the same data skips TF-IDF fitting.
+#
+#Each cache entry is a folder named after a hash of (dataset content + vectorizer settings). It holds:
+#- the CSR matrix X split into its three NumPy arrays (data / indices / indptr) as .npy files
+#- the binarized labels Y as a .npy file
+#- the fitted vectorizer and label binarizer (joblib)
+#Plain .npy files can be memory mapped (np.load(..., mmap_mode="r")), so a cache hit does not even read
+#the matrices into RAM up front; pages are loaded by the OS when the trainer touches them.
+#If the dataset or the settings change, the hash changes and a new entry is built.
+#Entries are a copy of the whole training matrix, so old ones are pruned: every entry of the current dataset
+#is kept (each one can still be hit, e.g. every setting of hyperparam_search), but of the entries built from
+#earlier versions of the dataset only the MAX_ENTRIES most recently used stay.
+#A cache hit hands out memory-mapped arrays whose files must outlive it: a caller holding entries of another
+#dataset passes their keys as `protect`, or builds with prune=False and calls prune_cache() once it is done.
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+import joblib
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import MultiLabelBinarizer
+
+CACHE_DIR = "models/feature_cache"
+
+#Entries of earlier versions of the dataset kept; older ones are deleted after a new entry is saved
+MAX_ENTRIES = 3
+
+
+#Hash of the dataset content: every text and its tags.
+#pandas hashes whole columns at once (no Python loop per row), and the row hashes are then hashed together.
+def dataset_fingerprint(texts, tags):
+    tag_strings = pd.Series(["|".join(row) for row in tags], dtype=object)
+    row_hashes = pd.util.hash_pandas_object(pd.DataFrame({"text": pd.Series(texts, dtype=object).reset_index(drop=True), "tags": tag_strings}), index=False)
+    return hashlib.sha256(row_hashes.to_numpy().tobytes()).hexdigest()
+
+#The cache key covers the data and the vectorizer settings, so changing either one builds a new entry.
+#fingerprint: dataset_fingerprint(texts, tags) if it is already known (hashing the data is the slow part)
+def cache_key(texts, tags, vectorizer_params, fingerprint=None):
+    digest = hashlib.sha256()
+    digest.update((fingerprint or dataset_fingerprint(texts, tags)).encode())
+    digest.update(json.dumps(vectorizer_params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+#Writes one cache entry into a temp folder, then renames it into place (a crash never leaves half an entry)
+#fingerprint: the dataset_fingerprint() of the data, which tells prune_cache() the entry is still current
+def save_features(key, X, Y, vectorizer, mlb, cache_dir=CACHE_DIR, fingerprint=None):
+    path = os.path.join(cache_dir, key)
+    tmp_path = path + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    X = sparse.csr_matrix(X)
+    np.save(os.path.join(tmp_path, "X_data.npy"), X.data)
+    np.save(os.path.join(tmp_path, "X_indices.npy"), X.indices)
+    np.save(os.path.join(tmp_path, "X_indptr.npy"), X.indptr)
+    np.save(os.path.join(tmp_path, "Y.npy"), np.asarray(Y))
+    joblib.dump(vectorizer, os.path.join(tmp_path, "vectorizer.pkl"))
+    joblib.dump(mlb, os.path.join(tmp_path, "binarizer.pkl"))
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"shape": list(X.shape), "dataset": fingerprint}, f)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+#Loads a cache entry, or returns None if there is none for this key.
+#mmap_mode="r" maps the arrays read-only instead of copying them into memory.
+def load_features(key, cache_dir=CACHE_DIR, mmap_mode="r"):
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        shape = tuple(json.load(f)["shape"])
+
+    data = np.load(os.path.join(path, "X_data.npy"), mmap_mode=mmap_mode)
+    indices = np.load(os.path.join(path, "X_indices.npy"), mmap_mode=mmap_mode)
+    indptr = np.load(os.path.join(path, "X_indptr.npy"), mmap_mode=mmap_mode)
+    X = sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    Y = np.load(os.path.join(path, "Y.npy"), mmap_mode=mmap_mode)
+    vectorizer = joblib.load(os.path.join(path, "vectorizer.pkl"))
+    mlb = joblib.load(os.path.join(path, "binarizer.pkl"))
+
+    #The time of meta.json is the entry's last use, which decides what prune_cache() keeps
+    os.utime(os.path.join(path, "meta.json"))
+    return X, Y, vectorizer, mlb
+
+#fingerprint: dataset_fingerprint() of the current dataset, whose entries are all kept; protect: keys never deleted.
+#Function: deletes all but the `keep` most recently used of the other entries, returns how many were deleted.
+#Temp folders, which another run may still be writing, are left alone.
+def prune_cache(cache_dir=CACHE_DIR, keep=MAX_ENTRIES, fingerprint=None, protect=()):
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = []
+    for entry in os.scandir(cache_dir):
+        meta = os.path.join(entry.path, "meta.json")
+        if not entry.is_dir() or entry.name.endswith(".tmp") or entry.name in protect or not os.path.exists(meta):
+            continue
+        with open(meta, encoding="utf-8") as f:
+            if fingerprint is not None and json.load(f).get("dataset") == fingerprint:
+                continue
+        entries.append((os.path.getmtime(meta), entry.path))
+
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+    return max(len(entries) - keep, 0)
+
+#texts: the prepared training texts.
+#tags: list of tag lists, one per text.
+#vectorizer_params: TfidfVectorizer settings.
+#prune: prune the cache after saving a new entry (pass False while holding entries of another dataset).
+#Function: returns (X, Y, vectorizer, mlb), from the cache when possible, otherwise fits them and fills the cache.
+def get_or_build(texts, tags, vectorizer_params, cache_dir=CACHE_DIR, prune=True):
+    fingerprint = dataset_fingerprint(texts, tags)
+    key = cache_key(texts, tags, vectorizer_params, fingerprint)
+
+    cached = load_features(key, cache_dir)
+    if cached is not None:
+        print(f"Using cached features {key}")
+        return cached
+
+    print(f"Building features {key}")
+    mlb = MultiLabelBinarizer()
+    Y = mlb.fit_transform(tags)
+    vectorizer = TfidfVectorizer(**vectorizer_params)
+    X = vectorizer.fit_transform(texts)
+
+    save_features(key, X, Y, vectorizer, mlb, cache_dir, fingerprint)
+    if prune:
+        pruned = prune_cache(cache_dir, fingerprint=fingerprint, protect={key})
+        if pruned:
+            print(f"Removed {pruned} old feature cache entries")
+    return X, Y, vectorizer, mlb
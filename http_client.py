@@ -0,0 +1,201 @@
+#Shared HTTP client used by the dataset builder and the web app.
+#
+#Every bare requests.get() opens a brand new TCP/TLS connection. A requests.Session keeps connections
+#alive in a pool, so repeated calls to the same host (api.mangadex.org, uploads.mangadex.org) reuse them.
+#On top of that this module adds timeouts, retries with exponential backoff + jitter, respects the
+#server's rate-limit headers, and keeps per-host counters so we can see where time goes.
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+#(connect timeout, read timeout) in seconds. Without a timeout a stuck server would hang the caller forever.
+DEFAULT_TIMEOUT = (5, 30)
+
+#How many connections are kept open per host
+POOL_SIZE = 10
+
+#Status codes worth retrying: rate limited, or a temporary server-side problem
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+#Token bucket rate limiter: tokens refill at `rate` per second up to `capacity`.
+#Every request takes one token, and waits if the bucket is empty.
+#This lets short bursts through while keeping the average at the API limit, and it can be shared by many threads.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+
+                #Refill the bucket based on how much time passed since the last check
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                #How long until one full token is available
+                wait_time = (1 - self.tokens) / self.rate
+
+            time.sleep(wait_time)
+
+
+#Reads how long the server wants us to wait, in seconds, or None if it did not say.
+#Retry-After is either a number of seconds or an HTTP date.
+#MangaDex also sends X-RateLimit-Retry-After as a unix timestamp.
+def parse_retry_after(response):
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    value = response.headers.get("X-RateLimit-Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value) - time.time())
+        except ValueError:
+            pass
+
+    return None
+
+
+class HttpClient:
+    """Pooled HTTP client with retries, backoff and per-host stats"""
+
+    #timeout: (connect, read) seconds used when a call does not pass its own.
+    #retries: how many extra attempts after the first one fails.
+    #backoff: base delay in seconds, doubled on every retry.
+    #max_backoff: the delay never grows past this.
+    #pool_size: connections kept alive per host.
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=3, backoff=0.5, max_backoff=30.0, pool_size=POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        #One session for everything; the adapter holds the keep-alive connection pool.
+        #max_retries=0 because retrying is done here, where we can read the rate-limit headers.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        #host -> counters, and host -> time before which we should not call that host again
+        self._stats = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    #Exponential backoff with "full jitter": a random delay between 0 and base * 2^attempt.
+    #The randomness stops many clients from retrying in lockstep.
+    def _backoff_delay(self, attempt, backoff):
+        return random.uniform(0, min(self.max_backoff, backoff * (2 ** attempt)))
+
+    def _record(self, host, **counts):
+        with self._lock:
+            stats = self._stats.setdefault(host, {"requests": 0, "retries": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0})
+            for key, value in counts.items():
+                if key == "latency":
+                    stats["latency_total"] += value
+                    stats["latency_max"] = max(stats["latency_max"], value)
+                else:
+                    stats[key] += value
+
+    #If the server told us to back off (429 or X-RateLimit-Remaining: 0), every thread waits, not just the one that was told
+    def _wait_if_blocked(self, host):
+        with self._lock:
+            blocked_until = self._blocked_until.get(host, 0)
+        delay = blocked_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _block(self, host, seconds):
+        with self._lock:
+            self._blocked_until[host] = max(self._blocked_until.get(host, 0), time.time() + seconds)
+
+    def get(self, url, params=None, timeout=None, stream=False, retries=None, backoff=None, rate_limiter=None):
+        """GET a URL, retrying connection errors, 429 and 5xx responses.
+
+        Returns the last response (which may still be an error status, callers decide what to do with it).
+        Raises the last connection error if no response was ever received.
+        """
+        host = urlparse(url).netloc
+        retries = self.retries if retries is None else retries
+        backoff = self.backoff if backoff is None else backoff
+        timeout = timeout or self.timeout
+
+        for attempt in range(retries + 1):
+            self._wait_if_blocked(host)
+
+            #Optional client-side limiter (e.g. the crawler's token bucket); taken on every attempt, retries included
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(host, requests=1, latency=time.perf_counter() - start)
+                if attempt == retries:
+                    self._record(host, errors=1)
+                    raise
+                self._record(host, retries=1)
+                time.sleep(self._backoff_delay(attempt, backoff))
+                continue
+
+            self._record(host, requests=1, latency=time.perf_counter() - start)
+
+            #The server says this was our last request for now: hold off until it resets
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                wait_time = parse_retry_after(response)
+                if wait_time:
+                    self._block(host, wait_time)
+
+            if response.status_code not in RETRY_STATUSES:
+                return response
+
+            if attempt == retries:
+                self._record(host, errors=1)
+                return response
+
+            #Use the server's own wait time when it gives one, otherwise back off
+            wait_time = parse_retry_after(response)
+            if wait_time is None:
+                wait_time = self._backoff_delay(attempt, backoff)
+            else:
+                self._block(host, wait_time)
+
+            self._record(host, retries=1)
+            response.close()
+            time.sleep(wait_time)
+
+    def stats(self):
+        """Per-host copy of the counters, with the average latency filled in"""
+        with self._lock:
+            snapshot = {host: dict(stats) for host, stats in self._stats.items()}
+        for stats in snapshot.values():
+            stats["latency_avg"] = stats["latency_total"] / stats["requests"] if stats["requests"] else 0.0
+        return snapshot
+
+
+#One shared client per process, so every module reuses the same connection pool
+client = HttpClient()
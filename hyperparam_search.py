@@ -0,0 +1,257 @@
+#Hyperparameter search for the genre classifier (TF-IDF settings + LogisticRegression C and class weights).
+#
+#supervised_trainer.py trains one fixed setting with a full 10-fold run. Trying other settings that way
+#means one full run per setting. This search is cheaper in four ways:
+#- the folds are made once and every candidate is scored on the same folds, and each TF-IDF setting is
+#  vectorized once through the feature cache (feature_store), shared by every candidate that uses it
+#- candidates that only differ in C form a regularization path: each genre is fitted from the smallest C
+#  to the largest with warm_start, so every fit starts from the previous solution instead of from zero
+#- successive halving: every candidate is first scored on a few folds, only the best 1/ETA get more folds,
+#  and so on until the survivors have used all of them. Weak settings stop early
+#- all (fold, genre, path) fits of a round run in parallel, like parallel_training.cross_validate
+#Candidates are scored like the served model: micro F1 with per-genre thresholds tuned on their out-of-fold
+#probabilities (calibration.py). The leaderboard puts the score next to the cost of training and serving,
+#and marks the candidates no other one beats on both score and prediction time.
+#
+#    python hyperparam_search.py
+#    python hyperparam_search.py --max-features 5000 20000 --ngrams 1 2 --C 0.5 1 2 4 --jobs 8
+
+import os
+import json
+import math
+import time
+import argparse
+import itertools
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.linear_model import LogisticRegression
+
+import calibration
+import feature_store
+import parallel_training
+import supervised_trainer
+
+#The search space (each can be changed on the command line)
+MAX_FEATURES = [5000, 10000, 20000]
+NGRAMS = [1, 2]
+SUBLINEAR_TF = [False, True]
+CLASS_WEIGHTS = [None]
+C_VALUES = [0.5, 1, 2, 4, 8]
+
+#Folds every candidate starts with, and 1/ETA of the candidates is kept after each round (with ETA times the folds)
+MIN_FOLDS = 2
+ETA = 3
+
+#Texts vectorized and scored to time prediction
+PREDICT_SAMPLE = 1000
+
+LEADERBOARD_FILE = "models/hyperparam_search.json"
+
+
+#Function: list of paths, each {"vectorizer": TfidfVectorizer settings, "class_weight": ..., "C": [ascending C values]}
+def make_paths(max_features=MAX_FEATURES, ngrams=NGRAMS, sublinear_tf=SUBLINEAR_TF, class_weights=CLASS_WEIGHTS, c_values=C_VALUES):
+    paths = []
+    for features, ngram, sublinear, class_weight in itertools.product(max_features, ngrams, sublinear_tf, class_weights):
+        vectorizer = dict(supervised_trainer.vectorizer_params, max_features=features, ngram_range=(1, ngram), sublinear_tf=sublinear)
+        paths.append({"vectorizer": vectorizer, "class_weight": class_weight, "C": sorted(c_values)})
+    return paths
+
+#X, Y: the features of the path's TF-IDF setting and the labels; label: the genre column this task fits.
+#c_values: ascending C values still in the search for this path.
+#Function: [(test-row probabilities, fit seconds) per C]; every fit after the first starts from the previous one
+def fit_path(X, Y, label, train_idx, test_idx, c_values, class_weight, params):
+    y_train = np.asarray(Y[train_idx, label])
+    if y_train.min() == y_train.max():
+        #Only one class in this training fold: predict it, as parallel_training.fit_label does
+        return [(np.full(len(test_idx), float(y_train[0]), dtype=np.float32), 0.0)] * len(c_values)
+
+    X_train, X_test = X[train_idx], X[test_idx]
+    estimator = LogisticRegression(**params, class_weight=class_weight, warm_start=True)
+    results = []
+    for C in c_values:
+        start = time.perf_counter()
+        estimator.set_params(C=C).fit(X_train, y_train)
+        seconds = time.perf_counter() - start
+        results.append((estimator.predict_proba(X_test)[:, 1].astype(np.float32), seconds))
+    return results
+
+#Function: milliseconds to vectorize and score PREDICT_SAMPLE texts with this vectorizer (best of 3)
+def predict_cost(vectorizer, texts, n_labels):
+    coef = np.random.default_rng(0).random((len(vectorizer.vocabulary_), n_labels), dtype=np.float32)
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        X = vectorizer.transform(texts)
+        X @ coef
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 * PREDICT_SAMPLE / len(texts)
+
+#Marks the candidates on the score / prediction cost front: no other candidate scores at least as well and predicts faster.
+#Scores on different numbers of folds are not comparable, so only the candidates that reached the most folds
+#(the finalists) are compared; the ones dropped in earlier rounds are never on the front.
+def mark_front(leaderboard):
+    final_folds = max((entry["folds"] for entry in leaderboard), default=0)
+    finalists = [entry for entry in leaderboard if entry["folds"] == final_folds]
+    for entry in leaderboard:
+        entry["front"] = entry["folds"] == final_folds and not any(
+            other["f1_micro"] >= entry["f1_micro"] and other["predict_ms"] < entry["predict_ms"]
+            or other["f1_micro"] > entry["f1_micro"] and other["predict_ms"] <= entry["predict_ms"]
+            for other in finalists
+        )
+
+def print_leaderboard(leaderboard, top=20):
+    print(f"{'#':>3} {'features':>8} {'ngram':>5} {'sublin':>6} {'weight':>8} {'C':>5} {'folds':>5} {'F1 micro':>8} {'F1 macro':>8} "
+          f"{'train s':>8} {'pred ms':>8} {'MB':>6}")
+    for rank, entry in enumerate(leaderboard[:top], start=1):
+        print(f"{rank:>3} {entry['max_features'] or 'all':>8} {'1-' + str(entry['ngram']):>5} {str(entry['sublinear_tf']):>6} "
+              f"{str(entry['class_weight']):>8} {entry['C']:>5} {entry['folds']:>5} {entry['f1_micro']:>8.4f} {entry['f1_macro']:>8.4f} "
+              f"{entry['train_seconds']:>8.2f} {entry['predict_ms']:>8.1f} {entry['model_mb']:>6.1f}{'  *' if entry['front'] else ''}")
+    print("* = no other finalist (scored on the most folds) scores as well and predicts faster")
+
+
+#paths: output of make_paths(); n_jobs: processes to use (-1 = all cores).
+#Function: runs the search, saves the leaderboard and returns it (best score first)
+def main(paths=None, n_splits=supervised_trainer.n_splits, min_folds=MIN_FOLDS, eta=ETA, n_jobs=parallel_training.N_JOBS,
+         params=parallel_training.LR_PARAMS, out_file=LEADERBOARD_FILE, top=20):
+    paths = paths or make_paths()
+    started = time.time()
+    df = supervised_trainer.load_training_data()
+
+    # --- Shared work, done once ---
+    #One feature matrix per TF-IDF setting (from the feature cache when it was built before).
+    #The cache is not pruned while the search runs: the memory-mapped matrices of every setting are in use until
+    #the end (the worker processes reopen them by file name), so it is pruned once after the search.
+    features = {}
+    for path in paths:
+        key = json.dumps(path["vectorizer"], sort_keys=True)
+        if key not in features:
+            features[key] = supervised_trainer.build_features(df, path["vectorizer"], prune=False)
+        path["features"] = key
+
+    #The labels are the same whatever the TF-IDF setting, so one set of folds serves every candidate
+    X0, Y, _, _ = next(iter(features.values()))
+    folds = supervised_trainer.make_folds(X0, Y, n_splits)
+    n_labels = Y.shape[1]
+
+    sample = df["text"].iloc[:PREDICT_SAMPLE].tolist()
+    costs = {key: predict_cost(vectorizer, sample, n_labels) for key, (_, _, vectorizer, _) in features.items()}
+
+    #Every candidate is (path index, C); proba / seconds hold its results on every fold scored so far
+    alive = [(p, C) for p, path in enumerate(paths) for C in path["C"]]
+    proba = {candidate: {} for candidate in alive}
+    seconds = {candidate: {} for candidate in alive}
+    scores = {}
+    print(f"{len(alive)} candidates on {len(features)} TF-IDF settings, {n_splits} folds")
+
+    used_folds, budget, round_number = 0, min(min_folds, n_splits), 1
+    while True:
+        # --- One round: every alive candidate on the folds it has not been scored on yet ---
+        paths_c = {}
+        for p, C in alive:
+            paths_c.setdefault(p, []).append(C)
+        tasks = [(p, fold, label) for p in paths_c for fold in range(used_folds, budget) for label in range(n_labels)]
+        round_started = time.time()
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(fit_path)(features[paths[p]["features"]][0], Y, label, folds[fold][0], folds[fold][1],
+                              sorted(paths_c[p]), paths[p]["class_weight"], params)
+            for p, fold, label in tasks
+        )
+
+        for (p, fold, label), path_results in zip(tasks, results):
+            #Time of a C is the time of the path up to it: fitting that C means walking there
+            elapsed = 0.0
+            for C, (label_proba, label_seconds) in zip(sorted(paths_c[p]), path_results):
+                elapsed += label_seconds
+                if fold not in proba[(p, C)]:
+                    proba[(p, C)][fold] = np.zeros((len(folds[fold][1]), n_labels), dtype=np.float32)
+                proba[(p, C)][fold][:, label] = label_proba
+                seconds[(p, C)][fold] = seconds[(p, C)].get(fold, 0.0) + elapsed
+
+        # --- Score every alive candidate on all the folds it has seen ---
+        rows = np.concatenate([folds[fold][1] for fold in range(budget)])
+        for candidate in alive:
+            oof = np.vstack([proba[candidate][fold] for fold in range(budget)])
+            thresholds = calibration.tune_thresholds(Y[rows], oof)
+            scores[candidate] = dict(calibration.scores(Y[rows], oof >= thresholds), folds=budget,
+                                     train_seconds=float(np.mean(list(seconds[candidate].values()))))
+
+        alive.sort(key=lambda candidate: scores[candidate]["f1_micro"], reverse=True)
+        best = alive[0]
+        print(f"Round {round_number}: {len(alive)} candidates on {budget} folds in {time.time() - round_started:.1f}s, "
+              f"best F1 micro {scores[best]['f1_micro']:.4f} (path {best[0]}, C={best[1]})")
+
+        if budget >= n_splits or len(alive) == 1:
+            break
+
+        #Keep the best 1/eta; the probabilities of the others are not needed any more
+        survivors = alive[:max(1, math.ceil(len(alive) / eta))]
+        for candidate in alive[len(survivors):]:
+            del proba[candidate]
+        alive = survivors
+        used_folds, budget, round_number = budget, min(budget * eta, n_splits), round_number + 1
+
+    # --- Leaderboard ---
+    leaderboard = []
+    for (p, C), score in scores.items():
+        path = paths[p]
+        vocabulary_size = len(features[path["features"]][2].vocabulary_)
+        leaderboard.append({
+            "max_features": path["vectorizer"]["max_features"],
+            "ngram": path["vectorizer"]["ngram_range"][1],
+            "sublinear_tf": path["vectorizer"]["sublinear_tf"],
+            "class_weight": path["class_weight"],
+            "C": C,
+            "folds": score["folds"],
+            "f1_micro": round(score["f1_micro"], 4),
+            "f1_macro": round(score["f1_macro"], 4),
+            "precision_micro": round(score["precision_micro"], 4),
+            "recall_micro": round(score["recall_micro"], 4),
+            #Seconds to fit every genre on one fold, and the size of the compact export's weights
+            "train_seconds": round(score["train_seconds"], 3),
+            "predict_ms": round(costs[path["features"]], 2),
+            "model_mb": round(vocabulary_size * n_labels * 4 / 1e6, 2),
+            "vectorizer_params": dict(path["vectorizer"], ngram_range=list(path["vectorizer"]["ngram_range"])),
+            "classifier_params": dict(params, C=C, class_weight=path["class_weight"]),
+        })
+
+    #Candidates that reached more folds first (their scores are the most reliable), then by score
+    leaderboard.sort(key=lambda entry: (entry["folds"], entry["f1_micro"]), reverse=True)
+    mark_front(leaderboard)
+    print_leaderboard(leaderboard, top)
+
+    os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"n_splits": n_splits, "min_folds": min_folds, "eta": eta, "rows": int(Y.shape[0]),
+                   "search_seconds": round(time.time() - started, 1), "leaderboard": leaderboard}, f, indent=2)
+    print(f"Leaderboard saved to {out_file} ({time.time() - started:.0f}s)")
+
+    #Every setting of this search stays cached for the next run; entries of older datasets beyond the limit go
+    fingerprint = feature_store.dataset_fingerprint(df["text"], df["tags"])
+    used = {feature_store.cache_key(df["text"], df["tags"], path["vectorizer"], fingerprint) for path in paths}
+    pruned = feature_store.prune_cache(supervised_trainer.feature_cache_dir, fingerprint=fingerprint, protect=used)
+    if pruned:
+        print(f"Removed {pruned} old feature cache entries")
+    return leaderboard
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Successive-halving search over TF-IDF and LogisticRegression settings")
+    parser.add_argument("--max-features", type=int, nargs="+", default=MAX_FEATURES, help="vocabulary sizes (0 = no limit)")
+    parser.add_argument("--ngrams", type=int, nargs="+", default=NGRAMS, help="longest word n-grams (1 = words, 2 = words and pairs)")
+    parser.add_argument("--sublinear-tf", choices=["no", "yes", "both"], default="both", help="log-scaled term counts")
+    parser.add_argument("--class-weight", choices=["none", "balanced", "both"], default="none")
+    parser.add_argument("--C", type=float, nargs="+", default=C_VALUES, help="inverse regularization strengths")
+    parser.add_argument("--folds", type=int, default=supervised_trainer.n_splits, help="folds the finalists are scored on")
+    parser.add_argument("--min-folds", type=int, default=MIN_FOLDS, help="folds every candidate is scored on first")
+    parser.add_argument("--eta", type=int, default=ETA, help="keep 1/eta of the candidates per round")
+    parser.add_argument("--jobs", type=int, default=parallel_training.N_JOBS, help="processes to use (-1 = all cores)")
+    parser.add_argument("--top", type=int, default=20, help="leaderboard rows to print")
+    parser.add_argument("--out", default=LEADERBOARD_FILE)
+    args = parser.parse_args()
+
+    choices = {"no": [False], "yes": [True], "both": [False, True]}
+    weights = {"none": [None], "balanced": ["balanced"], "both": [None, "balanced"]}
+    paths = make_paths([features or None for features in args.max_features], args.ngrams, choices[args.sublinear_tf],
+                       weights[args.class_weight], args.C)
+    main(paths, args.folds, args.min_folds, args.eta, args.jobs, out_file=args.out, top=args.top)
@@ -0,0 +1,277 @@
+#Compact, memory-mappable inference format for the genre model.
+#
+#Unpickling the sklearn objects is slow at start-up: the TF-IDF vectorizer carries a Python dict with every
+#vocabulary word plus a big stop_words_ set, and the OneVsRestClassifier holds ~70 separate estimators.
+#Every web worker pays that again. The export below keeps only what prediction needs, as plain arrays:
+#- terms.npy: the vocabulary, sorted, so a word is found with a binary search (np.searchsorted)
+#- columns.npy: the feature column of each sorted term
+#- idf.npy: the IDF weight of every column
+#- coef.npy / intercept.npy: every genre's LogisticRegression weights stacked into one matrix
+#- thresholds.npy: every genre's tuned probability cut-off (see calibration.py)
+#- config.json: label names, tokenizer settings, stop words
+#The arrays are opened with np.load(mmap_mode="r"). Loading is then just mapping files, and forked workers
+#(e.g. gunicorn) share the same pages through the OS page cache instead of each holding a copy.
+#
+#SklearnModel wraps the pickled objects with the same methods, so callers do not care which one they got.
+
+import os
+import re
+import json
+import shutil
+import argparse
+
+import numpy as np
+from scipy import sparse
+
+import model_bundle
+import calibration
+
+COMPACT_DIR = "models/compact"
+
+#Logit used for a genre that was always/never present in training (sklearn predicts a constant for those)
+CONSTANT_LOGIT = 30.0
+
+
+def sigmoid(scores):
+    return 1.0 / (1.0 + np.exp(-scores))
+
+#Per-genre thresholds as an array (0.5 for every genre when the model has none)
+def threshold_array(thresholds, n_labels):
+    if thresholds is None:
+        return np.full(n_labels, calibration.DEFAULT_THRESHOLD, dtype=np.float32)
+    return np.asarray(thresholds, dtype=np.float32)
+
+#scores: (texts x genres) matrix, higher = more likely; cutoffs: one cut-off per genre on the same scale.
+#Function: tuple of the genre names at or over their cut-off per row, most likely first
+def ranked_genres(scores, cutoffs, labels):
+    results = []
+    for row in scores:
+        hits = np.flatnonzero(row >= cutoffs)
+        hits = hits[np.argsort(-row[hits], kind="stable")]
+        results.append(tuple(labels[hits].tolist()))
+    return results
+
+#Turns the stacked genre estimators of a fitted OneVsRestClassifier into (coef matrix, intercept vector)
+def stack_coefficients(classifier, n_features):
+    coef = np.zeros((len(classifier.estimators_), n_features), dtype=np.float32)
+    intercept = np.zeros(len(classifier.estimators_), dtype=np.float32)
+    for label, estimator in enumerate(classifier.estimators_):
+        if hasattr(estimator, "coef_"):
+            coef[label] = estimator.coef_[0]
+            intercept[label] = estimator.intercept_[0]
+        else:
+            #sklearn's constant predictor: the genre was always (1) or never (0) present
+            intercept[label] = CONSTANT_LOGIT if estimator.y_[0] else -CONSTANT_LOGIT
+    return coef, intercept
+
+#Writes the compact export of a fitted vectorizer / binarizer / classifier into out_dir (swapped in atomically)
+def export_compact(vectorizer, binarizer, classifier, out_dir=COMPACT_DIR, version=None, thresholds=None):
+    #Only the plain word analyzer is re-implemented here
+    if vectorizer.analyzer != "word" or vectorizer.ngram_range != (1, 1) or vectorizer.tokenizer or vectorizer.preprocessor or vectorizer.strip_accents:
+        raise ValueError("Compact export only supports word unigrams with the default tokenizer")
+    if vectorizer.norm not in ("l2", None):
+        raise ValueError("Compact export only supports l2 or no normalization")
+
+    vocabulary = vectorizer.vocabulary_
+    terms = np.array(sorted(vocabulary))
+    columns = np.array([vocabulary[term] for term in terms], dtype=np.int32)
+    coef, intercept = stack_coefficients(classifier, len(vocabulary))
+
+    config = {
+        "version": version,
+        "labels": [str(label) for label in binarizer.classes_],
+        "lowercase": vectorizer.lowercase,
+        "token_pattern": vectorizer.token_pattern,
+        "stop_words": sorted(vectorizer.get_stop_words() or []),
+        "norm": vectorizer.norm,
+        "use_idf": vectorizer.use_idf,
+        "sublinear_tf": vectorizer.sublinear_tf,
+        "binary": vectorizer.binary,
+    }
+
+    tmp_dir = out_dir + ".tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "terms.npy"), terms)
+    np.save(os.path.join(tmp_dir, "columns.npy"), columns)
+    np.save(os.path.join(tmp_dir, "idf.npy"), vectorizer.idf_.astype(np.float32) if vectorizer.use_idf else np.ones(len(vocabulary), dtype=np.float32))
+    np.save(os.path.join(tmp_dir, "coef.npy"), coef)
+    np.save(os.path.join(tmp_dir, "intercept.npy"), intercept)
+    np.save(os.path.join(tmp_dir, "thresholds.npy"), threshold_array(thresholds, len(binarizer.classes_)))
+    with open(os.path.join(tmp_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+    #Swap the new export in: the old one is moved aside first, then removed
+    old_dir = out_dir + ".old"
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.isdir(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+    return out_dir
+
+
+class CompactModel:
+    """Genre model loaded from the compact export (memory-mapped arrays)"""
+
+    def __init__(self, path=COMPACT_DIR):
+        with open(os.path.join(path, "config.json"), encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        self.version = self.config["version"]
+        self.labels = np.array(self.config["labels"])
+        self.stop_words = frozenset(self.config["stop_words"])
+        self.token_pattern = re.compile(self.config["token_pattern"])
+
+        #mmap_mode="r": nothing is read until it is used, and forked workers share the pages
+        self.terms = np.load(os.path.join(path, "terms.npy"), mmap_mode="r")
+        self.columns = np.load(os.path.join(path, "columns.npy"), mmap_mode="r")
+        self.idf = np.load(os.path.join(path, "idf.npy"), mmap_mode="r")
+        self.coef = np.load(os.path.join(path, "coef.npy"), mmap_mode="r")
+        self.intercept = np.load(os.path.join(path, "intercept.npy"), mmap_mode="r")
+
+        #Exports made before calibration have no thresholds file
+        thresholds_path = os.path.join(path, "thresholds.npy")
+        self.thresholds = threshold_array(np.load(thresholds_path) if os.path.exists(thresholds_path) else None, len(self.labels))
+        #The same cut-offs on the raw score scale (sigmoid(score) >= t  <=>  score >= logit(t)), so predicting
+        #compares scores directly and costs nothing extra
+        self.score_cutoffs = np.log(self.thresholds / (1 - self.thresholds))
+
+    #Same steps as sklearn's word analyzer: lowercase, regex tokens, drop stop words
+    def tokenize(self, text):
+        if self.config["lowercase"]:
+            text = text.lower()
+        return [token for token in self.token_pattern.findall(text) if token not in self.stop_words]
+
+    #texts: list of strings.
+    #Function: TF-IDF matrix of the texts (one sparse row per text), identical to the vectorizer's transform().
+    def vectorize(self, texts):
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            tokens = self.tokenize(text)
+            if not tokens:
+                continue
+
+            #Binary search every token in the sorted vocabulary, keep the ones that are really in it
+            tokens = np.array(tokens)
+            positions = np.searchsorted(self.terms, tokens)
+            positions[positions == len(self.terms)] = 0
+            known = self.terms[positions] == tokens
+            if not known.any():
+                continue
+
+            doc_cols, counts = np.unique(self.columns[positions[known]], return_counts=True)
+            rows.append(np.full(len(doc_cols), row))
+            cols.append(doc_cols)
+            values.append(counts)
+
+        n_features = len(self.idf)
+        if not rows:
+            return sparse.csr_matrix((len(texts), n_features), dtype=np.float32)
+
+        X = sparse.csr_matrix(
+            (np.concatenate(values).astype(np.float32), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(texts), n_features),
+        )
+
+        if self.config["binary"]:
+            X.data[:] = 1
+        if self.config["sublinear_tf"]:
+            X.data = np.log(X.data) + 1
+        X = X @ sparse.diags(np.asarray(self.idf))
+
+        if self.config["norm"] == "l2":
+            norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            X = sparse.diags(1 / norms) @ X
+        return sparse.csr_matrix(X, dtype=np.float32)
+
+    #Function: raw score of every genre for every row of X, in one sparse x dense matrix product
+    def decision_function(self, X):
+        return np.asarray(X @ self.coef.T) + self.intercept
+
+    #The *_vectors methods take the output of vectorize(), so callers can time the two steps separately
+    def predict_proba_vectors(self, X):
+        return sigmoid(self.decision_function(X))
+
+    def predict_proba(self, texts):
+        return self.predict_proba_vectors(self.vectorize(texts))
+
+    #Function: tuple of predicted genre names per row (probability at or over the genre's threshold), most likely first
+    def predict_vectors(self, X):
+        return ranked_genres(self.decision_function(X), self.score_cutoffs, self.labels)
+
+    def predict(self, texts):
+        return self.predict_vectors(self.vectorize(texts))
+
+
+class SklearnModel:
+    """The pickled vectorizer / binarizer / classifier behind the same interface as CompactModel"""
+
+    def __init__(self, vectorizer, binarizer, classifier, version=None, thresholds=None):
+        self.vectorizer = vectorizer
+        self.binarizer = binarizer
+        self.classifier = classifier
+        self.version = version
+        self.labels = np.array(binarizer.classes_)
+        self.thresholds = threshold_array(thresholds, len(self.labels))
+
+    def vectorize(self, texts):
+        return self.vectorizer.transform(texts)
+
+    def decision_function(self, X):
+        return self.classifier.decision_function(X)
+
+    def predict_proba_vectors(self, X):
+        return self.classifier.predict_proba(X)
+
+    def predict_proba(self, texts):
+        return self.predict_proba_vectors(self.vectorize(texts))
+
+    def predict_vectors(self, X):
+        return ranked_genres(self.classifier.predict_proba(X), self.thresholds, self.labels)
+
+    def predict(self, texts):
+        return self.predict_vectors(self.vectorize(texts))
+
+
+#Function: loads the fastest model available.
+#The compact export is used when it was made from the current bundle; after a rollback (or before the
+#first export) the bundle itself is loaded; without any bundle, the three legacy pickles.
+def load_model(compact_dir=COMPACT_DIR, bundle_dir=model_bundle.BUNDLE_DIR):
+    current = model_bundle.current_version(bundle_dir)
+
+    if os.path.exists(os.path.join(compact_dir, "config.json")):
+        model = CompactModel(compact_dir)
+        if current is None or model.version == current:
+            return model
+
+    bundle = model_bundle.load_bundle(current, bundle_dir)
+    if bundle is not None:
+        return SklearnModel(bundle["vectorizer"], bundle["binarizer"], bundle["classifier"], current, bundle.get("thresholds"))
+
+    import joblib
+    return SklearnModel(
+        joblib.load("models/tfidf_vectorizer.pkl"),
+        joblib.load("models/genre_binarizer.pkl"),
+        joblib.load("models/genre_classifier.pkl"),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a model bundle to the compact inference format")
+    parser.add_argument("--version", help="bundle version to export (default: the current one)")
+    parser.add_argument("--out", default=COMPACT_DIR, help="folder to write")
+    args = parser.parse_args()
+
+    version = args.version or model_bundle.current_version()
+    bundle = model_bundle.load_bundle(version)
+    if bundle is None:
+        raise SystemExit("No model bundle found, run supervised_trainer.py first")
+
+    export_compact(bundle["vectorizer"], bundle["binarizer"], bundle["classifier"], args.out, version, bundle.get("thresholds"))
+    print(f"Exported model {version} to {args.out}")
@@ -0,0 +1,74 @@
+#Local store of the dataset, keyed by MangaDex manga id.
+#
+#build_dataset rewrites the whole dataset on every run. The store instead keeps one row per manga id in a
+#small SQLite database (part of Python, no server needed), so a sync only has to upsert or delete the
+#titles that changed. Because the id is the primary key, a title seen twice just overwrites itself.
+#The "sync_state" table remembers the updatedAt cursor of the last sync.
+
+import json
+import sqlite3
+
+import dataset_io
+import dedup
+
+STORE_FILE = "data/manga_store.db"
+
+#Same columns as the dataset written by build_dataset (tags are kept as a JSON list in SQLite)
+COLUMNS = dataset_io.COLUMNS
+
+
+class MangaStore:
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS manga ("
+            "manga_id TEXT PRIMARY KEY, title_ja TEXT, title_en TEXT, tags TEXT, "
+            "cover_image_path TEXT, description TEXT, updated_at TEXT)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    #upserts: list of (row, updated_at) where row is a dict with the COLUMNS keys.
+    #deletes: list of manga ids to remove.
+    #state: dict of sync_state values to save.
+    #Everything is written in one transaction, so the cursor never moves ahead of the rows it covers.
+    def apply(self, upserts=(), deletes=(), state=None):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO manga VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(manga_id) DO UPDATE SET title_ja = excluded.title_ja, title_en = excluded.title_en, "
+                "tags = excluded.tags, cover_image_path = excluded.cover_image_path, "
+                "description = excluded.description, updated_at = excluded.updated_at",
+                [[json.dumps(row[name]) if name == "tags" else row[name] for name in COLUMNS] + [updated_at]
+                 for row, updated_at in upserts],
+            )
+            self.conn.executemany("DELETE FROM manga WHERE manga_id = ?", [(manga_id,) for manga_id in deletes])
+            for key, value in (state or {}).items():
+                self.conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (key, value))
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM manga").fetchone()[0]
+
+    def rows(self):
+        """Iterate over every stored row as a dict of COLUMNS"""
+        for values in self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM manga ORDER BY manga_id"):
+            row = dict(zip(COLUMNS, values))
+            row["tags"] = json.loads(row["tags"])
+            yield row
+
+    #Writes the store out as the Parquet dataset the trainer reads.
+    #It is written to a side folder first and swapped in, so a crash never leaves a half written dataset.
+    #Ids are unique here already; the deduplicator normalizes the rows and leaves out entries with the same
+    #(or nearly the same) description as one exported before. Returns it, for its counts.
+    def export_dataset(self, dataset_dir=dataset_io.DATASET_DIR):
+        deduper = dedup.Deduplicator()
+        dataset_io.replace_dataset(list(deduper.filter(self.rows())), dataset_dir)
+        return deduper
+
+    def close(self):
+        self.conn.close()
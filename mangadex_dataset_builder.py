@@ -5,17 +5,27 @@
 #Imports Python’s built-in os module, which provides functions for interacting with the operating system, like creating directories, checking if files exist, and working with file paths
 import os
 
-# Imports the csv module, which allows you to read from and write to CSV (Comma-Separated Values) files. This will be used to save metadata about manga (like title, genres, description) in a structured format
-import csv
+# Columnar (Parquet) dataset files: text is kept exactly as MangaDex sends it and tags are stored as a real list
+import dataset_io
 
-# Imports the requests library, which is used to make HTTP requests in Python. Here it will be used to fetch manga data and images from the MangaDex API
-import requests
+# Imports the shared HTTP client (pooled keep-alive connections, retries with backoff, Retry-After handling). Here it will be used to fetch manga data and images from the MangaDex API
+from http_client import client, TokenBucket
+
+# Local store keyed by manga id, used by the incremental sync
+from manga_store import MangaStore
+
+# Normalizes rows and drops repeats (same id, same or nearly the same description) as pages arrive
+import dedup
 
 # Imports tqdm, a library used to create progress bars. It’s helpful to visualize progress when downloading many images or iterating over a large dataset.
 from tqdm import tqdm
 
-# Imports the time module. This is often used for adding delays (time.sleep()) to avoid hitting rate limits of APIs or controlling execution timing
-import time
+# json is used to save the crawl checkpoint
+import json
+import argparse
+
+# A thread pool lets several pages be downloaded at the same time (the work is waiting on the network, not the CPU)
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # This is the base URL for the MangaDex API. All requests for manga data (like titles, genres, descriptions) will be made to endpoints under this URL.
 API_URL = "https://api.mangadex.org"
@@ -26,41 +36,60 @@ IMG_URL = "https://uploads.mangadex.org/covers"
 # This defines the local folder where manga cover images will be saved on your computer. The program will check if this directory exists and create it if needed, then save downloaded images here
 DATA_DIR = "data/images"
 
-#This is the path to the CSV file that stores metadata about each manga.
+#This is the folder of Parquet files that stores metadata about each manga.
 #Metadata includes things like: title, genres, cover filename, and possibly descriptions.
-#The CSV allows your machine learning program to easily read and train on this structured data.
-META_FILE = "data/manga_dataset.csv"
+#The dataset allows your machine learning program to easily read and train on this structured data.
+META_FILE = dataset_io.DATASET_DIR
+
+#Stores how far a crawl got, so a killed run can continue instead of starting over
+CHECKPOINT_FILE = "data/crawl_checkpoint.json"
+
+#MangaDex's published limit is about 5 requests per second per IP, so the crawler never goes faster than that
+RATE_LIMIT = 5
+
+#Each /manga page carries up to 100 records (the API maximum)
+PAGE_SIZE = 100
+
+#How many pages can be downloaded at once
+MAX_WORKERS = 4
+
+#MangaDex refuses requests where offset + limit goes past 10000
+MAX_OFFSET = 10000
+
+#How many pages go into one Parquet part file (the checkpoint moves forward one part at a time)
+PAGES_PER_PART = 10
 
 #This function creates a directory (or multiple nested directories) at the specified path.
 os.makedirs(DATA_DIR, exist_ok=True)
 
 
+#One limiter for the whole process, so every API call made by this module counts against the same budget
+rate_limiter = TokenBucket(RATE_LIMIT)
+
+
 #url: The API endpoint you want to request (e.g., https://api.mangadex.org/manga/).
 #params: Optional dictionary of query parameters for the request.
 #retries: How many times to retry the request if it fails (default is 3).
-#delay: Seconds to wait between retries (default is 1.0 second).
+#delay: Base seconds for the backoff between retries (default is 1.0 second, doubled each retry with some randomness).
 #Function: Returns the response object if the request is successful.
 def safe_get(url, params=None, retries=3, delay=1.0):
     """Make API requests with retry and rate-limit handling"""
-    for _ in range(retries):
 
-        #Makes a GET request to the URL using the requests library
-        response = requests.get(url, params=params)
+    #The shared client retries 429/5xx with backoff (or the server's Retry-After), and waits for a token from the rate limiter before every attempt
+    response = client.get(url, params=params, retries=retries, backoff=delay, rate_limiter=rate_limiter)
 
-        #Checks if request was successful (status code 200)
-        if response.status_code == 200:
-            return response
-        
-        #Checks if the request was successful (status code 200).
-        time.sleep(delay)
+    #Checks if request was successful (status code 200)
+    if response.status_code == 200:
+        return response
 
     #If all retries fail, this raises an HTTPError with details about why the request failed
     response.raise_for_status()
 
 #limit: Maximum number of manga entries to fetch in one request (default is 100).
 #offset: How many entries to skip before starting (default is 0). Useful for pagination
+#api_url: Base URL of the API, can point at a local stub server for testing.
 #Function: fetches a list of manga from the MangaDex API.
-def get_manga_list(limit=100, offset=0):
+def get_manga_list(limit=100, offset=0, api_url=API_URL):
 
     #builds a dictionary of query parameters to send with the API request.
     params = {
@@ -75,7 +104,7 @@ def get_manga_list(limit=100, offset=0):
     }
 
     #Sends a GET request to the MangaDex API endpoint for manga: https://api.mangadex.org/manga, Passes the params dictionary to filter and limit results.
-    resp = safe_get(f"{API_URL}/manga", params)
+    resp = safe_get(f"{api_url}/manga", params)
 
     #Converts the API response from JSON (text) into a Python dictionary.
     return resp.json()
@@ -106,8 +135,8 @@ def download_cover(manga_id, filename):
     #Constructs the full URL of the cover image using an f-string
     url = f"{IMG_URL}/{manga_id}/{filename}"
 
-    #Sends a GET request with cover image URL to download the image data.
-    resp = requests.get(url)
+    #Sends a GET request with cover image URL to download the image data (through the shared connection pool).
+    resp = client.get(url)
     
     if resp.status_code == 200:
 
@@ -138,72 +167,240 @@ def extract_description(attr):
         return desc.get("en") or desc.get("ja") or ""
     return ""
 
-#total: Total number of manga to collect.
-#Function: builds the manga dataset by fetching manga data, downloading cover images, and saving metadata to a CSV file.
-def build_dataset(total):
-
-    # Opens the CSV file defined by META_FILE: This is a constant that holds the path to the CSV file where the dataset will be saved
-    # for writing ("w") with UTF-8 encoding: UTF-8 encoding supports all Unicode characters, ensuring that your CSV file can correctly store Japanese titles, emoji, and other characters.
-    # Using newline="" tells Python not to translate newlines, letting the csv module handle them correctly.
-    with open(META_FILE, "w", newline="", encoding="utf-8") as csvfile:
+#manga: One manga entry from the API response.
+#Function: turns a manga entry into a dataset row (dict of columns), or returns None if it has no usable title.
+def manga_to_row(manga):
+    attr = manga["attributes"]
 
-        writer = csv.writer(csvfile)
+    #english title and japanese title
+    title_en = attr["title"].get("en", "").strip()
+    title_ja = attr["title"].get("ja", "").strip()
 
-        #Writes the header row with following columns headers
-        writer.writerow(["title_ja", "title_en", "tags", "cover_image_path", "description"])
-
-
-        #Pagination is a concept used when dealing with large amounts of data from APIs, databases, or web pages. Instead of fetching all data at once, you split it into smaller chunks (pages) and retrieve them one at a time.
-        #Initializes offset to 0 for pagination.
-        offset = 0
-
-        #Creates a progress bar using tqdm to track how many manga have been processed.
-        pbar = tqdm(total=total, desc="Collecting manga")
-
-
-        while offset < total:
-            # Loops until the total number of manga collected reaches total.
-            # Calls get_manga_list to fetch up to 100 manga at a time from the API using the current offset.
-            data = get_manga_list(limit=100, offset=offset)
-
-
-            #Iterates over each manga in the API response and extracts relevant attributes.
-            for manga in data.get("data", []):
-                attr = manga["attributes"]
-
-                #english title and japanese title
-                title_en = attr["title"].get("en", "").replace(",", " ").strip()
-                title_ja = attr["title"].get("ja", "").replace(",", " ").strip()
-
-                # Skip entries with neither English nor Japanese titles
-                if not title_en and not title_ja:
-                    pbar.update(1)
-                    time.sleep(0.25)
-                    continue
+    # Skip entries with neither English nor Japanese titles
+    if not title_en and not title_ja:
+        return None
 
-                #genre tags
-                tags = [t["attributes"]["name"]["en"] for t in attr["tags"]]
+    #genre tags
+    tags = [t["attributes"]["name"]["en"] for t in attr["tags"]]
 
-                #description
-                desc = extract_description(attr).replace("\n", " ").replace(",", " ")
+    #description (kept as is, commas and newlines included, Parquet does not need them stripped)
+    desc = extract_description(attr)
 
-                #fetch and download cover image (will use in future for CNN model)
-                #cover_filename = get_cover_filename(manga["id"])
-                #img_path = download_cover(manga["id"], cover_filename) if cover_filename else ""
-                img_path = "" # Skipping image download for now to speed up dataset creation
+    #fetch and download cover image (will use in future for CNN model)
+    #cover_filename = get_cover_filename(manga["id"])
+    #img_path = download_cover(manga["id"], cover_filename) if cover_filename else ""
+    img_path = "" # Skipping image download for now to speed up dataset creation
 
-                #Writes a row to the CSV file with all the extracted data.
-                writer.writerow([title_ja, title_en, "|".join(tags), img_path, desc])
+    return {
+        "manga_id": manga["id"],
+        "title_ja": title_ja,
+        "title_en": title_en,
+        "tags": tags,
+        "cover_image_path": img_path,
+        "description": desc,
+    }
 
-                #update progress bar that tracks how many manga have been processed.
-                pbar.update(1)
-                time.sleep(0.25)  # stay under API rate limit
+#Reads the checkpoint left by an unfinished crawl, or None if there is none
+def load_checkpoint(path=CHECKPOINT_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-            # Writes a row to the CSV file with all the extracted data.
-            offset += 100
+#Saves the checkpoint atomically: write to a temp file, then rename over the old one.
+#A crash can never leave a half written checkpoint behind.
+def save_checkpoint(state, path=CHECKPOINT_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
 
-        #Closes the progress bar after all manga have been processed.
-        pbar.close()
+#total: Total number of manga to collect.
+#api_url: Base URL of the API (a local stub server can be used for testing).
+#workers: How many pages are downloaded at the same time.
+#resume: Continue from the checkpoint of a killed run instead of starting over.
+#Function: builds the manga dataset by fetching pages concurrently and saving metadata as Parquet part files.
+def build_dataset(total, api_url=API_URL, workers=MAX_WORKERS, resume=True):
+
+    #MangaDex cannot page past 10000 records with offsets
+    total = min(total, MAX_OFFSET)
+
+    checkpoint = load_checkpoint() if resume else None
+    deduper = dedup.Deduplicator()
+
+    if checkpoint and dataset_io.has_parts(META_FILE):
+        #Resume: every part up to the checkpoint is complete, carry on after it.
+        #A part written after the last checkpoint has the same name as the one about to be written, so it just gets replaced.
+        start_offset = checkpoint["next_offset"]
+        print(f"Resuming crawl at offset {start_offset}")
+
+        #The rows already written count as seen, so the rest of the crawl is deduped against them too
+        done_parts = [name for name in dataset_io.list_parts(META_FILE) if int(name[len("part-"):-len(".parquet")]) < start_offset]
+        for _, df in dataset_io.iter_batches(["manga_id", "description"], dataset_dir=META_FILE, parts=done_parts):
+            for row in df.to_dict("records"):
+                deduper.add(deduper.fingerprint(row))
+        deduper.counts.update(checkpoint.get("dedup", {}))
+    else:
+        start_offset = 0
+        dataset_io.clear_dataset(META_FILE)
+
+    #Pagination is a concept used when dealing with large amounts of data from APIs, databases, or web pages. Instead of fetching all data at once, you split it into smaller chunks (pages) and retrieve them one at a time.
+    #Every page offset still to download, in order.
+    offsets = list(range(start_offset, total, PAGE_SIZE))
+
+    #Creates a progress bar using tqdm to track how many manga have been processed.
+    pbar = tqdm(total=total, initial=start_offset, desc="Collecting manga")
+
+    #Pages can finish out of order, so finished pages wait in `finished` until every page before them is written.
+    #That keeps the parts in offset order and makes "next_offset" in the checkpoint exact.
+    finished = {}
+    next_offset = start_offset
+    reached_end = False
+
+    #Rows waiting to be written into the current part file, and the offset that part starts at
+    part_rows = []
+    part_start = start_offset
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        queued = iter(offsets)
+
+        while True:
+            #Keep a few pages in flight per worker, but not the whole crawl (that would hold every page in memory)
+            while not reached_end and len(pending) < workers * 2:
+                offset = next(queued, None)
+                if offset is None:
+                    break
+                pending[executor.submit(get_manga_list, PAGE_SIZE, offset, api_url)] = offset
+
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[pending.pop(future)] = future.result()
+
+            #Collect every page that is next in line, as soon as it is available
+            while next_offset in finished:
+                page = finished.pop(next_offset).get("data", [])
+
+                rows = [row for row in map(manga_to_row, page) if row]
+
+                #Normalized rows, without manga already collected (offset paging over a changing catalogue repeats some)
+                part_rows.extend(deduper.filter(rows))
+
+                pbar.update(len(page))
+                next_offset += PAGE_SIZE
+
+                #A short page means the catalogue ran out before `total`
+                if len(page) < PAGE_SIZE:
+                    reached_end = True
+
+                #Write the part once it is full (or the crawl is over), then move the checkpoint past it.
+                #Parts always start on the same offsets, so a part left behind by a killed run gets overwritten, not duplicated.
+                if next_offset - part_start >= PAGES_PER_PART * PAGE_SIZE or reached_end or next_offset >= total:
+                    dataset_io.write_part(part_rows, f"part-{part_start:06d}.parquet", META_FILE)
+                    save_checkpoint({"next_offset": next_offset, "total": total, "dedup": dict(deduper.counts)})
+                    part_rows = []
+                    part_start = next_offset
+
+                if reached_end:
+                    break
+
+            crawl_over = reached_end or next_offset >= total
+
+            if crawl_over:
+                #Drop pages past the end of the catalogue
+                for future in pending:
+                    future.cancel()
+                break
+
+    #Closes the progress bar after all manga have been processed.
+    pbar.close()
+    print(deduper.report())
+
+    #The crawl finished, so the next run starts a fresh dataset
+    if os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
+
+#MangaDex wants dates in this exact form for the updatedAtSince filter (no timezone, no fractions)
+def to_api_date(updated_at):
+    return updated_at[:19]
+
+#store: the MangaStore to update (opened from the default path if not given).
+#api_url: Base URL of the API (a local stub server can be used for testing).
+#Function: incremental refresh. Only asks MangaDex for titles updated since the last sync, upserts or deletes them
+#in the store, then exports the store to the dataset folder. The first sync (empty store) walks the whole catalogue the same way.
+def sync_dataset(store=None, api_url=API_URL):
+    store = store or MangaStore()
+
+    #The cursor is the updatedAt of the newest title already synced
+    cursor = store.get_state("updated_at_since")
+
+    #Titles are read oldest-update first, so the cursor only ever moves forward.
+    #Several titles can share the same updatedAt; `offset` skips the ones at the cursor that were already seen.
+    offset = 0
+    changed = deleted = 0
+    pbar = tqdm(desc="Syncing manga")
+
+    while True:
+        params = {"limit": PAGE_SIZE, "offset": offset, "order[updatedAt]": "asc"}
+        if cursor:
+            params["updatedAtSince"] = to_api_date(cursor)
+
+        page = safe_get(f"{api_url}/manga", params).json().get("data", [])
+
+        #Nothing at or past the cursor: there are no new rows left (or the server ignored the filter), stop here
+        newest = max((manga["attributes"]["updatedAt"] for manga in page), default=None)
+        if newest is None or (cursor and newest < cursor):
+            break
+
+        upserts = []
+        deletes = []
+        for manga in page:
+            row = manga_to_row(manga)
+
+            #No English translation (any more) or no usable title: it should not be in the dataset.
+            #The language filter is left out of the query on purpose, so titles that lost English show up here and get removed.
+            languages = manga["attributes"].get("availableTranslatedLanguages")
+            if row is None or (languages is not None and "en" not in languages):
+                deletes.append(manga["id"])
+            else:
+                upserts.append((row, manga["attributes"]["updatedAt"]))
+
+        if cursor and newest == cursor:
+            #The whole page had the same timestamp, page further along it
+            offset += len(page)
+        else:
+            #Move the cursor up (newest > cursor here, it never goes back) and skip the titles that sit exactly on it (already stored above)
+            cursor = newest
+            offset = sum(1 for manga in page if manga["attributes"]["updatedAt"] == newest)
+
+        #Rows and cursor are saved together, so an interrupted sync carries on from here next time
+        store.apply(upserts, deletes, {"updated_at_since": cursor} if cursor else None)
+        changed += len(upserts)
+        deleted += len(deletes)
+        pbar.update(len(page))
+
+        # A short page means there is nothing newer left
+        if len(page) < PAGE_SIZE:
+            break
+
+    pbar.close()
+
+    deduper = store.export_dataset(META_FILE)
+    print(f"Sync done: {changed} upserted, {deleted} removed, {store.count()} manga in store")
+    print(deduper.report())
+    return changed, deleted
 
 if __name__ == "__main__":
-    build_dataset(5000)  # Increase this to collect more manga
+    parser = argparse.ArgumentParser(description="Build the manga dataset from MangaDex")
+    parser.add_argument("--total", type=int, default=5000, help="how many manga to collect")  # Increase this to collect more manga
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="pages downloaded at the same time")
+    parser.add_argument("--api-url", default=API_URL, help="API base URL (e.g. a local stub server)")
+    parser.add_argument("--fresh", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--sync", action="store_true", help="incremental refresh of titles updated since the last sync")
+    args = parser.parse_args()
+
+    if args.sync:
+        sync_dataset(api_url=args.api_url)
+    else:
+        build_dataset(args.total, api_url=args.api_url, workers=args.workers, resume=not args.fresh)
@@ -0,0 +1,274 @@
+#Counters, timers and a sampling profiler for the web app, exposed in the Prometheus text format.
+#
+#Without numbers there is no telling whether a slow page was MangaDex, the model or the template. This module
+#keeps the numbers in memory (no extra dependency) and renders them for GET /metrics:
+#- Counter: a total that only goes up (requests per status code, cache hits, upstream errors...)
+#- Gauge: a value that goes up and down (model load time, queue depth...)
+#- Histogram: how long something took, counted in buckets (stage and request durations)
+#- register_collector(): stats that already live elsewhere (caches, batcher, HTTP client) are read at
+#  scrape time instead of being copied into counters
+#Every metric can have labels, e.g. STAGE_SECONDS.time(stage="predict").
+#
+#SamplingProfiler is opt-in (MANGA_PROFILE_SLOW_MS): one background thread records, a few hundred times per
+#second, the stacks of the threads working for a request (its own thread and the pool threads running its calls);
+#if the request turns out slower than the threshold the most common stacks are logged, so a slow request shows
+#where its time went. Other requests' threads are not sampled into its profile.
+
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+logger = logging.getLogger("manga.metrics")
+
+#Default histogram buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#Requests slower than this many milliseconds get profiled (0 = profiler off)
+PROFILE_SLOW_MS = float(os.environ.get("MANGA_PROFILE_SLOW_MS", 0))
+
+#Seconds between two stack samples
+PROFILE_INTERVAL = 0.005
+
+#Every metric created through this module, in creation order
+REGISTRY = []
+COLLECTORS = []
+
+
+#Label values may not contain raw backslashes, quotes or newlines in the text format
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    #The label values as a tuple of (name, value) in labelnames order, which is the key of the stored value
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    #with HISTOGRAM.time(stage="x"): ...  records how long the block took, even if it raised
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    #Buckets are stored per bucket and made cumulative (as the format wants) only when rendered
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                running = 0
+                for bound, count in zip(self.buckets, counts):
+                    running += count
+                    lines.append((self.name + "_bucket", key + (("le", format_value(float(bound))),), running))
+                lines.append((self.name + "_sum", key, total))
+                lines.append((self.name + "_count", key, running))
+        return lines
+
+
+#collect: function returning a list of (name, kind, help, [(sample name, labels dict, value), ...]) families,
+#called on every scrape (the sample name is the family name, or e.g. name + "_bucket" for a histogram)
+def register_collector(collect):
+    COLLECTORS.append(collect)
+    return collect
+
+#Function: every metric and collector in the Prometheus text exposition format
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+
+    for collect in COLLECTORS:
+        try:
+            families = collect()
+        except Exception:
+            logger.exception("Metrics collector %s failed", getattr(collect, "__name__", collect))
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{format_labels(sorted(labels.items()))} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- The app's metrics ---
+REQUESTS = Counter("manga_http_requests_total", "HTTP requests answered, by endpoint, method and status code", ["endpoint", "method", "status"])
+REQUEST_SECONDS = Histogram("manga_http_request_duration_seconds", "Time to answer a request", ["endpoint"])
+STAGE_SECONDS = Histogram("manga_stage_duration_seconds", "Time spent in each stage of a request", ["stage"])
+UPSTREAM_ERRORS = Counter("manga_upstream_errors_total", "Failed MangaDex calls, by what failed", ["kind", "reason"])
+MODEL_LOAD_SECONDS = Gauge("manga_model_load_seconds", "Seconds the model took to load at start-up", ["version", "kind"])
+SLOW_REQUESTS = Counter("manga_slow_requests_profiled_total", "Requests slower than MANGA_PROFILE_SLOW_MS that were profiled", ["endpoint"])
+
+
+class RequestProfile:
+    """Stacks sampled from the threads working for one request"""
+
+    def __init__(self):
+        self.stacks = StackCounter()
+        self.samples = 0
+
+    #Function: the `top` most seen stacks as text, with their share of every busy stack seen
+    def report(self, top=10):
+        seen = sum(self.stacks.values())
+        lines = [f"{self.samples} samples, {seen} busy stacks"]
+        for stack, count in self.stacks.most_common(top):
+            lines.append(f"{count / max(seen, 1):6.1%}  {stack}")
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """One background thread for the whole process, sampling only the threads that work for a profiled request"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        #{thread id: [profiles that thread is working for]}, and every profile still open
+        self.watched = {}
+        self.profiles = set()
+        self.wake = threading.Event()
+        self.thread = None
+
+    #Function: a new profile following the calling thread (the request's own thread) until end()
+    def begin(self):
+        profile = RequestProfile()
+        with self.lock:
+            self.profiles.add(profile)
+            self.watched.setdefault(threading.get_ident(), []).append(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+        return profile
+
+    def end(self, profile):
+        with self.lock:
+            self.profiles.discard(profile)
+            for thread_id in list(self.watched):
+                self._unwatch(thread_id, profile)
+
+    #Samples the calling thread for the profile while the block runs (a pool thread doing part of the request's work)
+    @contextmanager
+    def attach(self, profile):
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.watched.setdefault(thread_id, []).append(profile)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._unwatch(thread_id, profile)
+
+    def _unwatch(self, thread_id, profile):
+        profiles = self.watched.get(thread_id, [])
+        if profile in profiles:
+            profiles.remove(profile)
+        if not profiles:
+            self.watched.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                watched = {thread_id: list(profiles) for thread_id, profiles in self.watched.items()}
+                profiles = list(self.profiles)
+                if not profiles:
+                    self.wake.clear()
+            #Nothing to profile: sleep until the next profiled request instead of sampling for nothing
+            if not profiles:
+                self.wake.wait()
+                continue
+
+            frames = sys._current_frames()
+            for thread_id, thread_profiles in watched.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                #Threads parked in a wait (e.g. the request waiting on MangaDex) are idle, not where the time goes
+                if stack and stack[-1].name in ("wait", "_wait_for_tstate_lock", "select", "get", "accept", "poll", "_worker"):
+                    continue
+                line = " <- ".join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})" for entry in reversed(stack[-8:]))
+                for profile in thread_profiles:
+                    profile.stacks[line] += 1
+            for profile in profiles:
+                profile.samples += 1
+            time.sleep(self.interval)
+
+
+#The one sampler of the process, shared by every profiled request
+PROFILER = SamplingProfiler()
@@ -0,0 +1,139 @@
+#Micro-batching scheduler for single-text predictions.
+#
+#Each web request used to predict its own text: one vectorizer pass and one small matrix product per request,
+#with all the per-call Python overhead every time. Under concurrent traffic the batcher instead:
+#- puts every text on a queue and hands the caller a Future
+#- a worker thread takes the first waiting text, then keeps collecting until it has max_batch texts or
+#  max_wait seconds have passed, whichever comes first
+#- predicts the whole batch with one vectorize + one matrix product and gives every caller its own row
+#A lone request waits at most max_wait (a few milliseconds); under load the batches fill up and the cost per
+#text drops. stats() reports the queue depth and a histogram of the batch sizes.
+#The worker thread is started by the first submit() of each process, not when the batcher is created: threads
+#do not survive fork(), so with gunicorn --preload (app imported once, then forked) every worker process starts
+#its own queue and thread instead of waiting forever on the parent's.
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+#Most texts predicted together
+MAX_BATCH = int(os.environ.get("MANGA_MICROBATCH_SIZE", 32))
+
+#Seconds the worker waits for more texts after the first one arrived
+MAX_WAIT = float(os.environ.get("MANGA_MICROBATCH_WAIT_MS", 5)) / 1000
+
+#Upper bounds of the batch size histogram buckets (like Prometheus "le" buckets)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MicroBatcher:
+    """Collects single predictions into batches run by one background thread"""
+
+    #predict_batch: function taking a list of texts and returning one result per text (e.g. model.predict)
+    def __init__(self, predict_batch, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.predict_batch = predict_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "batches": 0, "batched_items": 0, "errors": 0, "max_queue_depth": 0}
+        self.size_histogram = {bucket: 0 for bucket in SIZE_BUCKETS}
+        self.size_histogram["+Inf"] = 0
+
+        #Process the worker thread runs in (None until the first submit)
+        self.pid = None
+        self.worker = None
+        self.start_lock = threading.Lock()
+
+    #Starts the worker thread if this process has none yet (first call, or first call after a fork)
+    def _ensure_worker(self):
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                #Forked child: the parent's queue and lock may have been in use at the moment of the fork
+                self.queue = queue.Queue()
+                self.lock = threading.Lock()
+            #Daemon thread: it must not keep the process alive on shutdown
+            self.worker = threading.Thread(target=self._run, args=(self.queue,), name="micro-batcher", daemon=True)
+            self.worker.start()
+            self.pid = os.getpid()
+
+    #Queues one text and returns a Future that gets its prediction
+    def submit(self, text):
+        self._ensure_worker()
+        future = Future()
+        self.queue.put((text, future))
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["max_queue_depth"] = max(self.counts["max_queue_depth"], self.queue.qsize())
+        return future
+
+    #Same as predict_batch([text])[0], but batched with whatever else is waiting
+    def predict(self, text, timeout=None):
+        return self.submit(text).result(timeout)
+
+    #Waits for the first text, then gathers more until the batch is full or max_wait ran out
+    def _collect(self, texts):
+        batch = [texts.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(texts.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    #texts: the queue of the process this thread was started in
+    def _run(self, texts):
+        while True:
+            batch = self._collect(texts)
+            #A caller that gave up (its Future was cancelled) is left out of the batch
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            self._record(len(batch))
+            try:
+                results = self.predict_batch([text for text, _ in batch])
+            except Exception as e:
+                #One bad batch fails its own callers, the worker keeps going
+                with self.lock:
+                    self.counts["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, size):
+        with self.lock:
+            self.counts["batches"] += 1
+            self.counts["batched_items"] += size
+            for bucket in SIZE_BUCKETS:
+                if size <= bucket:
+                    self.size_histogram[bucket] += 1
+                    break
+            else:
+                self.size_histogram["+Inf"] += 1
+
+    def stats(self):
+        with self.lock:
+            batches = self.counts["batches"]
+            return dict(
+                self.counts,
+                queue_depth=self.queue.qsize(),
+                avg_batch_size=round(self.counts["batched_items"] / batches, 2) if batches else 0,
+                batch_size_histogram={str(bucket): count for bucket, count in self.size_histogram.items()},
+                max_batch=self.max_batch,
+                max_wait_ms=self.max_wait * 1000,
+            )
@@ -0,0 +1,133 @@
+#Versioned model bundles.
+#
+#A bundle is one joblib file holding everything the web app needs to predict, so the pieces can never
+#come from different training runs: the vectorizer, the label binarizer, the classifier and some metadata.
+#
+#Saving is atomic: the bundle is written to a temp file, fsynced, then renamed into place, and only then
+#does the CURRENT pointer file move to it. A crash at any point leaves the previous model in use.
+#The last KEEP_VERSIONS bundles are kept, so going back to an older model is just moving the pointer.
+
+import os
+import time
+import argparse
+
+import joblib
+
+BUNDLE_DIR = "models/bundles"
+
+#Text file holding the version the app should load
+CURRENT_FILE = "CURRENT"
+
+#How many bundles to keep on disk
+KEEP_VERSIONS = 5
+
+
+def bundle_path(version, bundle_dir=BUNDLE_DIR):
+    return os.path.join(bundle_dir, f"genre-model-{version}.joblib")
+
+#Makes sure a rename inside the folder is on disk too (the folder entry is data as well)
+def fsync_dir(path):
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+#Writes a file atomically: write(f) fills a temp file, which is fsynced and then renamed to path
+def atomic_write(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(path) or ".")
+
+#All saved versions, oldest first (version names are timestamps, so they sort by time)
+def list_versions(bundle_dir=BUNDLE_DIR):
+    if not os.path.isdir(bundle_dir):
+        return []
+    return sorted(
+        name[len("genre-model-"):-len(".joblib")]
+        for name in os.listdir(bundle_dir)
+        if name.startswith("genre-model-") and name.endswith(".joblib")
+    )
+
+def current_version(bundle_dir=BUNDLE_DIR):
+    path = os.path.join(bundle_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+def set_current(version, bundle_dir=BUNDLE_DIR):
+    if not os.path.exists(bundle_path(version, bundle_dir)):
+        raise FileNotFoundError(f"No model bundle for version {version}")
+    atomic_write(os.path.join(bundle_dir, CURRENT_FILE), lambda f: f.write(version.encode()))
+
+#Deletes the oldest bundles beyond `keep` (the current one is never deleted)
+def prune(keep=KEEP_VERSIONS, bundle_dir=BUNDLE_DIR):
+    current = current_version(bundle_dir)
+    for version in list_versions(bundle_dir)[:-keep]:
+        if version != current:
+            os.remove(bundle_path(version, bundle_dir))
+
+#vectorizer / binarizer / classifier: the fitted pieces.
+#metadata: dict saved along with them (training settings, scores, row count...).
+#thresholds: per-genre probability cut-offs tuned by calibration.py (None = 0.5 for every genre).
+#Function: saves a new bundle, makes it the current one, prunes old ones and returns its version.
+def save_bundle(vectorizer, binarizer, classifier, metadata=None, bundle_dir=BUNDLE_DIR, keep=KEEP_VERSIONS, thresholds=None):
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    version = time.strftime("%Y%m%d-%H%M%S")
+    #Two saves within the same second get a suffix instead of overwriting each other
+    while os.path.exists(bundle_path(version, bundle_dir)):
+        version += "a"
+
+    bundle = {
+        "vectorizer": vectorizer,
+        "binarizer": binarizer,
+        "classifier": classifier,
+        "thresholds": thresholds,
+        "metadata": dict(metadata or {}, version=version, created_at=time.strftime("%Y-%m-%dT%H:%M:%S")),
+    }
+
+    atomic_write(bundle_path(version, bundle_dir), lambda f: joblib.dump(bundle, f))
+    set_current(version, bundle_dir)
+    prune(keep, bundle_dir)
+    return version
+
+#Loads a bundle (the current one by default). Returns None if no bundle was ever saved.
+def load_bundle(version=None, bundle_dir=BUNDLE_DIR):
+    version = version or current_version(bundle_dir)
+    if version is None:
+        return None
+    return joblib.load(bundle_path(version, bundle_dir))
+
+#Points CURRENT at the version saved before the current one and returns it
+def rollback(bundle_dir=BUNDLE_DIR):
+    versions = list_versions(bundle_dir)
+    current = current_version(bundle_dir)
+    older = [version for version in versions if current is None or version < current]
+    if not older:
+        raise RuntimeError("No older model bundle to roll back to")
+    set_current(older[-1], bundle_dir)
+    return older[-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage saved model bundles")
+    parser.add_argument("command", choices=["list", "rollback", "use"])
+    parser.add_argument("version", nargs="?", help="version for the 'use' command")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        current = current_version()
+        for version in list_versions():
+            print(("* " if version == current else "  ") + version)
+    elif args.command == "rollback":
+        print("Now using", rollback())
+    else:
+        set_current(args.version)
+        print("Now using", args.version)
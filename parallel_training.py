@@ -0,0 +1,84 @@
+#Parallel training engine for the one-vs-rest genre classifier.
+#
+#OneVsRestClassifier fits one binary LogisticRegression per genre, one after another, and the
+#cross-validation loop runs the folds one after another too, so training used a single core.
+#Every (fold, genre) pair is an independent problem, so here they are all spread over a process pool.
+#
+#joblib (loky backend) passes the big arrays to the worker processes as memory maps instead of copying them:
+#arrays over 1 MB (the data/indices/indptr arrays inside the sparse X, and Y) are dumped once to a temp
+#folder and every worker maps the same file. When X and Y already come memory mapped from the feature
+#cache, joblib just passes the file path along.
+
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.linear_model import LogisticRegression
+
+#How many processes to use (-1 = one per CPU core)
+N_JOBS = -1
+
+#Settings for every per-genre LogisticRegression
+#max_iter=500 → allows enough iterations to converge.
+#solver="saga" → efficient for sparse, high-dimensional matrices like TF-IDF.
+LR_PARAMS = {"max_iter": 500, "solver": "saga"}
+
+
+#X: feature matrix (shared by every task).
+#Y: label matrix (shared by every task); label is the column this task fits.
+#train_idx / test_idx: the rows of this fold.
+#Function: fits one genre on one fold and returns its test-row probabilities and how long the fit took.
+def fit_label(X, Y, label, train_idx, test_idx, params):
+    start = time.perf_counter()
+    y_train = np.asarray(Y[train_idx, label])
+
+    if y_train.min() == y_train.max():
+        #The genre is always (or never) present in this training fold: LogisticRegression needs two classes,
+        #so just predict that constant, the same as OneVsRestClassifier does
+        proba = np.full(len(test_idx), float(y_train[0]))
+    else:
+        estimator = LogisticRegression(**params).fit(X[train_idx], y_train)
+        proba = estimator.predict_proba(X[test_idx])[:, 1]
+
+    return proba, time.perf_counter() - start
+
+#X, Y: the full feature and label matrices.
+#folds: list of (train_idx, test_idx) pairs.
+#params: LogisticRegression settings.
+#n_jobs: processes to use (-1 = all cores).
+#Function: runs every (fold, genre) fit in parallel and returns one result per fold:
+#   {"test_idx": rows, "proba": (rows x genres) probabilities, "label_seconds": fit time per genre}
+def cross_validate(X, Y, folds, params=LR_PARAMS, n_jobs=N_JOBS):
+    n_labels = Y.shape[1]
+    tasks = [(fold, label) for fold in range(len(folds)) for label in range(n_labels)]
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(fit_label)(X, Y, label, folds[fold][0], folds[fold][1], params) for fold, label in tasks
+    )
+
+    fold_results = []
+    for fold, (_, test_idx) in enumerate(folds):
+        fold_results.append({
+            "test_idx": test_idx,
+            "proba": np.zeros((len(test_idx), n_labels)),
+            "label_seconds": np.zeros(n_labels),
+        })
+
+    for (fold, label), (proba, seconds) in zip(tasks, results):
+        fold_results[fold]["proba"][:, label] = proba
+        fold_results[fold]["label_seconds"][label] = seconds
+
+    return fold_results
+
+#Prints how long each fold took (summed over its genres) and the slowest genres across all folds
+def print_timings(fold_results, label_names, top=10):
+    label_seconds = np.array([result["label_seconds"] for result in fold_results])
+
+    print("--- Fit time per fold (seconds, summed over genres) ---")
+    for fold, seconds in enumerate(label_seconds.sum(axis=1), start=1):
+        print(f"Fold {fold}: {seconds:.2f}s")
+
+    print(f"--- Slowest {top} genres (mean seconds per fold) ---")
+    mean_seconds = label_seconds.mean(axis=0)
+    for label in np.argsort(mean_seconds)[::-1][:top]:
+        print(f"{label_names[label]}: {mean_seconds[label]:.3f}s")
@@ -0,0 +1,274 @@
+#"Similar manga" search over the TF-IDF vectors of the dataset.
+#
+#Every manga in the dataset is turned into its TF-IDF vector (the same vectorizer the genre model uses) and
+#stored in an inverted index: for every word, the list of manga containing it and the word's weight there
+#(a sparse matrix with one row per word, i.e. the transposed document matrix in CSR form).
+#The vectors are L2-normalized, so the cosine similarity of a query and a manga is just their dot product.
+#A query only has a few dozen words, so one sparse product only touches the posting lists of those words
+#instead of every manga; the k best scores are then picked with np.argpartition.
+#Speed knob: only the max_query_terms heaviest words of the query are looked up (approximate, much faster on
+#long descriptions; 0 = use every word).
+#
+#- build_index(): indexes the whole dataset
+#- SimilarityIndex.add(): adds new manga; they are searched from a small side matrix until merge()
+#- save() / load_index(): the index folder holds .npy arrays (memory mapped on load) and the manga list
+#- vote_genres(): kNN genre prediction: each neighbour votes for its genres, weighted by its similarity
+
+import os
+import json
+import shutil
+import logging
+import argparse
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger("manga.similarity")
+
+INDEX_DIR = "models/similarity_index"
+
+#Neighbours returned by default
+DEFAULT_K = 10
+
+#Heaviest query words looked up (0 = all)
+MAX_QUERY_TERMS = 32
+
+#Added manga are merged into the main index once this many are waiting
+MERGE_THRESHOLD = 10000
+
+#Share of the neighbours' similarity a genre needs to be predicted by vote_genres()
+VOTE_THRESHOLD = 0.5
+
+
+#What identifies a manga in the index: its id, or its row number in the dataset for rows of the old CSV that
+#have no id (not the title: different manga share titles, and keying by it dropped all but one of them)
+def item_key(manga_id, row):
+    return manga_id if manga_id else f"row:{row}"
+
+#Scales every row of a sparse matrix to length 1 (rows that are all zero stay zero)
+def normalize_rows(X):
+    X = sparse.csr_matrix(X, dtype=np.float32)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ X, dtype=np.float32)
+
+#Keeps only the `terms` largest weights of every row (then re-normalizes)
+def prune_query(Q, terms):
+    if not terms:
+        return Q
+    Q = Q.tolil()
+    for row in range(Q.shape[0]):
+        if len(Q.data[row]) > terms:
+            keep = np.argsort(Q.data[row])[-terms:]
+            Q.rows[row] = [Q.rows[row][i] for i in sorted(keep)]
+            Q.data[row] = [Q.data[row][i] for i in sorted(keep)]
+    return normalize_rows(Q.tocsr())
+
+
+class SimilarityIndex:
+    """Inverted index of TF-IDF vectors with top-k cosine search"""
+
+    #n_features: vectorizer vocabulary size; model_version: version of the model whose vectorizer was used
+    def __init__(self, n_features, model_version=None):
+        self.n_features = n_features
+        self.model_version = model_version
+        #word x manga matrix (the posting lists)
+        self.postings = sparse.csr_matrix((n_features, 0), dtype=np.float32)
+        #Manga added since the last merge, one row per manga
+        self.pending = []
+        self.manga_ids = []
+        self.titles = []
+        self.tags = []
+        #Dataset row number of every manga (what identifies the ones without an id)
+        self.rows = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.manga_ids)
+
+    #X: TF-IDF rows of the new manga; manga_ids / titles / tags / dataset_rows: one entry per row.
+    #Function: adds manga that are not indexed yet (already indexed ones are skipped), returns how many were added.
+    def add(self, X, manga_ids, titles, tags, dataset_rows):
+        X = normalize_rows(X)
+        keep = []
+        for row, manga_id in enumerate(manga_ids):
+            key = item_key(manga_id, dataset_rows[row])
+            if key in self.positions:
+                continue
+            self.positions[key] = len(self.manga_ids)
+            self.manga_ids.append(manga_id)
+            self.titles.append(titles[row])
+            self.tags.append(list(tags[row]) if tags[row] is not None else [])
+            self.rows.append(int(dataset_rows[row]))
+            keep.append(row)
+
+        if keep:
+            self.pending.append(X[keep])
+            if sum(rows.shape[0] for rows in self.pending) >= MERGE_THRESHOLD:
+                self.merge()
+        return len(keep)
+
+    #Moves the added manga into the main inverted index
+    def merge(self):
+        if not self.pending:
+            return
+        new_postings = sparse.vstack(self.pending).T.tocsr()
+        self.postings = sparse.hstack([self.postings, new_postings], format="csr", dtype=np.float32)
+        self.pending = []
+
+    #Q: TF-IDF rows of the queries.
+    #Function: for every query, a list of (position, cosine similarity) of the k most similar manga, best first.
+    def search_vectors(self, Q, k=DEFAULT_K, max_query_terms=MAX_QUERY_TERMS):
+        Q = prune_query(normalize_rows(Q), max_query_terms)
+
+        #Sparse x sparse: only manga sharing a word with the query get a score
+        scores = Q @ self.postings
+        if self.pending:
+            scores = sparse.hstack([scores, Q @ sparse.vstack(self.pending).T], format="csr")
+        scores = sparse.csr_matrix(scores)
+
+        results = []
+        for row in range(Q.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            data, positions = scores.data[start:end], scores.indices[start:end]
+            if len(data) > k:
+                best = np.argpartition(-data, k)[:k]
+                data, positions = data[best], positions[best]
+            order = np.argsort(-data)
+            results.append([(int(positions[i]), float(data[i])) for i in order])
+        return results
+
+    #model: the genre model (its vectorizer turns text into TF-IDF); exclude_id: leave this manga out (the query itself).
+    #Function: the k most similar manga to the text as dicts with manga_id, title, score and genres.
+    def search(self, model, text, k=DEFAULT_K, exclude_id=None, max_query_terms=MAX_QUERY_TERMS):
+        hits = self.search_vectors(model.vectorize([text]), k + 1, max_query_terms)[0]
+        similar = [
+            {"manga_id": self.manga_ids[position], "title": self.titles[position], "score": round(score, 4), "genres": self.tags[position]}
+            for position, score in hits
+            if exclude_id is None or self.manga_ids[position] != exclude_id
+        ]
+        return similar[:k]
+
+    def save(self, path=INDEX_DIR):
+        self.merge()
+        tmp_dir = path + ".tmp"
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        np.save(os.path.join(tmp_dir, "indptr.npy"), self.postings.indptr)
+        np.save(os.path.join(tmp_dir, "indices.npy"), self.postings.indices)
+        np.save(os.path.join(tmp_dir, "data.npy"), self.postings.data)
+        with open(os.path.join(tmp_dir, "items.json"), "w", encoding="utf-8") as f:
+            json.dump({"manga_ids": self.manga_ids, "titles": self.titles, "tags": self.tags, "rows": self.rows}, f)
+        with open(os.path.join(tmp_dir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_features": self.n_features, "model_version": self.model_version, "size": len(self)}, f)
+
+        #Same swap as the compact model export: old folder aside, new one in, old one removed
+        old_dir = path + ".old"
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.isdir(path):
+            os.replace(path, old_dir)
+        os.replace(tmp_dir, path)
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir)
+        return path
+
+
+#Loads a saved index (posting arrays memory mapped). Returns None if there is none, if it is from an older
+#format, or if model_version is given and the index was built with another model's vectorizer (its word columns would not match).
+def load_index(path=INDEX_DIR, model_version=None):
+    if not os.path.exists(os.path.join(path, "config.json")):
+        return None
+    with open(os.path.join(path, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    if model_version is not None and config["model_version"] != model_version:
+        logger.warning("Similarity index was built for model %s, not %s; rebuild it", config["model_version"], model_version)
+        return None
+
+    with open(os.path.join(path, "items.json"), encoding="utf-8") as f:
+        items = json.load(f)
+    #Older indexes keyed manga without an id by title and lost the ones sharing a title
+    if "rows" not in items:
+        logger.warning("Similarity index at %s has no dataset row numbers; rebuild it", path)
+        return None
+
+    index = SimilarityIndex(config["n_features"], config["model_version"])
+    index.postings = sparse.csr_matrix(
+        (
+            np.load(os.path.join(path, "data.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "indices.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "indptr.npy"), mmap_mode="r"),
+        ),
+        shape=(config["n_features"], config["size"]),
+        copy=False,
+    )
+    index.manga_ids = items["manga_ids"]
+    index.titles = items["titles"]
+    index.tags = items["tags"]
+    index.rows = items["rows"]
+    index.positions = {item_key(manga_id, row): position for position, (manga_id, row) in enumerate(zip(index.manga_ids, index.rows))}
+    return index
+
+#similar: output of SimilarityIndex.search().
+#Function: kNN genre prediction, a list of (genre, share) where share is the part of the neighbours' total
+#similarity that voted for the genre; genres below threshold are left out.
+def vote_genres(similar, threshold=VOTE_THRESHOLD):
+    total = sum(item["score"] for item in similar)
+    if total <= 0:
+        return []
+    votes = {}
+    for item in similar:
+        for genre in item["genres"]:
+            votes[genre] = votes.get(genre, 0) + item["score"]
+    shares = sorted(((genre, round(score / total, 4)) for genre, score in votes.items()), key=lambda vote: -vote[1])
+    return [(genre, share) for genre, share in shares if share >= threshold]
+
+#Turns dataset rows into (manga ids, titles, tags, text) with the same text preparation as training
+def dataset_rows(df):
+    import supervised_trainer
+    text = supervised_trainer.prepare_text(df)
+    titles = df["title_en"].where(df["title_en"].fillna("") != "", df["title_ja"]).fillna("")
+    tags = [list(tag_list) if tag_list is not None else [] for tag_list in df["tags"]]
+    #Missing ids come out of pandas as NaN; None is what the index (and JSON) expects
+    manga_ids = [manga_id if isinstance(manga_id, str) else None for manga_id in df["manga_id"]]
+    return manga_ids, titles.tolist(), tags, text.tolist()
+
+#Adds dataset rows to the index in chunks (vectorizing a million texts at once would need a lot of memory)
+def add_rows(index, model, df, chunk_size=10000):
+    manga_ids, titles, tags, texts = dataset_rows(df)
+    added = 0
+    for start in range(0, len(texts), chunk_size):
+        end = start + chunk_size
+        added += index.add(model.vectorize(texts[start:end]), manga_ids[start:end], titles[start:end], tags[start:end], range(start, min(end, len(texts))))
+    return added
+
+#Function: builds a new index of every dataset row with the model's vectorizer
+def build_index(model, df, chunk_size=10000):
+    n_features = model.vectorize([""]).shape[1]
+    index = SimilarityIndex(n_features, model.version)
+    add_rows(index, model, df, chunk_size)
+    index.merge()
+    return index
+
+
+if __name__ == "__main__":
+    import dataset_io
+    import inference_model
+
+    parser = argparse.ArgumentParser(description="Build or update the similar-manga index")
+    parser.add_argument("command", choices=["build", "update"], help="build: index everything again; update: add manga not indexed yet")
+    parser.add_argument("--out", default=INDEX_DIR, help="index folder")
+    args = parser.parse_args()
+
+    model = inference_model.load_model()
+    df = dataset_io.load_dataset(columns=["manga_id", "title_ja", "title_en", "description", "tags"])
+
+    index = load_index(args.out, model.version) if args.command == "update" else None
+    if index is None:
+        index = build_index(model, df)
+        print(f"Indexed {len(index)} manga")
+    else:
+        print(f"Added {add_rows(index, model, df)} manga, {len(index)} in total")
+    index.save(args.out)
@@ -0,0 +1,210 @@
+#Streaming (out-of-core) training of the genre model.
+#
+#supervised_trainer.py loads every row, builds the full TF-IDF matrix and fits saga LogisticRegression on it,
+#so memory grows with the dataset. This trainer never holds more than one chunk of rows:
+#- words are hashed into N_FEATURES columns (HashingVectorizer), so there is no vocabulary to fit or keep
+#- pass 1 streams the dataset once to count in how many manga every column appears (for the IDF) and to
+#  collect the genre names
+#- pass 2 (repeated `epochs` times) streams it again; every chunk is turned into TF-IDF and each genre's
+#  SGDClassifier (logistic loss) is updated with partial_fit, the genres in parallel threads
+#Memory is bounded by the chunk size and the weights (genres x N_FEATURES), whatever the row count.
+#
+#The result is a normal model bundle (Pipeline vectorizer, MultiLabelBinarizer, OneVsRestClassifier) that
+#the web app loads like any other. The compact export needs a vocabulary, so it is skipped: the app then
+#loads the bundle itself (see inference_model.load_model).
+#
+#--warm-start continues from the current streaming bundle with only the part files it has not seen yet (new
+#crawler pages), keeping its IDF and genres.
+
+import os
+import time
+import argparse
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MultiLabelBinarizer, LabelBinarizer
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.base import clone
+
+import dataset_io
+import model_bundle
+import supervised_trainer
+
+#Hashed feature columns (each genre keeps one weight per column)
+N_FEATURES = 2 ** 18
+
+#Rows read and trained at a time
+CHUNK_SIZE = 10000
+
+#Passes over the data in pass 2
+EPOCHS = 3
+
+#log_loss gives probabilities like LogisticRegression; alpha is the L2 regularization strength
+SGD_PARAMS = {"loss": "log_loss", "alpha": 1e-5, "random_state": 0}
+
+#Threads updating the genres of a chunk (SGD releases the GIL, so threads avoid copying the chunk per process)
+N_JOBS = -1
+
+
+#Stateless word hashing with the same tokenization and stop words as the TF-IDF vectorizer of the batch trainer
+def make_hasher(n_features=N_FEATURES):
+    return HashingVectorizer(
+        n_features=n_features,
+        stop_words=supervised_trainer.vectorizer_params["stop_words"],
+        alternate_sign=False,
+        norm=None,
+    )
+
+#Function: yields (part name, texts, tag lists) chunk by chunk, with the same text preparation as training
+def read_chunks(dataset_dir, chunk_size=CHUNK_SIZE, parts=None):
+    columns = ["title_ja", "title_en", "description", "tags"]
+    for part, df in dataset_io.iter_batches(columns, chunk_size, dataset_dir, supervised_trainer.csv_path, parts):
+        df = df.dropna(subset=["tags"])
+        if len(df):
+            yield part, supervised_trainer.prepare_text(df).tolist(), [list(tags) for tags in df["tags"]]
+
+#Pass 1: document frequency of every hashed column, number of rows and the set of genres
+def count_pass(hasher, chunks):
+    doc_freq = np.zeros(hasher.n_features, dtype=np.int64)
+    n_rows = 0
+    labels = set()
+    for _, texts, tags in chunks:
+        X = hasher.transform(texts)
+        #Every stored entry is one (manga, column) pair, so counting the column indices counts manga per column
+        doc_freq += np.bincount(X.indices, minlength=hasher.n_features)
+        n_rows += len(texts)
+        for tag_list in tags:
+            labels.update(tag_list)
+    return doc_freq, n_rows, sorted(labels)
+
+#Hasher + IDF weights as one fitted transformer (smooth IDF, like TfidfVectorizer's default)
+def make_vectorizer(hasher, doc_freq, n_rows):
+    tfidf = TfidfTransformer(norm="l2")
+    tfidf.idf_ = np.log((1 + n_rows) / (1 + doc_freq)) + 1
+    return Pipeline([("hash", hasher), ("tfidf", tfidf)])
+
+def partial_fit_label(estimator, X, y):
+    return estimator.partial_fit(X, y, classes=[0, 1])
+
+#Wraps the per-genre SGDClassifiers into a fitted OneVsRestClassifier, so the bundle looks like the batch trainer's
+#(OneVsRestClassifier.partial_fit itself only supports single-label targets)
+def to_one_vs_rest(estimators):
+    clf = OneVsRestClassifier(clone(estimators[0]))
+    clf.estimators_ = estimators
+    clf.label_binarizer_ = LabelBinarizer(sparse_output=True).fit(np.eye(len(estimators), dtype=int))
+    return clf
+
+#Pass 2: one epoch of partial_fit over the chunks; returns the updated estimators, the F1 and the rows trained.
+#evaluate: predict every chunk before training on it (progressive validation) and return its micro F1.
+def train_pass(vectorizer, mlb, estimators, chunks, n_jobs=N_JOBS, evaluate=False):
+    true_pos = false_pos = false_neg = 0
+    rows = 0
+    with Parallel(n_jobs=n_jobs, prefer="threads") as parallel:
+        for _, texts, tags in chunks:
+            X = vectorizer.transform(texts)
+            #Genres the model was not created with (possible on a warm start) are ignored, with a warning
+            Y = mlb.transform(tags)
+
+            if evaluate and hasattr(estimators[0], "coef_"):
+                predicted = np.column_stack([estimator.decision_function(X) > 0 for estimator in estimators])
+                true_pos += int((predicted & (Y == 1)).sum())
+                false_pos += int((predicted & (Y == 0)).sum())
+                false_neg += int((~predicted & (Y == 1)).sum())
+
+            estimators = parallel(delayed(partial_fit_label)(estimator, X, Y[:, label]) for label, estimator in enumerate(estimators))
+            rows += len(texts)
+            print(f"  trained {rows} rows")
+
+    if not evaluate:
+        return estimators, None, rows
+    f1 = 2 * true_pos / (2 * true_pos + false_pos + false_neg) if true_pos else 0.0
+    return estimators, f1, rows
+
+
+#dataset_dir: dataset folder; warm_start: continue the current streaming bundle with new part files only.
+#Function: trains, saves a new bundle and returns its version (None if a warm start found nothing new).
+def main(dataset_dir=supervised_trainer.dataset_dir, epochs=EPOCHS, chunk_size=CHUNK_SIZE, n_features=N_FEATURES,
+         n_jobs=N_JOBS, warm_start=False):
+    #The progressive F1 and the row count come from the first epoch, so there has to be one
+    if epochs < 1:
+        raise ValueError(f"epochs must be at least 1, got {epochs}")
+    bundle_dir = os.path.join(supervised_trainer.base_dir, model_bundle.BUNDLE_DIR)
+    started = time.time()
+    #Rows per part file, to know on the next warm start which parts are new
+    part_rows = dataset_io.part_row_counts(dataset_dir, supervised_trainer.csv_path)
+
+    if warm_start:
+        bundle = model_bundle.load_bundle(bundle_dir=bundle_dir)
+        if bundle is None or bundle["metadata"].get("training_mode") != "streaming":
+            raise SystemExit("The current model was not trained in streaming mode, train once without --warm-start")
+        vectorizer, mlb = bundle["vectorizer"], bundle["binarizer"]
+        estimators = bundle["classifier"].estimators_
+        previous_rows = bundle["metadata"]["rows"]
+
+        #Part files that are new, or grew since the last run
+        trained_parts = bundle["metadata"]["trained_parts"]
+        parts = [part for part, rows in part_rows.items() if trained_parts.get(part) != rows]
+        if not parts:
+            print("No new rows since the current model, nothing to train")
+            return None
+        print(f"Warm start from {bundle['metadata']['version']} with {len(parts)} new part files")
+        part_rows = dict(trained_parts, **part_rows)
+    else:
+        # --- Pass 1: IDF and genres ---
+        print("--- Pass 1: counting ---")
+        hasher = make_hasher(n_features)
+        doc_freq, n_rows, labels = count_pass(hasher, read_chunks(dataset_dir, chunk_size))
+        vectorizer = make_vectorizer(hasher, doc_freq, n_rows)
+        mlb = MultiLabelBinarizer(classes=labels).fit([labels])
+        estimators = [SGDClassifier(**SGD_PARAMS) for _ in labels]
+        previous_rows = 0
+        parts = None
+
+    # --- Pass 2: partial_fit ---
+    #The first epoch also scores every chunk before learning from it: rows the model has not seen yet, so an
+    #honest held-out estimate without a separate test pass
+    for epoch in range(1, epochs + 1):
+        print(f"--- Pass 2, epoch {epoch}/{epochs} ---")
+        estimators, epoch_f1, rows = train_pass(vectorizer, mlb, estimators, read_chunks(dataset_dir, chunk_size, parts), n_jobs, evaluate=epoch == 1)
+        if epoch == 1:
+            f1 = epoch_f1
+    print("Progressive validation F1 (micro):", f1)
+
+    version = model_bundle.save_bundle(
+        vectorizer,
+        mlb,
+        to_one_vs_rest(estimators),
+        metadata={
+            "rows": previous_rows + rows,
+            "features": int(vectorizer.named_steps["hash"].n_features),
+            "labels": list(mlb.classes_),
+            "training_mode": "streaming",
+            "vectorizer_params": {"hashing": True, "n_features": int(vectorizer.named_steps["hash"].n_features), "stop_words": "english"},
+            "classifier_params": SGD_PARAMS,
+            "epochs": epochs,
+            "warm_start": warm_start,
+            "trained_parts": part_rows,
+            "progressive_scores": {"f1_micro": f1},
+            "train_seconds": round(time.time() - started, 1),
+        },
+        bundle_dir=bundle_dir,
+    )
+    print("Saved model bundle", version)
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the genre classifier out-of-core, streaming the dataset in chunks")
+    parser.add_argument("--epochs", type=int, default=EPOCHS, help="passes over the data")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per chunk")
+    parser.add_argument("--features", type=int, default=N_FEATURES, help="hashed feature columns")
+    parser.add_argument("--jobs", type=int, default=N_JOBS, help="threads updating genres (-1 = all cores)")
+    parser.add_argument("--warm-start", action="store_true", help="continue the current streaming model with new part files only")
+    args = parser.parse_args()
+
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+    main(epochs=args.epochs, chunk_size=args.chunk_size, n_features=args.features, n_jobs=args.jobs, warm_start=args.warm_start)
@@ -1,122 +1,177 @@
 import os
-import re
+import argparse
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import MultiLabelBinarizer
-from sklearn.model_selection import train_test_split
 from sklearn.multiclass import OneVsRestClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report, accuracy_score
+from sklearn.metrics import classification_report
 from skmultilearn.model_selection import IterativeStratification
 import numpy as np
-import joblib
-
-# gets the relative file path to data.csv
+import dataset_io
+import model_bundle
+import inference_model
+import feature_store
+import parallel_training
+import calibration
+
+# gets the relative file path to the dataset folder (and the old data.csv it falls back to)
 try:
     base_dir = os.path.dirname(__file__)  # works if running as a script
 except NameError:
     base_dir = os.getcwd()  # fallback for Spyder or notebooks
-csv_path = os.path.join(base_dir, "data", "manga_dataset.csv")
+dataset_dir = os.path.join(base_dir, dataset_io.DATASET_DIR)
+csv_path = os.path.join(base_dir, dataset_io.LEGACY_CSV)
+feature_cache_dir = os.path.join(base_dir, feature_store.CACHE_DIR)
 
-# load csv data
-df = pd.read_csv(csv_path)
+#TF-IDF settings, also part of the feature cache key
+vectorizer_params = {"max_features": 10000, "stop_words": "english"}
 
+# --- 10-fold cross-validation using iterative stratification ---
+n_splits = 10
 
-# --- Prepare text input ---
-# Combine title_en and description into one text field
-df["text"] = (df["title_ja"].fillna("") + " " + df["title_en"].fillna("") + " " + df["description"].fillna("")).str.strip()
 
 # --- Optional: split CamelCase in Romaji titles ---
-def split_camel_case(text):
-    return re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
-df["text"] = df["text"].apply(split_camel_case)
-
-# Drop rows with missing tags
-df = df.dropna(subset=["tags"])
-
-# Split the tag string into lists
-df["tags"] = df["tags"].apply(lambda x: x.split("|"))
+#str.replace runs the regex over the whole column at once instead of calling a Python function per row
+def split_camel_case(texts):
+    return texts.str.replace(r'([a-z])([A-Z])', r'\1 \2', regex=True)
 
-# --- Encode labels ---
-#convert a list of labels per sample into a binary matrix.
-mlb = MultiLabelBinarizer()
-Y = mlb.fit_transform(df["tags"]) # to be kept seperate since it will be used for training
-
-# Convert to a DataFrame with readable column headers (genre names) - this is here to make it easier to understand the Y labels
-Y_df = pd.DataFrame(Y, columns=mlb.classes_)
-
-# Optional: merge it back with your original df for inspection
-#df_with_genres = pd.concat([df, Y_df], axis=1)
-
-
-# --- TF-IDF vectorization for text features ---
-#This converts raw text (your combined title_ja, title_en, and description) into a numeric matrix that a model can use.
+# --- Prepare text input ---
+# Combine title_ja, title_en and description into one text field (also used by the streaming trainer and the similarity index)
+def prepare_text(df):
+    text = (df["title_ja"].fillna("") + " " + df["title_en"].fillna("") + " " + df["description"].fillna("")).str.strip()
+    return split_camel_case(text)
+
+#Function: loads the dataset and returns a DataFrame with a prepared "text" column and a "tags" list column
+def load_training_data():
+    # load only the columns training needs; the Parquet files are memory mapped instead of parsed like a CSV
+    df = dataset_io.load_dataset(
+        columns=["title_ja", "title_en", "description", "tags"],
+        memory_map=True,
+        dataset_dir=dataset_dir,
+        legacy_csv=csv_path,
+    )
+
+    df["text"] = prepare_text(df)
+
+    # Drop rows with missing tags (tags are already stored as a list per row, no splitting needed)
+    return df.dropna(subset=["tags"])
+
+# --- Encode labels and vectorize text (cached) ---
+#MultiLabelBinarizer converts a list of labels per sample into a binary matrix Y.
+#TF-IDF converts raw text (your combined title_ja, title_en, and description) into a numeric matrix X that a model can use.
 #TF-IDF stands for Term Frequency–Inverse Document Frequency, a way to measure how important a word is in a document relative to all documents.
 # this also automatically considers case sensitive words by making everything lowercase
-tfidf = TfidfVectorizer(max_features=10000, stop_words="english")
-X = tfidf.fit_transform(df["text"])
-
-
-# --- 10-fold cross-validation using iterative stratification ---
-n_splits = 10
+#feature_store keys both on a hash of the data and these settings: if neither changed since the last run,
+#the fitted vectorizer, X and Y are loaded (memory mapped) from models/feature_cache instead of recomputed.
+#prune=False leaves old cache entries alone (for callers that prune once they are done, see feature_store).
+def build_features(df, params=vectorizer_params, prune=True):
+    return feature_store.get_or_build(df["text"], df["tags"], params, cache_dir=feature_cache_dir, prune=prune)
 
 #IterativeStratification is from skmultilearn, specifically for multi-label datasets.
 #Standard KFold or StratifiedKFold in scikit-learn is not suitable for multi-label data, because each sample can belong to multiple labels at once.
 #Iterative stratification ensures that each fold roughly preserves the label distribution for all genres.
-stratifier = IterativeStratification(n_splits=n_splits, order=1)
-fold = 1
-
-#This is an empty list that will store the classification reports for each fold.
-#After running all folds, you can:
-#Inspect each fold’s performance individually.
-#Optionally aggregate metrics (precision, recall, F1) across folds.
-all_reports = []
-
 #stratifier.split(X, Y) generates indices for training and testing for each fold.
 #train_idx → array of row indices to use for training.
 #test_idx → array of row indices to use for testing.
-for train_idx, test_idx in stratifier.split(X, Y):
-    print(f"--- Fold {fold} ---")
-    
-    #Spliting data
+def make_folds(X, Y, splits=n_splits):
+    stratifier = IterativeStratification(n_splits=splits, order=1)
+    return list(stratifier.split(X, Y))
+
+
+def main(n_jobs=parallel_training.N_JOBS):
+    df = load_training_data()
+    X, Y, tfidf, mlb = build_features(df)
+
+    # Convert to a DataFrame with readable column headers (genre names) - this is here to make it easier to understand the Y labels
+    Y_df = pd.DataFrame(Y, columns=mlb.classes_)
+
+    # Optional: merge it back with your original df for inspection
+    #df_with_genres = pd.concat([df, Y_df], axis=1)
+
+    folds = make_folds(X, Y)
+
+    #Every (fold, genre) pair is trained in parallel across n_jobs processes.
+    #Each genre is treated as a separate binary classification task (the same as OneVsRestClassifier with LogisticRegression does).
     #X → the TF-IDF features of your manga text.
     #Y → the binary matrix of genres (output of MultiLabelBinarizer).
-    X_train, X_test = X[train_idx], X[test_idx]
-    y_train, y_test = Y[train_idx], Y[test_idx]
-
-    #OneVsRestClassifier wraps LogisticRegression to handle multi-label classification.
-    #Each genre is treated as a separate binary classification task.
-    #The classifier learns 0/1 predictions for each genre independently.
-    #max_iter=200 → allows the logistic regression solver to converge (default 100 might be too low for some datasets).
-    #max_iter=500 → allows enough iterations to converge.
-    #solver="saga" → efficient for sparse, high-dimensional matrices like your TF-IDF. TF-IDF converts text into a matrix of numbers (features × samples). Most entries in this matrix are 0 because most words don’t appear in every document. A matrix with mostly zeros is called sparse.
-    clf = OneVsRestClassifier(LogisticRegression(max_iter=500, solver="saga"))
-    
-    
-    clf.fit(X_train, y_train)
-    y_pred = clf.predict(X_test)
-    
-    #summarize how well your model is performing across all labels
-    #It computes precision, recall, F1-score, and support for each class
-    #Precision: how accurate your model positive predict are
-    #Recall: how well your model finds all manga with a genre.
-    #F1-score: Balances the trade-off between precision and recall.
-    #Support: The number of true instances for that genre in the test set.
-    report = classification_report(y_test, y_pred, target_names=mlb.classes_, zero_division=0)
-    
-    
-    print(report)
-    all_reports.append(report)
-    fold += 1
-
-
-# --- Save models---
-os.makedirs("models", exist_ok=True)
-
-#joblib is a Python library optimized for saving large objects efficiently, like machine learning models or large arrays.
-#dump(obj, filename) saves the Python object obj to a file filename.
-#You can later load it back with joblib.load(filename) to use the model or transformer.
-joblib.dump(tfidf, "models/tfidf_vectorizer.pkl")
-joblib.dump(mlb, "models/genre_binarizer.pkl")
-joblib.dump(clf, "models/genre_classifier.pkl")
-
+    fold_results = parallel_training.cross_validate(X, Y, folds, n_jobs=n_jobs)
+
+    #This is an empty list that will store the classification reports for each fold.
+    #After running all folds, you can:
+    #Inspect each fold’s performance individually.
+    #Optionally aggregate metrics (precision, recall, F1) across folds.
+    all_reports = []
+
+    for fold, result in enumerate(fold_results, start=1):
+        print(f"--- Fold {fold} ---")
+        y_test = Y[result["test_idx"]]
+
+        #A genre is predicted when its probability is at least 0.5 (what clf.predict does)
+        y_pred = (result["proba"] >= 0.5).astype(int)
+
+        #summarize how well your model is performing across all labels
+        #It computes precision, recall, F1-score, and support for each class
+        #Precision: how accurate your model positive predict are
+        #Recall: how well your model finds all manga with a genre.
+        #F1-score: Balances the trade-off between precision and recall.
+        #Support: The number of true instances for that genre in the test set.
+        report = classification_report(y_test, y_pred, target_names=mlb.classes_, zero_division=0)
+
+        print(report)
+        all_reports.append(report)
+
+    parallel_training.print_timings(fold_results, mlb.classes_)
+
+    # --- Calibration ---
+    #Every row was in exactly one test fold, so putting the fold probabilities back in row order gives an
+    #out-of-fold probability for every manga and genre. The per-genre thresholds are tuned on those (see calibration.py).
+    oof_proba = np.zeros(Y.shape, dtype=np.float32)
+    for result in fold_results:
+        oof_proba[result["test_idx"]] = result["proba"]
+
+    thresholds = calibration.tune_thresholds(Y, oof_proba)
+    cv_scores = calibration.scores(Y, oof_proba >= 0.5)
+    tuned_scores = calibration.scores(Y, oof_proba >= thresholds)
+    print("Cross-validation (0.5 cut-off):", cv_scores)
+    print("Cross-validation (tuned thresholds):", tuned_scores)
+
+    # --- Final fit ---
+    #Cross-validation only measures the model. The model that gets shipped is retrained on every row.
+    #OneVsRestClassifier(n_jobs=...) fits its genres in parallel.
+    print("--- Final fit on all rows ---")
+    clf = OneVsRestClassifier(LogisticRegression(**parallel_training.LR_PARAMS), n_jobs=n_jobs)
+    clf.fit(X, Y)
+
+    # --- Save model bundle ---
+    #Vectorizer, binarizer and classifier are saved together in one versioned file (atomically),
+    #so the web app always loads pieces from the same training run. See model_bundle.py.
+    version = model_bundle.save_bundle(
+        tfidf,
+        mlb,
+        clf,
+        metadata={
+            "rows": int(X.shape[0]),
+            "features": int(X.shape[1]),
+            "labels": list(mlb.classes_),
+            "vectorizer_params": vectorizer_params,
+            "classifier_params": parallel_training.LR_PARAMS,
+            "cv_folds": n_splits,
+            "cv_scores": cv_scores,
+            "cv_scores_tuned": tuned_scores,
+            "thresholds": {label: round(float(threshold), 4) for label, threshold in zip(mlb.classes_, thresholds)},
+        },
+        bundle_dir=os.path.join(base_dir, model_bundle.BUNDLE_DIR),
+        thresholds=thresholds,
+    )
+    print("Saved model bundle", version)
+
+    #Also export the compact, memory-mappable copy the web app loads at start-up (see inference_model.py)
+    inference_model.export_compact(tfidf, mlb, clf, os.path.join(base_dir, inference_model.COMPACT_DIR), version, thresholds)
+
+
+#The guard matters now that training uses worker processes: they must not re-run the whole script when they start
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the genre classifier with 10-fold cross-validation")
+    parser.add_argument("--jobs", type=int, default=parallel_training.N_JOBS, help="processes to train with (-1 = all cores)")
+    args = parser.parse_args()
+
+    main(n_jobs=args.jobs)
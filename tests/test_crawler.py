@@ -0,0 +1,90 @@
+#Runs the crawler against the local MangaDex stub (benchmarks/mangadex_stub.py): no network, a few seconds.
+#    python -m pytest tests
+
+import os
+import sys
+import copy
+
+import pytest
+
+#The project modules live in the repo root, the stub and its synthetic manga in benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import dataset_io
+import mangadex_dataset_builder as builder
+from http_client import TokenBucket
+from mangadex_stub import StubServer
+
+#Unique manga served by the stub (the catalogue is 452 entries with the two duplicates added below)
+N_MANGA = 450
+
+
+class Crash(Exception):
+    pass
+
+
+#A stub serving N_MANGA manga plus two duplicates, the way MangaDex shows them to an offset crawl:
+#- manga 10 again at position 300 (the catalogue changed while it was paged)
+#- a re-upload of manga 20 under another id at position 350 (same description)
+@pytest.fixture
+def stub():
+    server = StubServer(N_MANGA, seed=1)
+    repeated = copy.deepcopy(server.manga[10])
+    reupload = copy.deepcopy(server.manga[20])
+    reupload["id"] = "00000000-0000-4000-8000-999999999999"
+    server.manga.insert(300, repeated)
+    server.manga.insert(350, reupload)
+    server.start()
+    yield server
+    server.stop()
+
+#Every relative data/ path of the crawler lands in a temp folder, and the rate limit is lifted
+@pytest.fixture(autouse=True)
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    monkeypatch.setattr(builder, "rate_limiter", TokenBucket(100000))
+    #Parts of 200 rows, so the small catalogue is written in several parts (and checkpoints)
+    monkeypatch.setattr(builder, "PAGES_PER_PART", 2)
+
+def crawled_ids():
+    return dataset_io.load_dataset(columns=["manga_id"])["manga_id"].tolist()
+
+
+def test_build_dataset_drops_duplicates(stub):
+    builder.build_dataset(len(stub.manga), api_url=stub.url, resume=False)
+
+    ids = crawled_ids()
+    assert len(ids) == N_MANGA
+    assert len(set(ids)) == N_MANGA
+    assert "00000000-0000-4000-8000-999999999999" not in ids
+    assert not os.path.exists(builder.CHECKPOINT_FILE)
+
+
+def test_build_dataset_resumes_after_a_crash(stub, monkeypatch):
+    #The crawl dies right after the first part (offsets 0-199) is written and checkpointed
+    save_checkpoint = builder.save_checkpoint
+
+    def save_then_crash(state, path=builder.CHECKPOINT_FILE):
+        save_checkpoint(state, path)
+        raise Crash()
+
+    monkeypatch.setattr(builder, "save_checkpoint", save_then_crash)
+    with pytest.raises(Crash):
+        builder.build_dataset(len(stub.manga), api_url=stub.url)
+    assert builder.load_checkpoint()["next_offset"] == 200
+    assert dataset_io.list_parts(builder.META_FILE) == ["part-000000.parquet"]
+
+    #The second run only asks for the pages after the checkpoint (200, 300 and 400)
+    monkeypatch.setattr(builder, "save_checkpoint", save_checkpoint)
+    requests_before = stub.requests
+    builder.build_dataset(len(stub.manga), api_url=stub.url)
+    assert stub.requests - requests_before == 3
+
+    #Rows written before the crash still count for dedup: manga 10 served again at 300 is dropped
+    ids = crawled_ids()
+    assert len(ids) == N_MANGA
+    assert len(set(ids)) == N_MANGA
+    assert not os.path.exists(builder.CHECKPOINT_FILE)
@@ -0,0 +1,70 @@
+#The feature cache must never delete an entry a caller still has memory mapped, and must still prune old ones.
+#    python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+#The project modules live in the repo root, the synthetic dataset generator in benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import feature_store
+import hyperparam_search
+import supervised_trainer
+import synthetic
+
+N_ROWS = 300
+
+
+#A small synthetic dataset, with the trainer's dataset and feature cache paths pointed at a temp folder
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    synthetic.write_dataset(N_ROWS, str(tmp_path / "dataset"), part_size=100)
+    monkeypatch.setattr(supervised_trainer, "dataset_dir", str(tmp_path / "dataset"))
+    monkeypatch.setattr(supervised_trainer, "csv_path", str(tmp_path / "missing.csv"))
+    monkeypatch.setattr(supervised_trainer, "feature_cache_dir", str(tmp_path / "feature_cache"))
+    return tmp_path
+
+def cached_keys(workspace):
+    return sorted(os.listdir(workspace / "feature_cache"))
+
+
+#A search over more TF-IDF settings than MAX_ENTRIES, after a narrower one: the worker processes reopen the
+#memory-mapped matrices by file name, so none of them may be pruned while the search runs
+def test_wider_search_after_narrower_one(workspace):
+    def search(max_features, ngrams):
+        paths = hyperparam_search.make_paths(max_features, ngrams, [False, True], [None], [1])
+        return hyperparam_search.main(paths, n_splits=2, min_folds=1, n_jobs=2, out_file=str(workspace / "search.json"), top=0)
+
+    search([300], [1])
+    assert len(cached_keys(workspace)) == 2
+
+    leaderboard = search([300, 400, 500], [1, 2])
+    assert len(leaderboard) == 12
+    #Every setting stays cached for the next run
+    assert len(cached_keys(workspace)) == 12
+
+
+def test_only_entries_of_older_datasets_are_pruned(tmp_path):
+    cache_dir = str(tmp_path)
+    tags = [["Action"], ["Romance"], ["Action", "Comedy"]]
+    old_texts = ["a hero with a sword", "two students fall in love", "a funny fight"]
+    new_texts = old_texts + ["a new manga"]
+
+    for max_features in range(1, 6):
+        feature_store.get_or_build(old_texts, tags, {"max_features": max_features}, cache_dir)
+    assert len(os.listdir(cache_dir)) == 5
+
+    #The dataset changed: of the 5 old entries only the MAX_ENTRIES most recently used stay
+    X, _, _, _ = feature_store.get_or_build(new_texts, tags + [["Drama"]], {}, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1 + feature_store.MAX_ENTRIES
+
+    #Entries of the current dataset are all kept, including the one just loaded (memory mapped) above
+    for max_features in range(1, 6):
+        feature_store.get_or_build(new_texts, tags + [["Drama"]], {"max_features": max_features}, cache_dir)
+    assert len(os.listdir(cache_dir)) == 6 + feature_store.MAX_ENTRIES
+    assert np.asarray(X.sum()) > 0